@@ -0,0 +1,54 @@
+"""
+Headless batch mode
+
+Run the cleaner stages and fingerprint calculation from a JSON
+configuration, without Streamlit:
+
+    python batch.py config.json [--stats stats.json]
+
+Run statistics are printed as JSON. Exit codes: 0 success, 1 failed
+run, 2 invalid configuration.
+"""
+
+
+import argparse
+import json
+import sys
+import traceback
+
+from csv_handler.core.batch import (EXIT_CONFIG, EXIT_FAILED, EXIT_OK,
+                                    ConfigError, load_config, run_pipeline)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dataset manager batch mode")
+    parser.add_argument("config", help="JSON pipeline configuration")
+    parser.add_argument("--stats", help="Write run statistics to this file")
+    args = parser.parse_args(argv)
+
+    stats = {}
+    try:
+        run_pipeline(load_config(args.config), stats)
+        code = EXIT_OK
+    except ConfigError as error:
+        stats.update(status="invalid_config", error=str(error))
+        code = EXIT_CONFIG
+    except Exception as error:
+        traceback.print_exc()
+        stats.update(status="failed", error=f"{type(error).__name__}: "
+                                            f"{error}")
+        code = EXIT_FAILED
+
+    stats["exit_code"] = code
+    output = json.dumps(stats, indent=2, default=str)
+    print(output)
+
+    if args.stats:
+        with open(args.stats, "w") as stats_file:
+            stats_file.write(output + "\n")
+
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
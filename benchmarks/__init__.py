@@ -0,0 +1,10 @@
+"""
+Processing stage benchmarks
+
+Run from the repository root:
+
+    python -m benchmarks.suite --sizes 1000 10000 --out results.json
+    python -m benchmarks.suite --compare results.json
+
+version: 1.0.0
+"""
@@ -0,0 +1,487 @@
+"""
+Benchmark suite
+
+Time and memory of each processing stage in isolation and of the
+batch pipeline end to end, on synthetic datasets of growing size:
+
+    python -m benchmarks.suite [--sizes 1000 10000] [--stages ...]
+                               [--repeat 3] [--out results.json]
+                               [--compare baseline.json] [--threshold 0.2]
+
+Every run happens in a new process. Memory is reported as the process
+peak and as the growth during the stage (rss_delta_mb), it is null
+without the resource module and /proc (Windows). Results are written
+as JSON. With --compare, stages slower or growing more than the
+baseline by more than the threshold are reported and the exit code
+is 1.
+
+version: 1.0.0
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    # Windows: no peak memory or child process CPU time
+    resource = None
+
+from .synthetic import dataset
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_STAGES = ["read_csv", "standardize", "filter_elements", "threshold",
+                  "duplicates", "rdkit_fingerprints", "sdf_index",
+                  "sdf_convert", "end_to_end"]
+DATA_DIR = "./benchmarks/data"
+
+# Exit codes of the command line
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+
+THRESHOLD_COLUMNS = ["Standard Value", "Standard Units", "Molecular Weight"]
+
+# Memory growth below this is allocator noise when comparing runs (MB)
+MEMORY_FLOOR_MB = 8.0
+
+
+class SkipStage(Exception):
+    pass
+
+
+def _load(csv_path):
+    from csv_handler.core.reader import CHEMBL_COLUMNS, read_csv_projected
+
+    return read_csv_projected(csv_path, ",", CHEMBL_COLUMNS)
+
+
+def _labelled(csv_path):
+    from csv_handler.core.utils import convert_threshold
+
+    return convert_threshold(_load(csv_path).dropna(), 10.0, "uM",
+                             THRESHOLD_COLUMNS)
+
+
+# Stage preparation: takes (csv_path, sdf_path, work_dir), loads the
+# stage input and returns the timed call, which returns the output rows
+
+def _read_csv(csv_path, sdf_path, work_dir):
+    return lambda: len(_load(csv_path))
+
+
+def _standardize(csv_path, sdf_path, work_dir):
+    from csv_handler.core.utils import standardize_smiles
+
+    smiles = _load(csv_path)["Smiles"].dropna()
+
+    return lambda: sum(value != "remove"
+                       for value in standardize_smiles(smiles))
+
+
+def _filter_elements(csv_path, sdf_path, work_dir):
+    from csv_handler.core.utils import filter_elements
+
+    smiles = _load(csv_path)["Smiles"].dropna()
+
+    return lambda: int(filter_elements(smiles).sum())
+
+
+def _threshold(csv_path, sdf_path, work_dir):
+    from csv_handler.core.utils import convert_threshold
+
+    dataframe = _load(csv_path).dropna()
+
+    return lambda: len(convert_threshold(dataframe, 10.0, "uM",
+                                         THRESHOLD_COLUMNS))
+
+
+def _duplicates(csv_path, sdf_path, work_dir):
+    from csv_handler.core.utils import process_duplicates
+
+    dataframe = _labelled(csv_path)
+
+    return lambda: len(process_duplicates(
+        dataframe, ["Smiles", "Activity", "Converted Value"]))
+
+
+def _rdkit_fingerprints(csv_path, sdf_path, work_dir):
+    from csv_handler.core.fingerprints import rdkit_fingerprints
+
+    smiles = _load(csv_path)["Smiles"].dropna()
+
+    return lambda: int(rdkit_fingerprints(smiles, "morgan2", 2048)[1].sum())
+
+
+def _sdf_index(csv_path, sdf_path, work_dir):
+    from sdf_handler.core.stream import sdf_index
+
+    return lambda: sdf_index(sdf_path, persist=False).n_records
+
+
+def _sdf_convert(csv_path, sdf_path, work_dir):
+    from sdf_handler.core.stream import SDFConverter
+
+    def run():
+        with open(sdf_path, "rb") as sdf_file:
+            converter = SDFConverter(sdf_file)
+            converter.to_csv(os.path.join(work_dir, "converted.csv"))
+
+        return converter.processed
+
+    return run
+
+
+def _padel(csv_path, sdf_path, work_dir):
+    from csv_handler.core.batch import PADEL_PATH
+    from csv_handler.core.padel import run_PaDEL
+
+    if shutil.which("java") is None:
+        raise SkipStage("java not found")
+
+    molecules = _load(csv_path)[["Smiles", "Molecule ChEMBL ID"]].dropna()
+    molecules.to_csv(work_dir + "/molecule.smi", sep="\t", header=False,
+                     index=False)
+
+    def run():
+        fp_path = run_PaDEL(PADEL_PATH, work_dir, "PubchemFingerprinter.xml",
+                            persistent=False)
+        with open(fp_path) as fp_file:
+            return sum(1 for _ in fp_file) - 1
+
+    return run
+
+
+def _end_to_end(csv_path, sdf_path, work_dir):
+    from csv_handler.core.batch import run_pipeline
+    from csv_handler.core.reader import CHEMBL_COLUMNS
+
+    config = {"input": csv_path, "columns": CHEMBL_COLUMNS,
+              "stages": [{"stage": "remove_nan"},
+                         {"stage": "standardize"},
+                         {"stage": "filter_elements"},
+                         {"stage": "threshold", "value": 10.0},
+                         {"stage": "duplicates"},
+                         {"stage": "shuffle", "seed": 0}],
+              "output": os.path.join(work_dir, "processed.csv"),
+              "fingerprint": {"engine": "RDKit", "type": "Morgan2 (ECFP4)",
+                              "output": os.path.join(work_dir,
+                                                     "fingerprint")}}
+
+    return lambda: run_pipeline(config)["rows_out"]
+
+
+STAGES = {"read_csv": _read_csv,
+          "standardize": _standardize,
+          "filter_elements": _filter_elements,
+          "threshold": _threshold,
+          "duplicates": _duplicates,
+          "rdkit_fingerprints": _rdkit_fingerprints,
+          "sdf_index": _sdf_index,
+          "sdf_convert": _sdf_convert,
+          "padel": _padel,
+          "end_to_end": _end_to_end}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS, None without
+    # the resource module
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+
+    return peak / 1024
+
+
+def _children_cpu_seconds():
+    # Child processes waited for (PaDEL, worker pools)
+    if resource is None:
+        return 0.0
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return children.ru_utime + children.ru_stime
+
+
+def _largest(values):
+    # Memory of several runs, None if unknown
+    values = list(values)
+    if None in values:
+        return None
+
+    return round(max(values), 1)
+
+
+def _status_mb(field: str):
+    # Linux only, None elsewhere
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def _reset_peak_rss():
+    # Linux: the peak (VmHWM) restarts from the current RSS, so the
+    # peak read after a stage excludes loading its input
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+
+    return _status_mb("VmHWM") is not None
+
+
+def _measure(stage: str, csv_path: str, sdf_path: str):
+    # Runs in a fresh process
+    work_dir = tempfile.mkdtemp()
+    try:
+        try:
+            run = STAGES[stage](csv_path, sdf_path, work_dir)
+        except SkipStage as reason:
+            return {"skipped": str(reason)}
+
+        stage_peak = _reset_peak_rss()
+        rss_before = _status_mb("VmRSS") if stage_peak else _peak_rss_mb()
+        start_cpu = time.process_time() + _children_cpu_seconds()
+        start = time.perf_counter()
+
+        rows_out = run()
+
+        seconds = time.perf_counter() - start
+        cpu_seconds = (time.process_time() + _children_cpu_seconds() -
+                       start_cpu)
+        peak = _peak_rss_mb()
+        rss_after = _status_mb("VmHWM") if stage_peak else peak
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    memory = {"peak_rss_mb": None, "rss_delta_mb": None}
+    if rss_before is not None and rss_after is not None:
+        memory = {"peak_rss_mb": max(peak or 0.0, rss_after),
+                  "rss_delta_mb": max(rss_after - rss_before, 0.0)}
+
+    return dict({"seconds": seconds, "cpu_seconds": cpu_seconds,
+                 "rows_out": int(rows_out)}, **memory)
+
+
+def run_benchmark(stage: str, n_rows: int, csv_path: str, sdf_path: str,
+                  repeat=3):
+    """Benchmark a stage, each run in a new process
+
+    Args:
+        stage (str): Stage name (see STAGES)
+        n_rows (int): Dataset size
+        csv_path (str): Dataset CSV path
+        sdf_path (str): Dataset SDF path
+        repeat (int, optional): Number of runs. Defaults to 3.
+
+    Returns:
+        dict: Stage result (best and median time, largest memory)
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=context) as executor:
+            measure = executor.submit(_measure, stage, csv_path, sdf_path)
+            runs.append(measure.result())
+
+        if "skipped" in runs[-1]:
+            return dict({"stage": stage, "rows": n_rows}, **runs[-1])
+
+    seconds = [run["seconds"] for run in runs]
+
+    return {"stage": stage, "rows": n_rows,
+            "rows_out": runs[-1]["rows_out"],
+            "seconds_min": round(min(seconds), 4),
+            "seconds_median": round(statistics.median(seconds), 4),
+            "cpu_seconds_median": round(statistics.median(
+                run["cpu_seconds"] for run in runs), 4),
+            "rows_per_second": round(n_rows / max(min(seconds), 1e-9), 1),
+            "peak_rss_mb": _largest(run["peak_rss_mb"] for run in runs),
+            "rss_delta_mb": _largest(run["rss_delta_mb"] for run in runs),
+            "runs": [round(value, 4) for value in seconds]}
+
+
+def _versions():
+    versions = {"python": platform.python_version()}
+    for package in ["pandas", "numpy", "pyarrow", "rdkit"]:
+        try:
+            versions[package] = __import__(package).__version__
+        except ImportError:
+            versions[package] = None
+
+    return versions
+
+
+def run_suite(sizes: list, stages: list, repeat=3, data_dir=DATA_DIR,
+              seed=0, log=None):
+    """Benchmark stages on synthetic datasets of each size
+
+    Args:
+        sizes (list): Dataset sizes (rows)
+        stages (list): Stage names (see STAGES)
+        repeat (int, optional): Runs per stage. Defaults to 3.
+        data_dir (str, optional): Dataset folder, datasets are reused.
+            Defaults to DATA_DIR.
+        seed (int, optional): Dataset seed. Defaults to 0.
+        log (function, optional): Called with each stage result.
+            Defaults to None.
+
+    Returns:
+        dict: Metadata and results
+    """
+    results = []
+
+    for n_rows in sizes:
+        csv_path, sdf_path = dataset(n_rows, data_dir, seed)
+
+        for stage in stages:
+            result = run_benchmark(stage, n_rows, csv_path, sdf_path,
+                                   repeat)
+            results.append(result)
+            if log is not None:
+                log(result)
+
+    return {"meta": {"date": datetime.now(timezone.utc).isoformat(),
+                     "platform": platform.platform(),
+                     "processor": platform.processor(),
+                     "cpu_count": os.cpu_count(),
+                     "versions": _versions(), "repeat": repeat,
+                     "seed": seed},
+            "results": results}
+
+
+def compare(results: dict, baseline: dict, threshold=0.2):
+    """Find stages slower or larger than a baseline
+
+    Memory is compared on the growth during the stage (rss_delta_mb),
+    the peak is dominated by the interpreter and library imports.
+
+    Args:
+        results (dict): Current suite output
+        baseline (dict): Baseline suite output
+        threshold (float, optional): Tolerated relative increase.
+            Defaults to 0.2.
+
+    Returns:
+        list: Comparison of each stage present in both, with a
+            "regression" flag
+    """
+    reference = {(result["stage"], result["rows"]): result
+                 for result in baseline["results"] if "skipped" not in result}
+    comparison = []
+
+    for result in results["results"]:
+        key = (result["stage"], result["rows"])
+        if "skipped" in result or key not in reference:
+            continue
+
+        old = reference[key]
+        time_ratio = (result["seconds_min"] /
+                      max(old["seconds_min"], 1e-9))
+        memory_ratio = 1.0
+        if (result["rss_delta_mb"] is not None and
+                old["rss_delta_mb"] is not None):
+            memory_ratio = (max(result["rss_delta_mb"], MEMORY_FLOOR_MB) /
+                            max(old["rss_delta_mb"], MEMORY_FLOOR_MB))
+
+        comparison.append({
+            "stage": result["stage"], "rows": result["rows"],
+            "seconds_min": result["seconds_min"],
+            "baseline_seconds_min": old["seconds_min"],
+            "time_ratio": round(time_ratio, 3),
+            "rss_delta_mb": result["rss_delta_mb"],
+            "baseline_rss_delta_mb": old["rss_delta_mb"],
+            "memory_ratio": round(memory_ratio, 3),
+            "regression": (time_ratio > 1 + threshold or
+                           memory_ratio > 1 + threshold)})
+
+    return comparison
+
+
+def _print_result(result):
+    if "skipped" in result:
+        print(f"{result['stage']:>20} {result['rows']:>9}  skipped: "
+              f"{result['skipped']}", file=sys.stderr)
+    elif result["peak_rss_mb"] is None:
+        print(f"{result['stage']:>20} {result['rows']:>9} "
+              f"{result['seconds_min']:>10.3f} s  memory unknown",
+              file=sys.stderr)
+    else:
+        print(f"{result['stage']:>20} {result['rows']:>9} "
+              f"{result['seconds_min']:>10.3f} s "
+              f"{result['peak_rss_mb']:>9.1f} MB "
+              f"{result['rss_delta_mb']:>+9.1f} MB", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dataset manager "
+                                                 "benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=DEFAULT_SIZES,
+                        help="Dataset sizes, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES,
+                        choices=list(STAGES), help="Stages to benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per stage")
+    parser.add_argument("--seed", type=int, default=0, help="Dataset seed")
+    parser.add_argument("--data-dir", default=DATA_DIR,
+                        help="Synthetic dataset folder")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Baseline results JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Tolerated relative increase over baseline")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.stages, args.repeat, args.data_dir,
+                        args.seed, log=_print_result)
+    code = EXIT_OK
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            comparison = compare(results, json.load(baseline_file),
+                                 args.threshold)
+        results["comparison"] = {"baseline": args.compare,
+                                 "threshold": args.threshold,
+                                 "stages": comparison}
+
+        for item in comparison:
+            if item["regression"]:
+                print(f"REGRESSION {item['stage']} ({item['rows']} rows): "
+                      f"time x{item['time_ratio']}, "
+                      f"memory x{item['memory_ratio']}", file=sys.stderr)
+                code = EXIT_REGRESSION
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as out_file:
+            out_file.write(output + "\n")
+    else:
+        print(output)
+
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Synthetic ChEMBL-like datasets
+
+version: 1.0.0
+"""
+
+
+import os
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem, RDLogger
+from rdkit.Chem import rdDepictor
+from rdkit.Geometry import Point3D
+
+EXAMPLE_PATH = "./csv_handler/core/files/cleaner_example_csv.csv"
+
+
+class _Analogs:
+    """Distinct analogs of the example molecules.
+
+    Analog k of a base molecule carries an alkyl chain on one of its
+    hydrogen-bearing atoms, so molecules stay distinct after
+    standardization. 2D coordinates are computed once per base molecule
+    and reused for its analogs.
+    """
+
+    def __init__(self, base_smiles):
+        self.base_smiles = base_smiles
+        self.templates = {}
+
+    def _template(self, index):
+        if index not in self.templates:
+            mol = Chem.MolFromSmiles(self.base_smiles[index])
+            candidates = []
+            if mol is not None:
+                rdDepictor.Compute2DCoords(mol)
+                candidates = [atom.GetIdx() for atom in mol.GetAtoms()
+                              if atom.GetTotalNumHs() > 0 and
+                              atom.GetSymbol() == "C"]
+            self.templates[index] = (mol, candidates)
+
+        return self.templates[index]
+
+    def get(self, index: int, variant: int):
+        """SMILES and mol block of an analog
+
+        Args:
+            index (int): Base molecule
+            variant (int): Analog number (0 is the base molecule)
+
+        Returns:
+            str: SMILES (None if the base molecule is invalid)
+            str: Mol block
+        """
+        mol, candidates = self._template(index)
+        if mol is None:
+            return None, None
+
+        if variant > 0 and candidates:
+            atom = candidates[(variant - 1) % len(candidates)]
+            length = 1 + (variant - 1) // len(candidates)
+
+            analog = Chem.RWMol(mol)
+            anchor = analog.GetAtomWithIdx(atom)
+            anchor.SetNumExplicitHs(max(0, anchor.GetNumExplicitHs() - 1))
+            conformer = analog.GetConformer()
+            origin = conformer.GetAtomPosition(atom)
+            previous = atom
+            for position in range(1, length + 1):
+                current = analog.AddAtom(Chem.Atom(6))
+                analog.AddBond(previous, current, Chem.BondType.SINGLE)
+                conformer.SetAtomPosition(current, Point3D(
+                    origin.x + 1.5 * position, origin.y + 0.5, 0.0))
+                previous = current
+
+            try:
+                Chem.SanitizeMol(analog)
+                mol = analog.GetMol()
+            except ValueError:
+                # Keep the base molecule, a rare extra replicate
+                pass
+
+        return Chem.MolToSmiles(mol), Chem.MolToMolBlock(mol)
+
+
+def _running_count(values):
+    # Occurrence number of each value among the previous ones
+    order = np.argsort(values, kind="stable")
+    starts = np.r_[0, np.flatnonzero(np.diff(values[order])) + 1]
+    lengths = np.diff(np.r_[starts, len(values)])
+
+    counts = np.empty(len(values), dtype=np.int64)
+    counts[order] = np.arange(len(values)) - np.repeat(starts, lengths)
+
+    return counts
+
+
+def synthetic_activities(n_rows: int, seed=0, duplicate_fraction=0.25,
+                         source=EXAMPLE_PATH, sdf_path=None):
+    """Generate an activity table with the cleaner example layout
+
+    Rows are resampled from the example file: units, organisms and
+    missing values follow its distribution, values are jittered and
+    molecules are made distinct analogs. A fraction of the rows are
+    replicate measurements of earlier molecules.
+
+    Args:
+        n_rows (int): Number of rows
+        seed (int, optional): Random seed. Defaults to 0.
+        duplicate_fraction (float, optional): Fraction of replicate rows.
+            Defaults to 0.25.
+        source (str, optional): Example file. Defaults to EXAMPLE_PATH.
+        sdf_path (str, optional): Also write the rows as SDF, grouped by
+            molecule. Defaults to None.
+
+    Returns:
+        DataFrame: Synthetic activities
+    """
+    base = pd.read_csv(source)
+    rng = np.random.default_rng(seed)
+    RDLogger.DisableLog("rdApp.*")
+
+    n_molecules = max(1, int(n_rows * (1 - duplicate_fraction)))
+    base_index = rng.integers(len(base), size=n_molecules)
+    variants = _running_count(base_index)
+
+    # Every molecule once, replicates drawn at random, then shuffled
+    molecule = np.r_[np.arange(n_molecules),
+                     rng.integers(n_molecules, size=n_rows - n_molecules)]
+    molecule = rng.permutation(molecule)
+    rows = base.iloc[base_index[molecule]].reset_index(drop=True)
+
+    dataframe = pd.DataFrame({
+        "Molecule ChEMBL ID": [f"CHEMBL{10 ** 7 + index}"
+                               for index in molecule],
+        "Molecular Weight": rows["Molecular Weight"],
+        "Smiles": None,
+        "Standard Value": (rows["Standard Value"] *
+                           rng.lognormal(0.0, 0.3, size=n_rows)).round(3),
+        "Standard Units": rows["Standard Units"],
+        "Assay Organism": rows["Assay Organism"]})
+
+    # Property lines of each row, missing values left out
+    properties = ["Molecular Weight", "Standard Value", "Standard Units",
+                  "Assay Organism"]
+    fields = [[f">  <{column}>\n{value}\n\n" if not pd.isna(value)
+               else "" for value in dataframe[column]]
+              for column in properties]
+    analogs = _Analogs(list(base["Smiles"]))
+    smiles = np.empty(n_rows, dtype=object)
+
+    # Rows of each molecule, one mol block in memory at a time
+    order = np.argsort(molecule, kind="stable")
+    bounds = np.searchsorted(molecule[order], np.arange(n_molecules + 1))
+
+    sdf_file = open(sdf_path, "w") if sdf_path else None
+    try:
+        for current in range(n_molecules):
+            positions = order[bounds[current]:bounds[current + 1]]
+            current_smiles, block = analogs.get(int(base_index[current]),
+                                                int(variants[current]))
+            smiles[positions] = (current_smiles if current_smiles else
+                                 base["Smiles"].iloc[base_index[current]])
+
+            if sdf_file is None or block is None:
+                continue
+
+            name = f"CHEMBL{10 ** 7 + current}"
+            record = name + block[block.index("\n"):]
+            for position in positions:
+                sdf_file.write(record + "".join(
+                    column[position] for column in fields) + "$$$$\n")
+    finally:
+        if sdf_file is not None:
+            sdf_file.close()
+
+    dataframe["Smiles"] = smiles
+
+    return dataframe
+
+
+def dataset(n_rows: int, data_dir: str, seed=0):
+    """Generate or reuse the CSV and SDF datasets of a size
+
+    Args:
+        n_rows (int): Number of rows
+        data_dir (str): Dataset folder
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        str: CSV path
+        str: SDF path
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    csv_path = os.path.join(data_dir, f"activities_{n_rows}_{seed}.csv")
+    sdf_path = os.path.join(data_dir, f"activities_{n_rows}_{seed}.sdf")
+
+    if not (os.path.exists(csv_path) and os.path.exists(sdf_path)):
+        dataframe = synthetic_activities(n_rows, seed, sdf_path=sdf_path)
+        dataframe.to_csv(csv_path, index=False)
+
+    return csv_path, sdf_path
@@ -0,0 +1,172 @@
+import java.io.BufferedReader;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.Map;
+import java.util.Set;
+
+import libpadeldescriptor.PaDELStandardize;
+import libpadeldescriptor.libPaDELDescriptorMaster;
+
+/**
+ * Long-lived PaDEL-Descriptor worker.
+ *
+ * Reads one request per line from stdin: PING, QUIT or PaDEL command
+ * line arguments separated by tabs. Answers READY on startup and PONG,
+ * OK or ERROR message on stdout. PaDEL's own output is redirected to
+ * stderr.
+ *
+ * Each request runs a new libPaDELDescriptorMaster configured as the
+ * PaDEL command line does, so the JVM, loaded classes and tautomer
+ * list are reused across requests without sharing run state.
+ *
+ * Shipped compiled (class file version 50) so no JDK is needed, rebuild
+ * with: javac --release 8 -cp "PaDEL-Descriptor.jar:lib/*" PaDELWorker.java
+ * Run with the classpath of the PaDEL jar manifest:
+ * java -cp PaDEL-Descriptor.jar:. PaDELWorker
+ */
+public class PaDELWorker {
+    // Options followed by a value, the others are flags
+    static final String[] VALUE_OPTIONS = {
+        "descriptortypes", "dir", "file", "threads", "waitingjobs",
+        "maxruntime", "maxcpdperfile"};
+
+    static final String[] FLAG_OPTIONS = {
+        "2d", "3d", "fingerprints", "removesalt", "detectaromaticity",
+        "standardizetautomers", "standardizenitro", "retain3d",
+        "convert3d", "log", "retainorder", "usefilenameasmolname"};
+
+    static String[] tautomers;
+
+    static void reply(PrintStream protocol, String message) {
+        protocol.println(message);
+        protocol.flush();
+    }
+
+    static boolean contains(String[] options, String option) {
+        for (int i = 0; i < options.length; i++) {
+            if (options[i].equals(option)) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    static int intValue(Map values, String option, int missing) {
+        String value = (String) values.get(option);
+        return value == null ? missing : Integer.parseInt(value);
+    }
+
+    /** Run PaDEL, returns null on success or an error message */
+    static String run(String[] args) throws Exception {
+        Map values = new HashMap();
+        Set flags = new HashSet();
+
+        for (int i = 0; i < args.length; i++) {
+            String option = args[i].startsWith("-")
+                    ? args[i].substring(1) : args[i];
+
+            if (contains(VALUE_OPTIONS, option) && i + 1 < args.length) {
+                values.put(option, args[++i]);
+            } else if (contains(FLAG_OPTIONS, option)) {
+                flags.add(option);
+            } else {
+                return "unknown option " + args[i];
+            }
+        }
+
+        // As PaDEL's command line without a configuration file, options
+        // not given are off
+        libPaDELDescriptorMaster master = new libPaDELDescriptorMaster(
+                (String) values.get("dir"), (String) values.get("file"),
+                flags.contains("2d"), flags.contains("3d"),
+                flags.contains("fingerprints"), flags.contains("removesalt"),
+                flags.contains("detectaromaticity"),
+                flags.contains("standardizetautomers"),
+                flags.contains("standardizenitro"),
+                flags.contains("retain3d"), flags.contains("convert3d"));
+
+        String error = master.CheckRequirements();
+        if (error != null && !error.isEmpty()) {
+            return error;
+        }
+
+        if (values.containsKey("descriptortypes")) {
+            master.SetDescriptorTypes((String) values.get("descriptortypes"));
+        } else {
+            master.SetDescriptorTypes(PaDELWorker.class.getClassLoader()
+                    .getResourceAsStream("META-INF/descriptors.xml"));
+        }
+
+        int threads = intValue(values, "threads", -1);
+        if (threads > 0) {
+            master.setMaxThreads(threads);
+        }
+        int waiting = intValue(values, "waitingjobs", -1);
+        if (waiting > 0) {
+            master.setMaxJobsWaiting(waiting);
+        }
+        if (values.containsKey("maxruntime")) {
+            master.setMaxRunTime(
+                    Long.parseLong((String) values.get("maxruntime")));
+        }
+        master.setMaxMolPerFile(intValue(values, "maxcpdperfile", 0));
+        master.setLogResults(flags.contains("log"));
+        master.setRetainOrder(flags.contains("retainorder"));
+        master.setUseFilenameAsMolName(
+                flags.contains("usefilenameasmolname"));
+        master.setTautomerList(tautomers);
+        master.setForcefield("mm2");
+
+        error = master.Initialize();
+        if (error != null && !error.isEmpty()) {
+            return error;
+        }
+
+        try {
+            while (master.HasWork()) {
+                master.DoWork();
+            }
+        } finally {
+            master.StopAllWorkers();
+        }
+
+        return null;
+    }
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = System.out;
+        System.setOut(System.err);
+
+        InputStream tautomerList = PaDELWorker.class.getClassLoader()
+                .getResourceAsStream("META-INF/tautomerlist.txt");
+        tautomers = PaDELStandardize.getTautomerList(tautomerList);
+
+        reply(protocol, "READY");
+
+        BufferedReader in = new BufferedReader(
+                new InputStreamReader(System.in));
+        String line;
+
+        while ((line = in.readLine()) != null) {
+            if (line.equals("PING")) {
+                reply(protocol, "PONG");
+                continue;
+            }
+            if (line.equals("QUIT")) {
+                break;
+            }
+
+            try {
+                String error = run(line.split("\t"));
+                reply(protocol, error == null ? "OK" : "ERROR " + error);
+            } catch (Throwable e) {
+                reply(protocol, "ERROR " + e);
+            }
+        }
+
+        Runtime.getRuntime().halt(0);
+    }
+}
@@ -1,22 +1,122 @@
+import os
+import shutil
+
+import pandas as pd
+import streamlit as st
+
 from .core.structure import Sidebar, MainStructure, IO, Fingerprint
+from .core.pipeline import checkpoint_columns, read_checkpoint
+from .core.fingerprints import FingerprintStore
+from .core.jobs import (get_runner, get_session_job, release_session_job,
+                        set_session_job)
+from .core.metrics import get_metrics_log, measure, run_summary
+from .core.workspace import get_workspace
+
+
+def _fingerprint_job(execute, stage, dataframe, selected_fp, options,
+                     workspace, progress=None):
+    # Runs as a background job, without any display. Files go to a
+    # directory of the session workspace, checked against its quota
+    data_path = workspace.mkdtemp("fingerprint-")
+
+    def _progress(done, total):
+        workspace.check_quota()
+        progress(done, total)
+
+    try:
+        with measure(stage, len(dataframe)) as record:
+            store_path, info = execute(dataframe, selected_fp, options,
+                                       _progress, data_path)
+            record.update(info,
+                          rows_out=FingerprintStore(store_path).shape[0],
+                          fingerprint=selected_fp[0])
+    except BaseException:
+        shutil.rmtree(data_path, ignore_errors=True)
+        raise
+
+    return store_path, info, record, selected_fp
+
+
+def _discard_result(keep_dir=None):
+    # Remove the displayed result and its files
+    result = st.session_state.pop("fingerprint_result", None)
+    if result is not None:
+        result_dir = os.path.dirname(os.path.abspath(result[0]))
+        if result_dir != keep_dir:
+            shutil.rmtree(result_dir, ignore_errors=True)
+
+
+def _select_input(source):
+    # A result is only displayed with the input it was calculated from
+    if source is None or st.session_state.get("fingerprint_input") == source:
+        return
+
+    st.session_state["fingerprint_input"] = source
+    _discard_result()
+
+
+def _collect(job):
+    release_session_job("fingerprint")
+
+    if job.status != "done":
+        st.warning(f"Fingerprint calculation {job.status}" +
+                   (f": {job.error}" if job.error else ""))
+        return
+
+    store_path, info, record, selected_fp = job.result
+    get_metrics_log().add(record)
+
+    # Results of a job resumed from another session are moved to this
+    # session workspace, the previous result is removed
+    workspace = get_workspace()
+    store_dir = os.path.dirname(os.path.abspath(store_path))
+    if os.path.dirname(store_dir) != workspace.path:
+        store_dir = shutil.move(store_dir, workspace.path)
+        store_path = os.path.join(store_dir, os.path.basename(store_path))
+
+    _discard_result(keep_dir=store_dir)
+
+    # Kept across reruns so the result can be paged
+    st.session_state["fingerprint_result"] = (store_path, selected_fp)
+
+    if "cache_hits" in info:
+        st.info(f"Cache hits: {info['cache_hits']} | "
+                f"Cache misses: {info['cache_misses']}")
+    if info.get("invalid"):
+        st.warning(f"Invalid SMILES: {info['invalid']} "
+                   f"(fingerprint set to zero)")
 
 
 def PaDEL_calc():
-    path = "./csv_handler/core/files/cleaner_dummy.csv"
+    path = get_workspace().file("cleaner_checkpoint.parquet")
+    example_path = path if os.path.exists(path) else None
     uploaded_file = None
     uploaded_file = Sidebar.sb_csv_uploader("Upload your CSV data",
                                             "Upload your input CSV file",
-                                            path)
+                                            example_path)
+
+    use_checkpoint = False
+    if example_path:
+        use_checkpoint = st.sidebar.checkbox("Use cleaner checkpoint")
 
-    if uploaded_file is None:
+    if uploaded_file is None and not use_checkpoint:
         MainStructure.awating_upload()
         execute_status = False
 
     else:
         execute_status = False
-        dataframe = IO.sb_csv_read_dataframe(uploaded_file)
-        columns = Fingerprint.fp_columns_selection(dataframe)
-        selected_fp, mol_nbr = Fingerprint.fp_selection(dataframe)
+        if use_checkpoint:
+            _select_input((path, os.stat(path).st_mtime_ns))
+            # Only the ID and SMILES columns are read
+            header = pd.DataFrame(columns=checkpoint_columns(path))
+            columns = Fingerprint.fp_columns_selection(header)
+            dataframe = read_checkpoint(path, columns)
+        else:
+            _select_input((uploaded_file.name, uploaded_file.size,
+                           getattr(uploaded_file, "id", None)))
+            dataframe = IO.sb_csv_read_dataframe(uploaded_file)
+            columns = Fingerprint.fp_columns_selection(dataframe)
+        selected_fp, mol_nbr, options = Fingerprint.fp_selection(dataframe)
 
         dataframe = MainStructure.data_selection_preview(dataframe, mol_nbr,
                                                          columns)
@@ -24,5 +124,28 @@ def PaDEL_calc():
 
     if execute_status:
         execute_status = False
-        fingerprint = Fingerprint.execute_PaDEL(dataframe, selected_fp)
-        Fingerprint.display_fingerprints(fingerprint, selected_fp)
+        if options["engine"] == "RDKit":
+            stage, execute = "rdkit_fingerprints", Fingerprint.execute_rdkit
+        else:
+            stage, execute = "padel", Fingerprint.execute_PaDEL
+        job = get_runner().submit(f"{options['engine']} fingerprints",
+                                  _fingerprint_job, execute, stage,
+                                  dataframe, selected_fp, options,
+                                  get_workspace(), total=len(dataframe))
+        set_session_job("fingerprint", job)
+
+    Sidebar.sb_resume_job("fingerprint")
+    job = get_session_job("fingerprint")
+    if job is not None and job.finished:
+        _collect(job)
+    elif job is not None:
+        st.info("Fingerprints are calculated in the background, see the "
+                "sidebar for progress. Note the job ID to collect the "
+                "result after a page reload.")
+
+    if "fingerprint_result" in st.session_state:
+        Fingerprint.display_fingerprints(
+            *st.session_state["fingerprint_result"])
+    run_summary(get_metrics_log(), "fingerprint_summary")
+
+    Sidebar.sb_jobs()
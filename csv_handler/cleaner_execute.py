@@ -1,35 +1,49 @@
-import pandas as pd
+import os
+
 import streamlit as st
 
 from .core.structure import Sidebar, MainStructure, IO
 from .core.process import Remover, Calc, Utils, Standardize
+from .core.pipeline import get_pipeline, set_pipeline
+from .core.metrics import get_metrics_log, run_summary
+from .core.workspace import QuotaExceeded, get_workspace
 
 
-@st.cache
 def _init_():
-    path = "./csv_handler/core/files/cleaner_dummy.csv"
-    sep = ","
-    st.session_state['status'] = False
+    # Checkpoints are kept in the session workspace
+    path = get_workspace().file("cleaner_checkpoint.parquet")
+
+    return path
+
 
-    return path, sep
+def _process(pipeline):
 
+    _ = Remover.remove_nan(pipeline)
+    _ = Remover.remove_outlier(pipeline)
+    _ = Standardize.standardize_smiles(pipeline)
+    _ = Remover.filter_elements(pipeline)
+    _ = Remover.select_strains(pipeline)
+    _ = Calc.select_threshold(pipeline)
+    _ = Calc.check_duplicates_simple(pipeline)
+    _ = Calc.check_duplicates(pipeline)
+    _ = Utils.shuffle_rows(pipeline)
 
-def _process(path, sep):
 
-    _ = Remover.remove_nan(path, sep)
-    _ = Remover.remove_outlier(path, sep)
-    _ = Standardize.standardize_smiles(path, sep)
-    _ = Remover.filter_elements(path, sep)
-    _ = Remover.select_strains(path, sep)
-    _ = Calc.select_threshold(path, sep)
-    _ = Calc.check_duplicates_simple(path, sep)
-    _ = Calc.check_duplicates(path, sep)
-    _ = Utils.shuffle_rows(path, sep)
+def _checkpoint(pipeline):
+    with st.sidebar.header("Checkpoint"):
+        if st.sidebar.button("Save checkpoint"):
+            try:
+                get_workspace().check_quota()
+                path = pipeline.checkpoint()
+                st.sidebar.success(f"Checkpoint saved: "
+                                   f"{os.path.basename(path)}")
+            except QuotaExceeded as error:
+                st.sidebar.error(str(error))
 
 
 def cleaner():
     example_path = "./csv_handler/core/files/cleaner_example_csv.csv"
-    path, sep = _init_()
+    path = _init_()
     uploaded_file = None
     uploaded_file = Sidebar.sb_csv_uploader("Upload CSV data",
                                             "Upload input CSV file",
@@ -39,23 +53,35 @@ def cleaner():
         st.session_state['status'] = False
 
     if uploaded_file and not st.session_state['status']:
-        uploaded = IO.sb_csv_read_dataframe(uploaded_file)
+        # Every column is kept by default, later stages may use columns
+        # outside the ChEMBL export (e.g. Labels)
+        uploaded, _, _ = IO.sb_csv_read_selection(uploaded_file)
         if st.sidebar.button("Go!"):
-            uploaded.to_csv(path, index=False, sep=sep)
+            set_pipeline(uploaded, path)
+            get_metrics_log().clear()
             st.session_state['status'] = True
 
-    if uploaded_file and st.session_state['status']:
+    pipeline = get_pipeline()
+
+    if uploaded_file and st.session_state['status'] and pipeline:
         st.subheader('Data preview')
         matrix = st.empty()
         info = st.empty()
 
-        _process(path, sep)
+        _process(pipeline)
+        _checkpoint(pipeline)
 
-        dataframe = pd.read_csv(path, delimiter=sep)
-        matrix.dataframe(dataframe)
+        dataframe = pipeline.dataframe
+        with matrix.container():
+            MainStructure.paged_dataframe(dataframe, "cleaner_preview",
+                                          version=pipeline.version)
         info.info(f"Dataset shape: {dataframe.shape}")
+        run_summary(get_metrics_log(), "cleaner_summary")
 
-        MainStructure.download_button(dataframe, name="processed_dataframe")
+        MainStructure.export_button(dataframe, "processed_dataframe",
+                                    "cleaner", version=pipeline.version)
 
     else:
         MainStructure.awating_upload()
+
+    Sidebar.sb_jobs()
@@ -0,0 +1,538 @@
+"""
+Headless pipeline execution
+
+version: 1.0.0
+"""
+
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from .cache import SmilesCache
+from .chunked import (MEMORY_BUDGET_MB, ROW_COLUMN, chunk_rows,
+                      choose_execution, estimate_dataset, map_chunks,
+                      process_duplicates_chunked, remove_outliers_chunked,
+                      shuffle_chunked, spill_csv)
+from .export import EXPORT_FORMATS, export_chunks, export_dataframe
+from .metrics import MetricsLog
+from .fingerprints import (RDKIT_FINGERPRINTS, bit_columns,
+                           csv_to_fingerprints, merge_fingerprints,
+                           rdkit_fingerprints, save_fingerprints)
+from .padel import PADEL_FINGERPRINTS, cached_run_PaDEL, run_PaDEL
+from .reader import read_csv_projected
+from .utils import (AGGREGATE_POLICIES, DEFAULT_ELEMENTS, DUPLICATE_POLICIES,
+                    OUTPUT_UNITS, STANDARDIZER_VERSION,
+                    cached_standardize_smiles,
+                    convert_threshold, filter_elements, filter_organisms,
+                    process_duplicates, remove_invalid_smiles,
+                    remove_outliers, shuffle_rows, standardize_smiles)
+
+# Exit codes of the command line
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_CONFIG = 2
+
+PADEL_PATH = "./csv_handler/PaDEL-Descriptor"
+
+EXECUTION_MODES = ["auto", "memory", "chunked"]
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _remove_nan(dataframe, options):
+    return dataframe.dropna(), {}
+
+
+def _remove_outliers(dataframe, options):
+    return remove_outliers(dataframe, options.get("column", "Labels"),
+                           options.get("lower", 0.1),
+                           options.get("upper", 0.9)), {}
+
+
+def _standardize(dataframe, options):
+    column = options.get("column", "Smiles")
+    kwargs = {"n_jobs": options.get("n_jobs", 1),
+              "timeout": options.get("timeout", None)}
+    info = {}
+
+    if options.get("cache"):
+        with SmilesCache(options["cache"], STANDARDIZER_VERSION) as cache:
+            std_list = cached_standardize_smiles(dataframe[column], cache,
+                                                 **kwargs)
+        info = {"cache_hits": cache.hits, "cache_misses": cache.misses}
+    else:
+        std_list = standardize_smiles(dataframe[column], **kwargs)
+
+    dataframe = dataframe.copy()
+    dataframe[column] = std_list
+
+    return remove_invalid_smiles(dataframe, column), info
+
+
+def _filter_elements(dataframe, options):
+    flags = filter_elements(dataframe[options.get("column", "Smiles")],
+                            options.get("allowed", DEFAULT_ELEMENTS),
+                            n_jobs=options.get("n_jobs", 1))
+
+    return dataframe[flags], {}
+
+
+def _filter_organisms(dataframe, options):
+    return filter_organisms(dataframe,
+                            options.get("column", "Assay Organism"),
+                            options["organisms"]), {}
+
+
+def _threshold(dataframe, options):
+    columns = options.get("columns", ["Standard Value", "Standard Units",
+                                      "Molecular Weight"])
+
+    return convert_threshold(dataframe, float(options["value"]),
+                             options.get("unit", "uM"), columns), {}
+
+
+def _duplicates_simple(dataframe, options):
+    return process_duplicates(dataframe,
+                              [options.get("column", "Smiles")]), {}
+
+
+def _duplicates(dataframe, options):
+    columns = options.get("columns", ["Smiles", "Activity",
+                                      "Converted Value"])
+
+    return process_duplicates(dataframe, columns,
+                              options.get("policy", "max"),
+                              options.get("drop_conflicts", True)), {}
+
+
+def _shuffle(dataframe, options):
+    return shuffle_rows(dataframe, options.get("seed", None)), {}
+
+
+# Stage name: (function, required options)
+STAGES = {"remove_nan": (_remove_nan, ()),
+          "remove_outliers": (_remove_outliers, ()),
+          "standardize": (_standardize, ()),
+          "filter_elements": (_filter_elements, ()),
+          "filter_organisms": (_filter_organisms, ("organisms",)),
+          "threshold": (_threshold, ("value",)),
+          "duplicates_simple": (_duplicates_simple, ()),
+          "duplicates": (_duplicates, ()),
+          "shuffle": (_shuffle, ())}
+
+
+def load_config(path: str):
+    """Load a JSON pipeline configuration
+
+    Args:
+        path (str): Configuration path
+
+    Returns:
+        dict: Validated configuration
+    """
+    try:
+        with open(path) as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError) as error:
+        raise ConfigError(f"Cannot read configuration: {error}")
+
+    validate_config(config)
+
+    return config
+
+
+def validate_config(config: dict):
+    """Check a pipeline configuration, raising ConfigError
+
+    Args:
+        config (dict): Configuration
+    """
+    if not isinstance(config, dict):
+        raise ConfigError("Configuration must be a JSON object")
+
+    if "input" not in config:
+        raise ConfigError("Missing 'input'")
+    if not os.path.exists(config["input"]):
+        raise ConfigError(f"Input not found: {config['input']}")
+
+    if config.get("output_format", "CSV") not in EXPORT_FORMATS:
+        raise ConfigError(f"Unknown output format: "
+                          f"{config['output_format']}")
+
+    if config.get("execution", "auto") not in EXECUTION_MODES:
+        raise ConfigError(f"Unknown execution mode: {config['execution']!r}")
+    budget = config.get("memory_budget_mb", MEMORY_BUDGET_MB)
+    if not isinstance(budget, (int, float)) or budget <= 0:
+        raise ConfigError(f"Invalid memory budget: {budget!r}")
+
+    stages = config.get("stages", [])
+    if not isinstance(stages, list):
+        raise ConfigError("'stages' must be a list")
+
+    for index, stage in enumerate(stages):
+        if not isinstance(stage, dict):
+            raise ConfigError(f"Stage {index}: must be a JSON object")
+
+        name = stage.get("stage")
+        if name not in STAGES:
+            raise ConfigError(f"Stage {index}: unknown stage {name!r}")
+
+        for option in STAGES[name][1]:
+            if option not in stage:
+                raise ConfigError(f"Stage {index} ({name}): "
+                                  f"missing '{option}'")
+
+        unit = stage.get("unit", "uM")
+        if name == "threshold" and unit not in OUTPUT_UNITS:
+            raise ConfigError(f"Stage {index}: unknown unit {unit!r}")
+        policy = stage.get("policy", "max")
+        if name == "duplicates" and policy not in DUPLICATE_POLICIES.values():
+            raise ConfigError(f"Stage {index}: unknown policy {policy!r}")
+        if (name == "duplicates" and policy in AGGREGATE_POLICIES
+                and not stage.get("drop_conflicts", True)):
+            raise ConfigError(f"Stage {index}: policy {policy!r} requires "
+                              f"drop_conflicts")
+
+    fingerprint = config.get("fingerprint")
+    if fingerprint:
+        if not isinstance(fingerprint, dict):
+            raise ConfigError("'fingerprint' must be a JSON object")
+
+        engines = {"RDKit": RDKIT_FINGERPRINTS,
+                   "PaDEL": PADEL_FINGERPRINTS}
+        engine = fingerprint.get("engine", "RDKit")
+
+        if engine not in engines:
+            raise ConfigError(f"Unknown fingerprint engine: {engine!r}")
+        if fingerprint.get("type") not in engines[engine]:
+            raise ConfigError(f"Unknown {engine} fingerprint: "
+                              f"{fingerprint.get('type')!r}")
+        if "output" not in fingerprint:
+            raise ConfigError("Missing fingerprint 'output'")
+
+
+def run_stages(dataframe, stages: list, stats=None, log=None):
+    """Run cleaner stages in order
+
+    Args:
+        dataframe (DataFrame): Input dataframe
+        stages (list): Stage configurations ({"stage": name, ...})
+        stats (list, optional): Filled with the statistics of each
+            completed stage. Defaults to None.
+        log (MetricsLog, optional): Metrics log receiving each stage.
+            Defaults to a log without export files.
+
+    Returns:
+        DataFrame: Processed dataframe
+    """
+    stats = [] if stats is None else stats
+    log = MetricsLog(None, None) if log is None else log
+
+    for stage in stages:
+        function, _ = STAGES[stage["stage"]]
+
+        with log.measure(stage["stage"], len(dataframe)) as record:
+            dataframe, info = function(dataframe, stage)
+            record.update(info, rows_out=len(dataframe))
+
+        stats.append(log.records[-1])
+
+    return dataframe
+
+
+def _chunked_stage(table, stage: dict, directory: str, budget_mb):
+    # Global stages spill to disk, row-local stages run part by part
+    name = stage["stage"]
+
+    if name == "remove_outliers":
+        return remove_outliers_chunked(table, directory,
+                                       stage.get("column", "Labels"),
+                                       stage.get("lower", 0.1),
+                                       stage.get("upper", 0.9)), {}
+    if name == "duplicates_simple":
+        return process_duplicates_chunked(
+            table, directory, [stage.get("column", "Smiles")],
+            budget_mb=budget_mb), {}
+    if name == "duplicates":
+        columns = stage.get("columns", ["Smiles", "Activity",
+                                        "Converted Value"])
+        return process_duplicates_chunked(
+            table, directory, columns, stage.get("policy", "max"),
+            stage.get("drop_conflicts", True), budget_mb), {}
+    if name == "shuffle":
+        return shuffle_chunked(table, directory, stage.get("seed", None),
+                               budget_mb), {}
+
+    function, _ = STAGES[name]
+    info = {}
+
+    def _apply(chunk):
+        chunk, chunk_info = function(chunk, stage)
+        for key, value in chunk_info.items():
+            info[key] = info.get(key, 0) + value
+        return chunk
+
+    return map_chunks(table, _apply, directory), info
+
+
+def run_stages_chunked(table, stages: list, work_dir: str,
+                       budget_mb=MEMORY_BUDGET_MB, stats=None, log=None):
+    """Run cleaner stages in order on a dataset spilled to disk
+
+    Each stage writes a new table in work_dir and removes its input, so
+    one chunk (or one bucket of a global stage) is in memory at a time.
+
+    Args:
+        table (SpillTable): Input table
+        stages (list): Stage configurations ({"stage": name, ...})
+        work_dir (str): Directory of intermediate tables
+        budget_mb (float, optional): Memory budget (MB).
+            Defaults to MEMORY_BUDGET_MB.
+        stats (list, optional): Filled with the statistics of each
+            completed stage. Defaults to None.
+        log (MetricsLog, optional): Metrics log receiving each stage.
+            Defaults to a log without export files.
+
+    Returns:
+        SpillTable: Processed table
+    """
+    stats = [] if stats is None else stats
+    log = MetricsLog(None, None) if log is None else log
+
+    for index, stage in enumerate(stages):
+        directory = os.path.join(work_dir, f"stage-{index:03d}")
+
+        with log.measure(stage["stage"], table.n_rows) as record:
+            output, info = _chunked_stage(table, stage, directory,
+                                          budget_mb)
+            table.remove()
+            table = output
+            record.update(info, rows_out=table.n_rows)
+
+        stats.append(log.records[-1])
+
+    return table
+
+
+def run_fingerprints(dataframe, config: dict, log=None):
+    """Compute fingerprints into the binary fingerprint format
+
+    Args:
+        dataframe (DataFrame): Dataframe
+        config (dict): Fingerprint configuration
+        log (MetricsLog, optional): Metrics log receiving the fingerprint
+            stage. Defaults to a log without export files.
+
+    Returns:
+        dict: Fingerprint statistics
+    """
+    log = MetricsLog(None, None) if log is None else log
+    stage = "rdkit_fingerprints" if config.get(
+        "engine", "RDKit") == "RDKit" else "padel"
+
+    with log.measure(stage, len(dataframe)) as record:
+        stats = _fingerprints(dataframe, config)
+        record["rows_out"] = stats["molecules"]
+
+    return dict(stats, **{key: log.records[-1][key] for key in
+                          ["seconds", "cpu_seconds", "peak_rss_mb"]})
+
+
+def run_fingerprints_chunked(table, config: dict, directory: str, log=None):
+    """Compute fingerprints part by part into the binary fingerprint format
+
+    Each part of the table is fingerprinted into its own store in
+    `directory`, the stores are then merged, so only one part of the
+    molecules is in memory at a time.
+
+    Args:
+        table (SpillTable): Table with the identifier and Smiles columns
+        config (dict): Fingerprint configuration
+        directory (str): Directory of the part stores
+        log (MetricsLog, optional): Metrics log receiving the fingerprint
+            stage. Defaults to a log without export files.
+
+    Returns:
+        dict: Fingerprint statistics
+    """
+    columns = list(config.get("columns", ["Molecule ChEMBL ID",
+                                          "Smiles"])[:2])
+    if not table.parts:
+        return run_fingerprints(pd.DataFrame(columns=columns), config, log)
+
+    log = MetricsLog(None, None) if log is None else log
+    stage = "rdkit_fingerprints" if config.get(
+        "engine", "RDKit") == "RDKit" else "padel"
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    with log.measure(stage, table.n_rows) as record:
+        for index, chunk in enumerate(table.chunks(columns)):
+            paths.append(os.path.join(directory, f"part{index:05d}"))
+            part_stats = _fingerprints(chunk, dict(config,
+                                                   output=paths[-1]))
+
+            if index == 0:
+                stats = part_stats
+                continue
+            for key in ["molecules", "invalid", "cache_hits",
+                        "cache_misses"]:
+                if key in part_stats:
+                    stats[key] += part_stats[key]
+
+        merge_fingerprints(paths, config["output"])
+        stats["output"] = config["output"]
+        record["rows_out"] = stats["molecules"]
+
+    return dict(stats, **{key: log.records[-1][key] for key in
+                          ["seconds", "cpu_seconds", "peak_rss_mb"]})
+
+
+def _fingerprints(dataframe, config: dict):
+    engine = config.get("engine", "RDKit")
+    id_column, smiles_column = config.get("columns",
+                                          ["Molecule ChEMBL ID", "Smiles"])
+    molecules = dataframe[[id_column, smiles_column]]
+    out_path = config["output"]
+    stats = {"engine": engine, "type": config["type"],
+             "molecules": len(molecules), "output": out_path}
+
+    if engine == "RDKit":
+        fingerprint, n_bits = RDKIT_FINGERPRINTS[config["type"]]
+        matrix, valid = rdkit_fingerprints(molecules[smiles_column],
+                                           fingerprint, n_bits,
+                                           config.get("n_jobs", 1))
+        save_fingerprints(out_path, molecules[id_column], matrix,
+                          bit_columns(f"{fingerprint}_", n_bits))
+        stats["invalid"] = int((~valid).sum())
+
+    else:
+        selected_fp = PADEL_FINGERPRINTS[config["type"]]
+        padel_path = config.get("padel_path", PADEL_PATH)
+        data_path = tempfile.mkdtemp()
+
+        try:
+            if config.get("cache"):
+                fp_path, hits, misses = cached_run_PaDEL(
+                    molecules, padel_path, data_path, selected_fp,
+                    config["cache"], config.get("sharded", False))
+                stats.update(cache_hits=hits, cache_misses=misses)
+            else:
+                molecules[molecules.columns[::-1]].to_csv(
+                    data_path + "/molecule.smi", sep="\t", header=False,
+                    index=False)
+                fp_path = run_PaDEL(padel_path, data_path, selected_fp,
+                                    sharded=config.get("sharded", False))
+
+            csv_to_fingerprints(fp_path, out_path,
+                                counts="Count" in selected_fp)
+        finally:
+            shutil.rmtree(data_path, ignore_errors=True)
+
+    return stats
+
+
+def run_pipeline(config: dict, stats=None):
+    """Run a full pipeline: read, clean, write and fingerprint
+
+    Args:
+        config (dict): Configuration (see `validate_config`). Stage
+            metrics are appended to config["metrics"]["jsonl"] and written
+            to config["metrics"]["prometheus"] when given.
+            config["execution"] selects in-memory or chunked execution,
+            "auto" (default) chooses from the estimated dataset size and
+            config["memory_budget_mb"].
+        stats (dict, optional): Filled with run statistics, also on
+            failure. Defaults to None.
+
+    Returns:
+        dict: Run statistics
+    """
+    validate_config(config)
+    stats = {} if stats is None else stats
+    stats.update(status="running", input=config["input"], stages=[])
+    start = time.perf_counter()
+    metrics = config.get("metrics", {})
+    log = MetricsLog(metrics.get("jsonl"), metrics.get("prometheus"))
+
+    delimiter = config.get("delimiter", ",")
+    columns = config.get("columns", None)
+    budget = config.get("memory_budget_mb", MEMORY_BUDGET_MB)
+    execution = config.get("execution", "auto")
+    if execution != "memory":
+        n_rows, n_bytes = estimate_dataset(config["input"], delimiter,
+                                           columns)
+        stats["estimated_mb"] = round(n_bytes / 2 ** 20, 1)
+    if execution == "auto":
+        execution = choose_execution(n_bytes, budget)
+    stats["execution"] = execution
+
+    if execution == "chunked":
+        work_dir = tempfile.mkdtemp(dir=config.get("work_dir", None))
+        try:
+            _run_chunked(config, stats, log, work_dir,
+                         chunk_rows(n_rows, n_bytes, budget))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        _run_memory(config, stats, log)
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["status"] = "ok"
+
+    return stats
+
+
+def _run_memory(config: dict, stats: dict, log):
+    dataframe = read_csv_projected(config["input"],
+                                   config.get("delimiter", ","),
+                                   config.get("columns", None),
+                                   config.get("filters", None))
+    stats["rows_in"] = len(dataframe)
+
+    dataframe = run_stages(dataframe, config.get("stages", []),
+                           stats["stages"], log)
+    stats["rows_out"] = len(dataframe)
+
+    if config.get("output"):
+        export_dataframe(dataframe, config["output"],
+                         config.get("output_format", "CSV"))
+        stats["output"] = config["output"]
+
+    if config.get("fingerprint"):
+        stats["fingerprint"] = run_fingerprints(dataframe,
+                                                config["fingerprint"], log)
+
+
+def _run_chunked(config: dict, stats: dict, log, work_dir: str,
+                 chunksize: int):
+    budget = config.get("memory_budget_mb", MEMORY_BUDGET_MB)
+    stats["chunk_rows"] = chunksize
+
+    table = spill_csv(config["input"], os.path.join(work_dir, "input"),
+                      config.get("delimiter", ","),
+                      config.get("columns", None),
+                      config.get("filters", None), chunksize)
+    stats["rows_in"] = table.n_rows
+
+    table = run_stages_chunked(table, config.get("stages", []), work_dir,
+                               budget, stats["stages"], log)
+    stats["rows_out"] = table.n_rows
+
+    if config.get("output"):
+        export_chunks((chunk.drop(columns=ROW_COLUMN)
+                       for chunk in table.chunks()), config["output"],
+                      config.get("output_format", "CSV"))
+        stats["output"] = config["output"]
+
+    if config.get("fingerprint"):
+        stats["fingerprint"] = run_fingerprints_chunked(
+            table, config["fingerprint"],
+            os.path.join(work_dir, "fingerprints"), log)
@@ -0,0 +1,185 @@
+"""
+Persistent SQLite caches
+
+version: 1.1.0
+"""
+
+
+import sqlite3
+import time
+
+
+def _batches(seq, size=900):
+    # SQLite limits the number of bound parameters per statement
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+class SQLiteCache:
+    """Key/value table with least recently used eviction.
+
+    Subclasses set `table` and `scope_columns`, the columns fixing the
+    context of the cached values (e.g. the software version). Keys are
+    only looked up inside the current scope.
+    """
+
+    table = None
+    scope_columns = ()
+
+    def __init__(self, path: str, scope: tuple, max_entries=1000000):
+        self.path = path
+        self.scope = tuple(scope)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        scope_schema = "".join(f"{column} TEXT NOT NULL, "
+                               for column in self.scope_columns)
+        scope_key = "".join(f"{column}, " for column in self.scope_columns)
+        self._scope_where = "".join(f"{column} = ? AND "
+                                    for column in self.scope_columns)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                                    {scope_schema}
+                                    key TEXT NOT NULL,
+                                    value TEXT NOT NULL,
+                                    accessed REAL NOT NULL,
+                                    PRIMARY KEY ({scope_key}key))""")
+        self.connection.execute(f"""CREATE INDEX IF NOT EXISTS
+                                    {self.table}_accessed
+                                    ON {self.table} (accessed)""")
+        self.connection.commit()
+
+    def get_many(self, keys: list):
+        """Get cached values
+
+        Args:
+            keys (list): Keys to look up
+
+        Returns:
+            dict: Cached entries {key: value}
+        """
+        unique = list(set(keys))
+        found = {}
+
+        for batch in _batches(unique):
+            marks = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                f"SELECT key, value FROM {self.table} "
+                f"WHERE {self._scope_where}key IN ({marks})",
+                list(self.scope) + batch)
+            found.update(rows)
+
+        now = time.time()
+        for batch in _batches(list(found)):
+            marks = ",".join("?" * len(batch))
+            self.connection.execute(
+                f"UPDATE {self.table} SET accessed = ? "
+                f"WHERE {self._scope_where}key IN ({marks})",
+                [now] + list(self.scope) + batch)
+        self.connection.commit()
+
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+
+        return found
+
+    def set_many(self, entries: dict):
+        """Store values
+
+        Args:
+            entries (dict): {key: value}
+        """
+        now = time.time()
+        marks = ",".join("?" * (len(self.scope) + 3))
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {self.table} VALUES ({marks})",
+            (self.scope + (key, value, now)
+             for key, value in entries.items()))
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries above `max_entries`"""
+        count, = self.connection.execute(
+            f"SELECT COUNT(*) FROM {self.table}").fetchone()
+
+        if count > self.max_entries:
+            self.connection.execute(
+                f"""DELETE FROM {self.table} WHERE rowid IN (
+                    SELECT rowid FROM {self.table}
+                    ORDER BY accessed LIMIT ?)""",
+                (count - self.max_entries,))
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SmilesCache(SQLiteCache):
+    """Map input SMILES to standardized SMILES across runs.
+
+    Entries are keyed by (version, SMILES) so a new standardizer release
+    never serves stale results.
+    """
+
+    table = "standardized_smiles"
+    scope_columns = ("version",)
+
+    def __init__(self, path: str, version: str, max_entries=1000000):
+        super().__init__(path, (version,), max_entries)
+
+
+class FingerprintCache(SQLiteCache):
+    """Map canonical SMILES to fingerprint values across runs.
+
+    Entries are keyed by (fingerprint file, PaDEL options, canonical
+    SMILES), values are the comma separated fingerprint values. The
+    fingerprint column names are stored once per scope.
+    """
+
+    table = "fingerprints"
+    scope_columns = ("fingerprint", "options")
+
+    def __init__(self, path: str, fingerprint: str, options: str,
+                 max_entries=1000000):
+        super().__init__(path, (fingerprint, options), max_entries)
+
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS
+                                   fingerprint_columns (
+                                   fingerprint TEXT NOT NULL,
+                                   options TEXT NOT NULL,
+                                   columns TEXT NOT NULL,
+                                   PRIMARY KEY (fingerprint, options))""")
+        self.connection.commit()
+
+    def get_columns(self):
+        """Get fingerprint column names
+
+        Returns:
+            list: Column names (None if unknown)
+        """
+        row = self.connection.execute(
+            """SELECT columns FROM fingerprint_columns
+               WHERE fingerprint = ? AND options = ?""",
+            self.scope).fetchone()
+
+        return row[0].split(",") if row else None
+
+    def set_columns(self, columns: list):
+        """Store fingerprint column names
+
+        Args:
+            columns (list): Column names
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO fingerprint_columns VALUES (?, ?, ?)",
+            self.scope + (",".join(columns),))
+        self.connection.commit()
@@ -0,0 +1,501 @@
+"""
+Out-of-core pipeline execution
+
+version: 1.0.0
+"""
+
+
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .pipeline import read_checkpoint, write_checkpoint
+from .reader import read_csv_chunks
+from .utils import AGGREGATE_POLICIES, process_duplicates
+
+# Memory given to a pipeline run (MB)
+MEMORY_BUDGET_MB = 1024
+
+# Peak memory of a stage relative to the size of its input (copies,
+# masks, group-by tables)
+MEMORY_OVERHEAD = 4
+
+MIN_CHUNK_ROWS = 1000
+MAX_CHUNK_ROWS = 1000000
+
+# Rows parsed to estimate the size of a dataset
+ESTIMATE_ROWS = 10000
+
+# Input position of each row, kept while the dataset is on disk
+ROW_COLUMN = "__row"
+
+# Bits of the value sort keys resolved per pass when selecting quantiles
+RADIX_BITS = 16
+
+
+def estimate_dataset(path: str, delimiter=",", columns=None):
+    """Estimate the number of rows and the in-memory size of a CSV file
+
+    The first ESTIMATE_ROWS rows are parsed, their size is extrapolated
+    to the whole file from its size on disk. Row filters are not
+    applied, the estimate is the size before filtering. Records are
+    assumed to take one line each: quoted fields spanning several lines
+    skew the row count.
+
+    Args:
+        path (str): CSV path
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+
+    Returns:
+        int: Estimated number of rows
+        int: Estimated size in memory (bytes)
+    """
+    sample = pd.read_csv(path, delimiter=delimiter, usecols=columns,
+                         nrows=ESTIMATE_ROWS)
+    sample_bytes = int(sample.memory_usage(deep=True).sum())
+
+    if len(sample) < ESTIMATE_ROWS:
+        return len(sample), sample_bytes
+
+    # Bytes on disk of the header and sampled rows
+    with open(path, "rb") as csv_file:
+        disk_bytes = sum(len(csv_file.readline())
+                         for _ in range(ESTIMATE_ROWS + 1))
+
+    n_rows = int(len(sample) * os.path.getsize(path) / disk_bytes)
+
+    return n_rows, int(sample_bytes * n_rows / len(sample))
+
+
+def choose_execution(n_bytes: int, budget_mb=MEMORY_BUDGET_MB):
+    """Choose in-memory or chunked execution
+
+    Args:
+        n_bytes (int): Estimated dataset size in memory (bytes)
+        budget_mb (float, optional): Memory budget (MB).
+            Defaults to MEMORY_BUDGET_MB.
+
+    Returns:
+        str: "memory" or "chunked"
+    """
+    if n_bytes * MEMORY_OVERHEAD <= budget_mb * 2 ** 20:
+        return "memory"
+
+    return "chunked"
+
+
+def chunk_rows(n_rows: int, n_bytes: int, budget_mb=MEMORY_BUDGET_MB):
+    """Rows per chunk fitting the memory budget
+
+    Args:
+        n_rows (int): Number of rows
+        n_bytes (int): Dataset size in memory (bytes)
+        budget_mb (float, optional): Memory budget (MB).
+            Defaults to MEMORY_BUDGET_MB.
+
+    Returns:
+        int: Rows per chunk
+    """
+    row_bytes = max(1.0, n_bytes / max(1, n_rows))
+    rows = int(budget_mb * 2 ** 20 / (row_bytes * MEMORY_OVERHEAD))
+
+    return max(MIN_CHUNK_ROWS, min(MAX_CHUNK_ROWS, rows))
+
+
+class SpillTable:
+    """Dataset stored on disk as Parquet parts.
+
+    Parts are written and read one at a time, so only one chunk of the
+    dataset is in memory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.parts = []
+        self.n_rows = 0
+        self.n_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, chunk):
+        """Write a chunk as a new part
+
+        Args:
+            chunk (DataFrame): Chunk
+        """
+        if len(chunk) == 0:
+            return
+
+        path = os.path.join(self.directory,
+                            f"part-{len(self.parts):06d}.parquet")
+        write_checkpoint(chunk, path)
+
+        self.parts.append(path)
+        self.n_rows += len(chunk)
+        self.n_bytes += int(chunk.memory_usage(deep=True).sum())
+
+    def chunks(self, columns=None):
+        """Read parts in order
+
+        Args:
+            columns (list, optional): Columns read. Defaults to all.
+
+        Yields:
+            DataFrame: Part
+        """
+        for path in self.parts:
+            yield read_checkpoint(path, columns)
+
+    def n_buckets(self, fraction=1.0, budget_mb=MEMORY_BUDGET_MB):
+        """Buckets needed so one bucket fits the memory budget
+
+        Args:
+            fraction (float, optional): Fraction of the row size kept in
+                the buckets. Defaults to 1.0.
+            budget_mb (float, optional): Memory budget (MB).
+                Defaults to MEMORY_BUDGET_MB.
+
+        Returns:
+            int: Number of buckets
+        """
+        size = self.n_bytes * fraction * MEMORY_OVERHEAD
+
+        return max(1, math.ceil(size / (budget_mb * 2 ** 20)))
+
+    def remove(self):
+        """Remove the parts from disk"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.parts = []
+
+
+def spill_csv(path: str, directory: str, delimiter=",", columns=None,
+              filters=None, chunksize=100000):
+    """Read a CSV file into a SpillTable, numbering rows
+
+    Args:
+        path (str): CSV path
+        directory (str): Table directory
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+        filters (dict, optional): {column: allowed values}.
+            Defaults to None.
+        chunksize (int, optional): Rows per part. Defaults to 100000.
+
+    Returns:
+        SpillTable: Dataset with a ROW_COLUMN position column
+    """
+    table = SpillTable(directory)
+    start = 0
+
+    for chunk in read_csv_chunks(path, delimiter, columns, filters,
+                                 chunksize):
+        chunk = chunk.reset_index(drop=True)
+        chunk.insert(0, ROW_COLUMN, np.arange(start, start + len(chunk)))
+        start += len(chunk)
+        table.append(chunk)
+
+    return table
+
+
+def map_chunks(table, function, directory: str):
+    """Apply a row-local function to each part
+
+    Args:
+        table (SpillTable): Input table
+        function (function): Takes and returns a DataFrame chunk
+        directory (str): Output table directory
+
+    Returns:
+        SpillTable: Output table
+    """
+    output = SpillTable(directory)
+    for chunk in table.chunks():
+        output.append(function(chunk))
+
+    return output
+
+
+def _partition(table, bucket_of, n_buckets: int, directory: str,
+               columns=None, budget_mb=MEMORY_BUDGET_MB):
+    # Spill rows to buckets, each bucket keeps input order. Rows are
+    # buffered up to the budget so buckets get few, large parts.
+    buckets = [SpillTable(os.path.join(directory, f"bucket-{index}"))
+               for index in range(n_buckets)]
+    buffers = [[] for _ in range(n_buckets)]
+    limit = budget_mb * 2 ** 20 / MEMORY_OVERHEAD
+    buffered = 0
+
+    def _flush():
+        for bucket, buffer in zip(buckets, buffers):
+            if buffer:
+                bucket.append(pd.concat(buffer))
+                buffer.clear()
+
+    for chunk in table.chunks(columns):
+        assignment = bucket_of(chunk)
+        for index, buffer in enumerate(buffers):
+            buffer.append(chunk[assignment == index])
+
+        buffered += chunk.memory_usage(deep=True).sum()
+        if buffered > limit:
+            _flush()
+            buffered = 0
+    _flush()
+
+    return buckets
+
+
+def _read_bucket(bucket):
+    chunks = list(bucket.chunks())
+    bucket.remove()
+
+    return pd.concat(chunks, ignore_index=True) if chunks else None
+
+
+def _present_values(table, column: str):
+    # Non-missing values of each part, as floats
+    for chunk in table.chunks([column]):
+        values = chunk[column].to_numpy(dtype=float)
+        yield values[~np.isnan(values)]
+
+
+def _sort_keys(values):
+    # Unsigned integers in the same order as the float values
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    sign = np.uint64(1 << 63)
+
+    return np.where(bits & sign, ~bits, bits | sign)
+
+
+def _from_sort_key(key: int):
+    bits = np.array([key], dtype=np.uint64)
+    sign = np.uint64(1 << 63)
+    bits = np.where(bits & sign, bits ^ sign, ~bits)
+
+    return float(bits.view(np.float64)[0])
+
+
+def _select_ranks(table, column: str, ranks: list):
+    """Values at given ranks of the sorted non-missing values
+
+    Radix selection on the value sort keys: each pass reads the column
+    part by part and counts the next RADIX_BITS bits of the keys sharing
+    the prefix found so far, memory is bounded by one part.
+
+    Args:
+        table (SpillTable): Input table
+        column (str): Value column
+        ranks (list): Ranks (from 0) in the sorted values
+
+    Returns:
+        list: Value at each rank
+    """
+    ranks = list(ranks)
+    prefixes = [0] * len(ranks)
+    n_bins = 1 << RADIX_BITS
+
+    for shift in range(64 - RADIX_BITS, -1, -RADIX_BITS):
+        counts = [np.zeros(n_bins, dtype=np.int64) for _ in ranks]
+
+        for values in _present_values(table, column):
+            keys = _sort_keys(values)
+            digits = ((keys >> np.uint64(shift)) &
+                      np.uint64(n_bins - 1)).astype(np.int64)
+            for count, prefix in zip(counts, prefixes):
+                if shift + RADIX_BITS < 64:
+                    high = keys >> np.uint64(shift + RADIX_BITS)
+                    count += np.bincount(digits[high == np.uint64(prefix)],
+                                         minlength=n_bins)
+                else:
+                    count += np.bincount(digits, minlength=n_bins)
+
+        for i, count in enumerate(counts):
+            cumulative = np.cumsum(count)
+            digit = int(np.searchsorted(cumulative, ranks[i], side="right"))
+            if digit:
+                ranks[i] -= int(cumulative[digit - 1])
+            prefixes[i] = (prefixes[i] << RADIX_BITS) | digit
+
+    return [_from_sort_key(prefix) for prefix in prefixes]
+
+
+def quantiles_chunked(table, column: str, quantiles: list):
+    """Quantiles of a column with linear interpolation, out of core
+
+    Same values as `Series.quantile`, missing values are skipped. The
+    column is read part by part once to count the values, then once per
+    RADIX_BITS bits of the values (see `_select_ranks`).
+
+    Args:
+        table (SpillTable): Input table
+        column (str): Value column
+        quantiles (list): Quantiles between 0 and 1
+
+    Returns:
+        list: Quantile values, NaN without values
+    """
+    n_values = sum(len(values)
+                   for values in _present_values(table, column))
+    if n_values == 0:
+        return [np.nan] * len(quantiles)
+
+    positions = [(n_values - 1) * quantile for quantile in quantiles]
+    ranks = sorted({rank for position in positions
+                    for rank in (math.floor(position),
+                                 min(n_values - 1,
+                                     math.floor(position) + 1))})
+    selected = dict(zip(ranks, _select_ranks(table, column, ranks)))
+
+    results = []
+    for position in positions:
+        rank = math.floor(position)
+        low = selected[rank]
+        high = selected[min(n_values - 1, rank + 1)]
+        # Equal infinite values would interpolate to NaN
+        results.append(low + (high - low) * (position - rank)
+                       if high != low else low)
+
+    return results
+
+
+def remove_outliers_chunked(table, directory: str, column="Labels",
+                            lower=0.1, upper=0.9):
+    """Remove rows outside a quantile range, in bounded memory
+
+    The quantiles are selected reading the value column part by part
+    (see `quantiles_chunked`), then each part is filtered.
+
+    Args:
+        table (SpillTable): Input table
+        directory (str): Output table directory
+        column (str, optional): Value column. Defaults to "Labels".
+        lower (float, optional): Lower quantile. Defaults to 0.1.
+        upper (float, optional): Upper quantile. Defaults to 0.9.
+
+    Returns:
+        SpillTable: Rows strictly between both quantiles
+    """
+    low, high = quantiles_chunked(table, column, [lower, upper])
+
+    def _filter(chunk):
+        return chunk[(chunk[column] > low) & (chunk[column] < high)]
+
+    return map_chunks(table, _filter, directory)
+
+
+def process_duplicates_chunked(table, directory: str, columns: list,
+                               policy="max", drop_conflicts=True,
+                               budget_mb=MEMORY_BUDGET_MB):
+    """Resolve duplicated molecules out of core
+
+    Rows are hash-partitioned on the molecule column into buckets
+    fitting the memory budget, only the row position and the columns
+    used to resolve duplicates are spilled. Each bucket is resolved with
+    `process_duplicates`, then the kept rows are selected from the parts
+    in input order, giving the same rows as in-memory execution.
+
+    Args:
+        table (SpillTable): Input table
+        directory (str): Output table directory
+        columns (list): Smiles column, or Smiles, Activity and
+            Converted Value columns
+        policy (str, optional): Replicate value policy.
+            Defaults to "max".
+        drop_conflicts (bool, optional): Drop molecules with conflicting
+            activity. Defaults to True.
+        budget_mb (float, optional): Memory budget (MB).
+            Defaults to MEMORY_BUDGET_MB.
+
+    Returns:
+        SpillTable: Table with one row per molecule
+    """
+    if (len(columns) > 1 and policy in AGGREGATE_POLICIES
+            and not drop_conflicts):
+        raise ValueError(f"Policy {policy!r} requires dropping conflicts")
+
+    key_columns = [ROW_COLUMN] + list(dict.fromkeys(columns[:3]))
+    kept_columns = [ROW_COLUMN]
+    if len(columns) > 1:
+        kept_columns += ["Replicates", columns[2]]
+
+    n_columns = len(next(table.chunks(), pd.DataFrame()).columns)
+    n_buckets = table.n_buckets(len(key_columns) / max(1, n_columns),
+                                budget_mb)
+
+    def _bucket_of(chunk):
+        return pd.util.hash_array(
+            chunk[columns[0]].astype(str).to_numpy(dtype=object)) % n_buckets
+
+    # Kept row positions, with replicate counts and aggregated values
+    kept = []
+    for bucket in _partition(table, _bucket_of, n_buckets,
+                             directory + "-buckets", key_columns,
+                             budget_mb):
+        bucket = _read_bucket(bucket)
+        if bucket is not None:
+            kept.append(process_duplicates(bucket, columns, policy,
+                                           drop_conflicts)[kept_columns])
+    shutil.rmtree(directory + "-buckets", ignore_errors=True)
+
+    kept = (pd.concat(kept, ignore_index=True) if kept
+            else pd.DataFrame(columns=kept_columns))
+    kept = kept.sort_values(ROW_COLUMN, kind="mergesort")
+    rows = kept[ROW_COLUMN].to_numpy(dtype=np.int64)
+
+    def _select(chunk):
+        chunk_rows = chunk[ROW_COLUMN].to_numpy(dtype=np.int64)
+        positions = np.minimum(np.searchsorted(rows, chunk_rows),
+                               max(0, len(rows) - 1))
+        found = (rows[positions] == chunk_rows if len(rows)
+                 else np.zeros(len(chunk), dtype=bool))
+        if len(columns) == 1:
+            return chunk[found]
+
+        selected = kept.iloc[positions[found]]
+        chunk = chunk[found].copy()
+        chunk["Replicates"] = selected["Replicates"].to_numpy()
+        if policy in ("median", "geomean"):
+            chunk[columns[2]] = selected[columns[2]].to_numpy()
+
+        return chunk
+
+    return map_chunks(table, _select, directory)
+
+
+def shuffle_chunked(table, directory: str, seed=None,
+                    budget_mb=MEMORY_BUDGET_MB):
+    """Shuffle rows out of core
+
+    Rows are spilled to random buckets fitting the memory budget, each
+    bucket is then shuffled in memory. Every permutation is equally
+    likely.
+
+    Args:
+        table (SpillTable): Input table
+        directory (str): Output table directory
+        seed (int, optional): Random seed. Defaults to None.
+        budget_mb (float, optional): Memory budget (MB).
+            Defaults to MEMORY_BUDGET_MB.
+
+    Returns:
+        SpillTable: Shuffled table
+    """
+    rng = np.random.default_rng(seed)
+    n_buckets = table.n_buckets(budget_mb=budget_mb)
+
+    def _bucket_of(chunk):
+        return rng.integers(n_buckets, size=len(chunk))
+
+    output = SpillTable(directory)
+    for bucket in _partition(table, _bucket_of, n_buckets,
+                             directory + "-buckets", budget_mb=budget_mb):
+        bucket = _read_bucket(bucket)
+        if bucket is not None:
+            output.append(bucket.iloc[rng.permutation(len(bucket))])
+    shutil.rmtree(directory + "-buckets", ignore_errors=True)
+
+    return output
@@ -0,0 +1,148 @@
+"""
+Dataset and fingerprint export
+
+version: 1.0.0
+"""
+
+
+import gzip
+import io
+import os
+import zipfile
+
+from .pipeline import arrow_compatible
+
+# Displayed name: (file suffix, mime type)
+EXPORT_FORMATS = {"CSV": (".csv", "text/csv"),
+                  "CSV (gzip)": (".csv.gz", "application/gzip"),
+                  "CSV (zip)": (".zip", "application/zip"),
+                  "Parquet": (".parquet", "application/octet-stream")}
+
+FINGERPRINT_FORMATS = {"NumPy (packed)": (".zip", "application/zip"),
+                       "CSV (gzip)": (".csv.gz", "application/gzip")}
+
+
+def _write_csv_chunks(chunks, binary_file):
+    text_file = io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+    try:
+        for index, chunk in enumerate(chunks):
+            chunk.to_csv(text_file, index=False, header=index == 0)
+    finally:
+        text_file.detach()
+
+
+def _write_parquet_chunks(chunks, out_path: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            chunk = arrow_compatible(chunk)
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(out_path, schema)
+            writer.write_table(pa.Table.from_pandas(
+                chunk, schema=schema, preserve_index=False))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_chunks(chunks, out_path: str, out_format: str, name="data"):
+    """Write dataframe chunks to a file, one chunk in memory at a time
+
+    Args:
+        chunks (iterable): DataFrame chunks sharing the same columns
+        out_path (str): Output path
+        out_format (str): Format (see EXPORT_FORMATS)
+        name (str, optional): File name inside zip archives.
+            Defaults to "data".
+
+    Returns:
+        str: Output path
+    """
+    if out_format == "Parquet":
+        _write_parquet_chunks(chunks, out_path)
+
+    elif out_format == "CSV (gzip)":
+        with gzip.open(out_path, "wb", compresslevel=6) as out_file:
+            _write_csv_chunks(chunks, out_file)
+
+    elif out_format == "CSV (zip)":
+        with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(f"{name}.csv", "w",
+                              force_zip64=True) as out_file:
+                _write_csv_chunks(chunks, out_file)
+
+    else:
+        with open(out_path, "wb") as out_file:
+            _write_csv_chunks(chunks, out_file)
+
+    return out_path
+
+
+def export_dataframe(dataframe, out_path: str, out_format: str,
+                     name="data", chunksize=100000):
+    """Write a dataframe to a file in chunks
+
+    Args:
+        dataframe (DataFrame): Dataframe
+        out_path (str): Output path
+        out_format (str): Format (see EXPORT_FORMATS)
+        name (str, optional): File name inside zip archives.
+            Defaults to "data".
+        chunksize (int, optional): Rows serialized at once.
+            Defaults to 100000.
+
+    Returns:
+        str: Output path
+    """
+    # Always at least one chunk so the header is written
+    starts = range(0, max(1, len(dataframe)), chunksize)
+    chunks = (dataframe.iloc[start:start + chunksize] for start in starts)
+
+    return export_chunks(chunks, out_path, out_format, name)
+
+
+def export_fingerprints(store, out_path: str, out_format: str,
+                        name="fingerprint", chunksize=10000):
+    """Write a fingerprint store to a file
+
+    "NumPy (packed)" archives the packed store files, "CSV (gzip)"
+    unpacks the store in chunks.
+
+    Args:
+        store (FingerprintStore): Fingerprint store
+        out_path (str): Output path
+        out_format (str): Format (see FINGERPRINT_FORMATS)
+        name (str, optional): File name prefix. Defaults to "fingerprint".
+        chunksize (int, optional): Rows unpacked at once.
+            Defaults to 10000.
+
+    Returns:
+        str: Output path
+    """
+    if out_format == "NumPy (packed)":
+        with zipfile.ZipFile(out_path, "w") as archive:
+            for file in store.files:
+                archive.write(file, name + file[len(store.path):])
+
+        return out_path
+
+    n_rows = store.shape[0]
+    starts = range(0, max(1, n_rows), chunksize)
+    chunks = (store.to_dataframe(start, start + chunksize)
+              for start in starts)
+
+    return export_chunks(chunks, out_path, "CSV (gzip)", name)
+
+
+def remove_export(path):
+    """Remove an export file if it exists
+
+    Args:
+        path (str): Export path
+    """
+    if path and os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,332 @@
+"""
+In-process RDKit fingerprints and fingerprint storage
+
+version: 1.1.0
+"""
+
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem, DataStructs
+from rdkit.Chem import MACCSkeys, rdFingerprintGenerator
+
+from .jobs import process_context
+
+# Displayed name: (fingerprint, number of bits)
+RDKIT_FINGERPRINTS = {"MACCS": ("maccs", 167),
+                      "Morgan2 (ECFP4)": ("morgan2", 2048),
+                      "Morgan3 (ECFP6)": ("morgan3", 2048),
+                      "AtomPairs": ("atompair", 2048),
+                      "TopologicalTorsion": ("torsion", 2048),
+                      "RDKit": ("rdkit", 2048)}
+
+
+@lru_cache(maxsize=None)
+def _generator(fingerprint: str, n_bits: int):
+    # Generators are not picklable, each process builds its own
+    if fingerprint == "morgan2":
+        return rdFingerprintGenerator.GetMorganGenerator(radius=2,
+                                                         fpSize=n_bits)
+    if fingerprint == "morgan3":
+        return rdFingerprintGenerator.GetMorganGenerator(radius=3,
+                                                         fpSize=n_bits)
+    if fingerprint == "atompair":
+        return rdFingerprintGenerator.GetAtomPairGenerator(fpSize=n_bits)
+    if fingerprint == "torsion":
+        return rdFingerprintGenerator.GetTopologicalTorsionGenerator(
+            fpSize=n_bits)
+    if fingerprint == "rdkit":
+        return rdFingerprintGenerator.GetRDKitFPGenerator(fpSize=n_bits)
+
+    raise ValueError(f"Unknown fingerprint: {fingerprint}")
+
+
+def _fingerprint_chunk(chunk, fingerprint, n_bits):
+    matrix = np.zeros((len(chunk), n_bits), dtype=np.uint8)
+    valid = np.zeros(len(chunk), dtype=bool)
+    row = np.zeros(n_bits, dtype=np.uint8)
+
+    for index, current_smiles in enumerate(chunk):
+        mol = Chem.MolFromSmiles(str(current_smiles))
+        if mol is None:
+            continue
+
+        if fingerprint == "maccs":
+            fp = MACCSkeys.GenMACCSKeys(mol)
+        else:
+            fp = _generator(fingerprint, n_bits).GetFingerprint(mol)
+
+        DataStructs.ConvertToNumpyArray(fp, row)
+        matrix[index] = row
+        valid[index] = True
+
+    return matrix, valid
+
+
+def _fill(matrix, valid, starts, results, callback=None):
+    for start, (chunk_matrix, chunk_valid) in zip(starts, results):
+        matrix[start:start + len(chunk_valid)] = chunk_matrix
+        valid[start:start + len(chunk_valid)] = chunk_valid
+        if callback is not None:
+            callback(start + len(chunk_valid), len(valid))
+
+
+def rdkit_fingerprints(smiles, fingerprint: str, n_bits: int, n_jobs=1,
+                       chunk_size=5000, callback=None):
+    """Compute RDKit fingerprints into a bit matrix
+
+    Args:
+        smiles (list): SMILES
+        fingerprint (str): Fingerprint (see RDKIT_FINGERPRINTS)
+        n_bits (int): Number of bits
+        n_jobs (int, optional): Number of worker processes. Defaults to 1.
+        chunk_size (int, optional): SMILES sent to a worker at once.
+            Defaults to 5000.
+        callback (function, optional): Called with (done, total) after
+            each chunk, an exception it raises cancels the rest.
+            Defaults to None.
+
+    Returns:
+        ndarray: uint8 matrix (molecules x bits), zeros for invalid SMILES
+        ndarray: Boolean flag of valid SMILES
+    """
+    smiles = list(smiles)
+    matrix = np.zeros((len(smiles), n_bits), dtype=np.uint8)
+    valid = np.zeros(len(smiles), dtype=bool)
+
+    starts = range(0, len(smiles), chunk_size)
+    chunks = [smiles[start:start + chunk_size] for start in starts]
+
+    if n_jobs <= 1:
+        results = (_fingerprint_chunk(chunk, fingerprint, n_bits)
+                   for chunk in chunks)
+        _fill(matrix, valid, starts, results, callback)
+
+        return matrix, valid
+
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             mp_context=process_context()) as executor:
+        futures = [executor.submit(_fingerprint_chunk, chunk, fingerprint,
+                                   n_bits) for chunk in chunks]
+        try:
+            _fill(matrix, valid, starts,
+                  (future.result() for future in futures), callback)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return matrix, valid
+
+
+def bit_columns(prefix: str, n_bits: int):
+    """Bit column names
+
+    Args:
+        prefix (str): Column prefix
+        n_bits (int): Number of bits
+
+    Returns:
+        list: Column names
+    """
+    return [f"{prefix}{index}" for index in range(n_bits)]
+
+
+def fingerprint_dataframe(names, matrix, columns: list):
+    """Fingerprint matrix as dataframe, PaDEL output layout
+
+    Args:
+        names (list): Molecule IDs
+        matrix (ndarray): Fingerprint matrix
+        columns (list): Bit column names
+
+    Returns:
+        DataFrame: Name column followed by one column per bit
+    """
+    fingerprint_df = pd.DataFrame(matrix, columns=columns)
+    fingerprint_df.insert(0, "Name", list(names))
+
+    return fingerprint_df
+
+
+def _store_files(path: str):
+    return path + ".npy", path + ".ids.npy", path + ".json"
+
+
+def _pack(matrix, counts: bool):
+    if counts:
+        return np.minimum(matrix, np.iinfo(np.uint16).max).astype(np.uint16)
+
+    return np.packbits(np.asarray(matrix) > 0, axis=1)
+
+
+def save_fingerprints(path: str, names, matrix, columns: list, counts=False):
+    """Save fingerprints in the binary fingerprint format
+
+    Bits are packed 8 per byte, counts are stored as uint16. The matrix,
+    the molecule IDs and the metadata are stored in `path`.npy,
+    `path`.ids.npy and `path`.json.
+
+    Args:
+        path (str): Store path, without extension
+        names (list): Molecule IDs
+        matrix (ndarray): Fingerprint matrix (molecules x bits)
+        columns (list): Bit column names
+        counts (bool, optional): Count fingerprint. Defaults to False.
+
+    Returns:
+        str: Store path
+    """
+    data_file, ids_file, meta_file = _store_files(path)
+
+    np.save(data_file, _pack(matrix, counts))
+    np.save(ids_file, np.asarray(list(names), dtype=str))
+    with open(meta_file, "w") as meta:
+        json.dump({"columns": list(columns), "counts": counts}, meta)
+
+    return path
+
+
+def csv_to_fingerprints(csv_path: str, path: str, counts=False,
+                        chunksize=10000):
+    """Convert a PaDEL fingerprint CSV into the binary fingerprint format
+
+    The CSV is read in chunks and written into a memory-mapped matrix,
+    the whole fingerprint matrix is never loaded.
+
+    Args:
+        csv_path (str): Path to PaDEL CSV file
+        path (str): Store path, without extension
+        counts (bool, optional): Count fingerprint. Defaults to False.
+        chunksize (int, optional): Rows read at once. Defaults to 10000.
+
+    Returns:
+        str: Store path
+    """
+    data_file, ids_file, meta_file = _store_files(path)
+
+    columns = pd.read_csv(csv_path, nrows=0).columns[1:]
+
+    # First pass on the ID column only to size the matrix
+    names = []
+    for chunk in pd.read_csv(csv_path, usecols=[0], chunksize=chunksize):
+        names.extend(chunk.iloc[:, 0].astype(str))
+
+    n_columns = len(columns) if counts else (len(columns) + 7) // 8
+    data = np.lib.format.open_memmap(
+        data_file, mode="w+", dtype=np.uint16 if counts else np.uint8,
+        shape=(len(names), n_columns))
+
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        values = chunk.iloc[:, 1:].fillna(0).to_numpy()
+        data[start:start + len(chunk)] = _pack(values, counts)
+        start += len(chunk)
+
+    data.flush()
+    del data
+
+    np.save(ids_file, np.asarray(names, dtype=str))
+    with open(meta_file, "w") as meta:
+        json.dump({"columns": list(columns), "counts": counts}, meta)
+
+    return path
+
+
+def merge_fingerprints(paths: list, path: str):
+    """Concatenate stores in the binary fingerprint format
+
+    Parts are copied one at a time into a memory-mapped matrix.
+
+    Args:
+        paths (list): Store paths of the parts, in order
+        path (str): Merged store path, without extension
+
+    Returns:
+        str: Store path
+    """
+    data_file, ids_file, meta_file = _store_files(path)
+    stores = [FingerprintStore(part) for part in paths]
+    first = stores[0]
+
+    data = np.lib.format.open_memmap(
+        data_file, mode="w+", dtype=first.data.dtype,
+        shape=(sum(len(store.data) for store in stores),
+               first.data.shape[1]))
+
+    start = 0
+    for store in stores:
+        data[start:start + len(store.data)] = store.data
+        start += len(store.data)
+
+    data.flush()
+    del data
+
+    np.save(ids_file, np.concatenate([np.asarray(store.names)
+                                      for store in stores]))
+    with open(meta_file, "w") as meta:
+        json.dump({"columns": first.columns, "counts": first.counts}, meta)
+
+    return path
+
+
+class FingerprintStore:
+    """Memory-mapped access to the binary fingerprint format.
+
+    Nothing is loaded until rows are requested, `rows` and
+    `to_dataframe` only read and unpack the requested slice.
+    """
+
+    def __init__(self, path: str):
+        data_file, ids_file, meta_file = _store_files(path)
+
+        with open(meta_file) as meta:
+            metadata = json.load(meta)
+
+        self.path = path
+        self.columns = metadata["columns"]
+        self.counts = metadata["counts"]
+        self.data = np.load(data_file, mmap_mode="r")
+        self.names = np.load(ids_file, mmap_mode="r")
+
+    @property
+    def shape(self):
+        return self.data.shape[0], len(self.columns)
+
+    @property
+    def files(self):
+        return _store_files(self.path)
+
+    def rows(self, start=0, stop=None):
+        """Fingerprint rows
+
+        Args:
+            start (int, optional): First row. Defaults to 0.
+            stop (int, optional): Row after the last one. Defaults to None.
+
+        Returns:
+            ndarray: Fingerprint matrix slice
+        """
+        block = self.data[start:stop]
+
+        if self.counts:
+            return np.asarray(block)
+
+        return np.unpackbits(block, axis=1, count=len(self.columns))
+
+    def to_dataframe(self, start=0, stop=None):
+        """Fingerprint rows as dataframe
+
+        Args:
+            start (int, optional): First row. Defaults to 0.
+            stop (int, optional): Row after the last one. Defaults to None.
+
+        Returns:
+            DataFrame: Name column followed by one column per bit
+        """
+        return fingerprint_dataframe(self.names[start:stop],
+                                     self.rows(start, stop), self.columns)
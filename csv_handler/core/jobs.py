@@ -0,0 +1,267 @@
+"""
+Background jobs
+
+version: 1.0.0
+"""
+
+
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+# Jobs running at once in the server process, all sessions together
+JOB_WORKERS = max(2, min(8, os.cpu_count() or 1))
+
+# Finished jobs not picked up are dropped after this delay (s)
+JOB_RETENTION = 24 * 3600
+
+# Modules imported once by the fork server of worker processes
+FORKSERVER_PRELOAD = ["csv_handler.core.utils",
+                      "csv_handler.core.fingerprints"]
+
+
+def process_context():
+    """Multiprocessing context for worker processes
+
+    Pools are started from job and script threads: a forked child
+    would copy locks held by other threads of the server. Forkserver
+    children are forked from a single-threaded server instead.
+
+    Returns:
+        BaseContext: Forkserver context, spawn where unavailable
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(FORKSERVER_PRELOAD)
+
+    return context
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """Work running in a background thread of the server process.
+
+    The work reports progress through `progress`, which raises
+    JobCancelled once cancellation is requested, so work stops at its
+    next progress report.
+    """
+
+    def __init__(self, name: str, total=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    def progress(self, done: int, total=None):
+        """Report progress, raise JobCancelled if cancellation is requested
+
+        Args:
+            done (int): Items done
+            total (int, optional): Total items, if it changed.
+                Defaults to None.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def cancel(self):
+        """Request cancellation"""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.status = "cancelled"
+            self.finished_at = time.time()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+
+        return (self.finished_at or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """Items per second"""
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left (None if unknown)"""
+        if not self.total or not self.throughput or self.finished:
+            return None
+
+        return max(0, self.total - self.done) / self.throughput
+
+
+class JobRunner:
+    """Thread pool running jobs of all sessions.
+
+    Jobs live in the server process, independently of the script runs
+    that submitted them, so reruns and page reloads do not interrupt
+    them. Results stay available until picked up or expired.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _run(self, job, function, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+
+        try:
+            job.result = function(*args, progress=job.progress, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as error:
+            job.error = f"{type(error).__name__}: {error}"
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def submit(self, name: str, function, *args, total=None, **kwargs):
+        """Run function(*args, progress=job.progress, **kwargs) in the
+        background
+
+        Args:
+            name (str): Job name
+            function (function): Work, reporting progress with the
+                `progress(done, total=None)` keyword argument
+            total (int, optional): Total items. Defaults to None.
+
+        Returns:
+            Job: Submitted job
+        """
+        self.prune()
+        job = Job(name, total)
+
+        with self.lock:
+            self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job, function, args,
+                                          kwargs)
+
+        return job
+
+    def get(self, job_id: str):
+        """Get a job
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            Job: Job (None if unknown)
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def forget(self, job_id: str):
+        """Drop a job and its result
+
+        Args:
+            job_id (str): Job ID
+        """
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def prune(self, max_age=JOB_RETENTION):
+        """Drop jobs finished for longer than max_age
+
+        Args:
+            max_age (float, optional): Delay (s). Defaults to JOB_RETENTION.
+        """
+        now = time.time()
+        with self.lock:
+            for job_id, job in list(self.jobs.items()):
+                if job.finished and now - job.finished_at > max_age:
+                    del self.jobs[job_id]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """Get the job runner shared by all sessions
+
+    Returns:
+        JobRunner: Job runner
+    """
+    global _runner
+
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+
+        return _runner
+
+
+def session_jobs():
+    """Jobs of current session
+
+    Returns:
+        dict: {key: Job}, unknown jobs left out
+    """
+    job_ids = st.session_state.setdefault("jobs", {})
+    jobs = {key: get_runner().get(job_id) for key, job_id in job_ids.items()}
+
+    return {key: job for key, job in jobs.items() if job is not None}
+
+
+def get_session_job(key: str):
+    """Get a job of current session
+
+    Args:
+        key (str): Job key in the session
+
+    Returns:
+        Job: Job (None if missing)
+    """
+    return session_jobs().get(key)
+
+
+def set_session_job(key: str, job):
+    """Attach a job to current session
+
+    Args:
+        key (str): Job key in the session
+        job (Job): Job
+    """
+    st.session_state.setdefault("jobs", {})[key] = job.id
+
+
+def release_session_job(key: str):
+    """Detach a job from current session once its result is used
+
+    Args:
+        key (str): Job key in the session
+    """
+    job_id = st.session_state.setdefault("jobs", {}).pop(key, None)
+    if job_id is not None:
+        get_runner().forget(job_id)
@@ -0,0 +1,324 @@
+"""
+Stage metrics
+
+version: 1.0.0
+"""
+
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+import streamlit as st
+
+try:
+    import resource
+except ImportError:
+    # Windows: no child process CPU time
+    resource = None
+
+METRICS_JSONL_PATH = "./csv_handler/core/files/metrics.jsonl"
+METRICS_PROM_PATH = "./csv_handler/core/files/metrics.prom"
+
+PROMETHEUS_PREFIX = "dataset_manager_stage"
+
+# Seconds between resident memory samples during a stage
+RSS_SAMPLE_INTERVAL = 0.05
+
+# Columns of the run summary
+SUMMARY_COLUMNS = ["stage", "status", "rows_in", "rows_out", "removed",
+                   "seconds", "cpu_seconds", "peak_rss_mb", "rss_growth_mb"]
+
+# Prometheus metric: (record field, type, help)
+_PROMETHEUS_METRICS = [
+    ("runs_total", None, "counter", "Completed stage runs"),
+    ("failures_total", None, "counter", "Failed stage runs"),
+    ("seconds_total", "seconds", "counter", "Wall time spent in the stage"),
+    ("cpu_seconds_total", "cpu_seconds", "counter",
+     "CPU time of the stage thread and of child processes ended "
+     "during the stage"),
+    ("rows_in_total", "rows_in", "counter", "Rows entering the stage"),
+    ("rows_out_total", "rows_out", "counter", "Rows leaving the stage"),
+    ("last_seconds", "seconds", "gauge", "Wall time of the last run"),
+    ("last_peak_rss_bytes", "peak_rss_mb", "gauge",
+     "Peak resident memory of the process during the last run")]
+
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def _rss_mb():
+    # Current resident memory of the process, None without /proc
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _children_cpu_seconds():
+    # Child processes waited for (PaDEL, worker pools) by any thread
+    if resource is None:
+        return 0.0
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return children.ru_utime + children.ru_stime
+
+
+class _RSSSampler:
+    """Peak resident memory of the process, sampled in a thread."""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.start_mb = _rss_mb()
+        self.peak_mb = self.start_mb
+        self.stopped = threading.Event()
+        self.thread = None
+
+        if self.start_mb is not None:
+            self.thread = threading.Thread(target=self._sample,
+                                           args=(interval,), daemon=True)
+            self.thread.start()
+
+    def _sample(self, interval):
+        while not self.stopped.wait(interval):
+            self._update()
+
+    def _update(self):
+        current = _rss_mb()
+        if current is not None:
+            self.peak_mb = max(self.peak_mb, current)
+
+    def stop(self):
+        """Stop sampling
+
+        Returns:
+            float: Resident memory at start (MB), None if unknown
+            float: Peak resident memory (MB), None if unknown
+        """
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self._update()
+
+        return self.start_mb, self.peak_mb
+
+
+@contextmanager
+def measure(stage: str, rows_in=None):
+    """Measure a stage
+
+    Wall time, CPU time, peak resident memory and its growth during the
+    stage are added to the yielded record on exit. The stage sets
+    "rows_out" (and any other field) on the record.
+
+    CPU time is the time of the calling thread plus child processes
+    that ended during the stage. Children are counted process-wide, so
+    pools of concurrent sessions add to each other. Memory is the
+    resident memory of this process (worker processes excluded),
+    sampled during the stage; other sessions' allocations are included.
+    Memory is None without /proc (Windows, macOS), child CPU time is
+    left out without the resource module (Windows).
+
+    Args:
+        stage (str): Stage name
+        rows_in (int, optional): Input rows. Defaults to None.
+
+    Yields:
+        dict: Stage record
+    """
+    record = {"stage": stage, "status": "running", "rows_in": rows_in,
+              "rows_out": None}
+    sampler = _RSSSampler()
+    start_cpu = time.thread_time()
+    start_children = _children_cpu_seconds()
+    start = time.perf_counter()
+
+    try:
+        yield record
+        record["status"] = "ok"
+    except BaseException as error:
+        record["status"] = "failed"
+        record["error"] = f"{type(error).__name__}: {error}"
+        raise
+    finally:
+        cpu_seconds = (time.thread_time() - start_cpu +
+                       _children_cpu_seconds() - start_children)
+        rss_start, rss_peak = sampler.stop()
+        record.update(
+            seconds=round(time.perf_counter() - start, 4),
+            cpu_seconds=round(cpu_seconds, 4),
+            peak_rss_mb=None if rss_peak is None else round(rss_peak, 1),
+            rss_growth_mb=(None if rss_peak is None else
+                           round(rss_peak - rss_start, 1)),
+            time=datetime.now(timezone.utc).isoformat())
+        if rows_in is not None and record["rows_out"] is not None:
+            record["removed"] = rows_in - record["rows_out"]
+
+
+def write_jsonl(record: dict, path=METRICS_JSONL_PATH):
+    """Append a record to a JSON lines file
+
+    Args:
+        record (dict): Stage record
+        path (str, optional): JSON lines path.
+            Defaults to METRICS_JSONL_PATH.
+    """
+    with open(path, "a") as jsonl_file:
+        jsonl_file.write(json.dumps(record, default=str) + "\n")
+
+
+def _add_totals(record: dict):
+    with _totals_lock:
+        totals = _totals.setdefault(record["stage"], dict.fromkeys(
+            [name for name, *_ in _PROMETHEUS_METRICS], 0.0))
+
+        if record["status"] != "ok":
+            totals["failures_total"] += 1
+            return
+
+        totals["runs_total"] += 1
+        for name, field, kind, _ in _PROMETHEUS_METRICS:
+            value = record.get(field) if field else None
+            if value is None:
+                continue
+            if field == "peak_rss_mb":
+                value *= 2 ** 20
+            if kind == "counter":
+                totals[name] += value
+            else:
+                totals[name] = value
+
+
+def write_prometheus(path=METRICS_PROM_PATH):
+    """Write stage totals of this process as a Prometheus textfile
+
+    The file is replaced atomically so a collector never reads it
+    half written.
+
+    Args:
+        path (str, optional): Textfile path. Defaults to METRICS_PROM_PATH.
+    """
+    with _totals_lock:
+        totals = {stage: dict(values) for stage, values in _totals.items()}
+
+    lines = []
+    for name, _, kind, description in _PROMETHEUS_METRICS:
+        metric = f"{PROMETHEUS_PREFIX}_{name}"
+        lines += [f"# HELP {metric} {description}",
+                  f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{stage="{stage}"}} {values[name]:g}'
+                  for stage, values in sorted(totals.items())]
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as prom_file:
+        prom_file.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+
+
+class MetricsLog:
+    """Stage records of a session.
+
+    Each record is appended to the JSON lines file and added to the
+    process totals of the Prometheus textfile as soon as the stage ends.
+    """
+
+    def __init__(self, jsonl_path=METRICS_JSONL_PATH,
+                 prom_path=METRICS_PROM_PATH):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+
+    @contextmanager
+    def measure(self, stage: str, rows_in=None):
+        """Measure a stage and record it (see `measure`)
+
+        Args:
+            stage (str): Stage name
+            rows_in (int, optional): Input rows. Defaults to None.
+
+        Yields:
+            dict: Stage record
+        """
+        record = {}
+        try:
+            with measure(stage, rows_in) as record:
+                yield record
+        finally:
+            if record:
+                self.add(record)
+
+    def add(self, record: dict):
+        """Record a finished stage
+
+        Args:
+            record (dict): Stage record
+        """
+        record = dict(record, run_id=self.run_id)
+        self.records.append(record)
+        _add_totals(record)
+
+        # Metrics never interrupt processing
+        try:
+            if self.jsonl_path:
+                write_jsonl(record, self.jsonl_path)
+            if self.prom_path:
+                write_prometheus(self.prom_path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Start a new run"""
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+
+    def summary(self):
+        """Records of the current run
+
+        Returns:
+            DataFrame: One row per stage run
+        """
+        return pd.DataFrame(self.records).reindex(columns=SUMMARY_COLUMNS)
+
+
+def get_metrics_log():
+    """Get metrics log of current session
+
+    Returns:
+        MetricsLog: Session metrics log
+    """
+    if "metrics_log" not in st.session_state:
+        st.session_state["metrics_log"] = MetricsLog()
+
+    return st.session_state["metrics_log"]
+
+
+def run_summary(log, key="run_summary"):
+    """Display wall time, CPU time, memory and rows of each stage run
+
+    Args:
+        log (MetricsLog): Session metrics log
+        key (str, optional): Unique widget key. Defaults to "run_summary".
+    """
+    if not log.records:
+        return
+
+    with st.expander("Run summary", expanded=True):
+        if st.button("Clear run summary", key=f"{key}_clear"):
+            log.clear()
+            return
+
+        summary = log.summary()
+        st.dataframe(summary)
+        st.caption(f"Total: {summary['seconds'].sum():.2f} s wall, "
+                   f"{summary['cpu_seconds'].sum():.2f} s CPU | "
+                   f"Peak memory: {summary['peak_rss_mb'].max():.1f} MB"
+                   f" | Metrics: {log.jsonl_path}, {log.prom_path}")
@@ -0,0 +1,600 @@
+"""
+PaDEL-Descriptor execution
+
+version: 1.0.0
+"""
+
+
+import atexit
+import math
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from rdkit import Chem
+
+from .cache import FingerprintCache
+
+# Options of every PaDEL fingerprint run
+PADEL_OPTIONS = ["-removesalt", "-standardizenitro", "-fingerprints",
+                 "-retainorder"]
+
+# Displayed name: fingerprint XML file
+PADEL_FINGERPRINTS = {
+    "AtomPairs2D": "AtomPairs2DFingerprinter.xml",
+    "AtomPairs2DCount": "AtomPairs2DFingerprintCount.xml",
+    "CDK": "Fingerprinter.xml",
+    "CDKextended": "ExtendedFingerprinter.xml",
+    "CDKgraphonly": "GraphOnlyFingerprinter.xml",
+    "EState": "EStateFingerprinter.xml",
+    "KlekotaRoth": "KlekotaRothFingerprinter.xml",
+    "KlekotaRothCount": "KlekotaRothFingerprintCount.xml",
+    "MACCS": "MACCSFingerprinter.xml",
+    "PubChem": "PubchemFingerprinter.xml",
+    "Substructure": "SubstructureFingerprinter.xml",
+    "SubstructureCount": "SubstructureFingerprintCount.xml"}
+
+# Molecules of each PaDEL run when progress is reported
+PADEL_BATCH_SIZE = 1000
+
+# Deadline of a PaDEL run: fixed seconds plus seconds per molecule
+PADEL_TIMEOUT = 120
+PADEL_MOLECULE_TIMEOUT = 1.0
+
+# Heap bounds for each PaDEL process (MB)
+MIN_HEAP_MB = 1024
+MAX_HEAP_MB = 8192
+
+
+class PaDELError(Exception):
+    pass
+
+
+def padel_arguments(descriptor_path: str, smi_path: str, out_file: str):
+    """PaDEL command line arguments for a fingerprint run
+
+    Args:
+        descriptor_path (str): Path to fingerprint XML file
+        smi_path (str): Path to SMILES file
+        out_file (str): Path to output CSV file
+
+    Returns:
+        list: PaDEL arguments
+    """
+    return PADEL_OPTIONS + ["-descriptortypes", descriptor_path,
+                            "-dir", smi_path, "-file", out_file]
+
+
+def padel_command(padel_path: str, arguments: list, heap="2G"):
+    """Java command running PaDEL in a new process
+
+    Args:
+        padel_path (str): Path to PaDEL folder
+        arguments (list): PaDEL arguments
+        heap (str, optional): JVM heap size. Defaults to "2G".
+
+    Returns:
+        list: Command
+    """
+    jar_path = padel_path + "/PaDEL-Descriptor.jar"
+
+    return (["java", f"-Xms{heap}", f"-Xmx{heap}",
+             "-Djava.awt.headless=true", "-jar", jar_path] + arguments)
+
+
+def padel_timeout(smi_path: str):
+    """Deadline of a PaDEL run on a SMILES file
+
+    Args:
+        smi_path (str): Path to SMILES file
+
+    Returns:
+        float: Seconds allowed
+    """
+    with open(smi_path) as smi_file:
+        n_molecules = sum(1 for _ in smi_file)
+
+    return PADEL_TIMEOUT + PADEL_MOLECULE_TIMEOUT * n_molecules
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def _available_memory():
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4 * MIN_HEAP_MB * 2 ** 20
+
+
+def padel_resources(n_molecules: int, min_shard=1000, memory_fraction=0.75):
+    """Size sharded PaDEL execution from available cores and memory
+
+    Args:
+        n_molecules (int): Number of molecules
+        min_shard (int, optional): Minimum molecules per shard.
+            Defaults to 1000.
+        memory_fraction (float, optional): Fraction of available memory
+            given to PaDEL. Defaults to 0.75.
+
+    Returns:
+        int: Number of PaDEL processes
+        int: Heap of each process (MB)
+        int: Threads of each process
+    """
+    cores = _available_cores()
+    budget_mb = int(_available_memory() * memory_fraction / 2 ** 20)
+
+    n_workers = min(cores, max(1, budget_mb // MIN_HEAP_MB),
+                    max(1, math.ceil(n_molecules / min_shard)))
+    heap_mb = max(MIN_HEAP_MB, min(MAX_HEAP_MB, budget_mb // n_workers))
+    threads = max(1, cores // n_workers)
+
+    return n_workers, heap_mb, threads
+
+
+def _run_process(command, timeout=None):
+    # PaDEL in a new java process, killed after timeout seconds
+    try:
+        process = subprocess.run(command, stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise PaDELError(f"PaDEL did not finish in {timeout:.0f} s")
+
+    if process.returncode != 0:
+        raise PaDELError(f"PaDEL exit status {process.returncode}")
+
+
+def _run_shard(padel_path, arguments, heap_mb, timeout):
+    _run_process(padel_command(padel_path, arguments, f"{heap_mb}M"),
+                 timeout)
+
+
+def run_sharded(padel_path: str, descriptor_path: str, smi_path: str,
+                out_file: str, n_workers=None, heap_mb=None, threads=None):
+    """Run PaDEL on shards of a SMILES file in concurrent processes
+
+    Shard outputs are merged back in input order. Unset resources are
+    sized with `padel_resources`.
+
+    Args:
+        padel_path (str): Path to PaDEL folder
+        descriptor_path (str): Path to fingerprint XML file
+        smi_path (str): Path to SMILES file
+        out_file (str): Path to output CSV file
+        n_workers (int, optional): Number of PaDEL processes.
+        heap_mb (int, optional): Heap of each process (MB).
+        threads (int, optional): Threads of each process.
+
+    Returns:
+        str: Path to fingerprint CSV file
+    """
+    with open(smi_path) as smi_file:
+        lines = smi_file.readlines()
+
+    sizing = padel_resources(len(lines))
+    n_workers = n_workers or sizing[0]
+    heap_mb = heap_mb or sizing[1]
+    threads = threads or sizing[2]
+
+    shard_size = max(1, math.ceil(len(lines) / n_workers))
+    shards = []
+    for index, start in enumerate(range(0, len(lines), shard_size)):
+        shard_smi = f"{smi_path}.{index}.smi"
+        shard_out = f"{out_file}.{index}.csv"
+        with open(shard_smi, "w") as shard_file:
+            shard_file.writelines(lines[start:start + shard_size])
+        shards.append((shard_smi, shard_out))
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            runs = [executor.submit(
+                _run_shard, padel_path,
+                padel_arguments(descriptor_path, shard_smi, shard_out) +
+                ["-threads", str(threads)],
+                heap_mb, padel_timeout(shard_smi))
+                for shard_smi, shard_out in shards]
+            for run in runs:
+                run.result()
+
+        with open(out_file, "w") as merged:
+            for index, (_, shard_out) in enumerate(shards):
+                if not os.path.exists(shard_out):
+                    raise PaDELError(f"PaDEL failed on shard {index}")
+
+                with open(shard_out) as shard_file:
+                    header = shard_file.readline()
+                    if index == 0:
+                        merged.write(header)
+                    shutil.copyfileobj(shard_file, merged)
+
+    finally:
+        for shard_smi, shard_out in shards:
+            for path in (shard_smi, shard_out):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return out_file
+
+
+class PaDELWorker:
+    """Long-lived JVM running PaDEL-Descriptor requests.
+
+    The JVM runs the precompiled PaDELWorker class, which calls the
+    PaDEL descriptor API directly so one JVM serves every request. It
+    is started lazily on the first request, checked with a ping before
+    each request and restarted when it died or stopped answering.
+    Requests are serialized, one PaDEL run at a time. A JVM exceeding
+    the deadline of a request is killed, a new one is started for the
+    next request.
+    """
+
+    def __init__(self, padel_path: str, heap="2G", ping_timeout=10.0):
+        self.padel_path = os.path.abspath(padel_path)
+        self.heap = heap
+        self.ping_timeout = ping_timeout
+        self.process = None
+        self.lines = None
+        self.lock = threading.Lock()
+
+    def _command(self):
+        # The jar manifest adds the PaDEL libraries, as with java -jar
+        classpath = os.pathsep.join([
+            os.path.join(self.padel_path, "PaDEL-Descriptor.jar"),
+            self.padel_path])
+
+        return ["java", f"-Xms{self.heap}", f"-Xmx{self.heap}",
+                "-Djava.awt.headless=true", "-cp", classpath, "PaDELWorker"]
+
+    def _read_lines(self, stream, lines):
+        for line in stream:
+            lines.put(line.strip())
+        lines.put(None)
+
+    def _receive(self, timeout=None):
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            raise PaDELError("PaDEL worker did not answer")
+
+        if line is None:
+            raise PaDELError("PaDEL worker exited")
+
+        return line
+
+    def _send(self, line: str):
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise PaDELError("PaDEL worker exited")
+
+    def start(self):
+        """Start the JVM and wait for it to be ready"""
+        self.process = subprocess.Popen(self._command(),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        text=True, bufsize=1)
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_lines,
+                         args=(self.process.stdout, self.lines),
+                         daemon=True).start()
+
+        if self._receive(timeout=120) != "READY":
+            self.stop()
+            raise PaDELError("PaDEL worker failed to start")
+
+    def _answer(self, timeout=None):
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            self.kill()
+            return f"ERROR no answer in {timeout:.0f} s"
+
+        if line is None:
+            self.kill()
+            return "ERROR PaDEL worker exited"
+
+        return line
+
+    def kill(self):
+        """Kill the JVM, a new one is started on the next request"""
+        if self.process is None:
+            return
+
+        self.process.kill()
+        self.process.wait()
+        self.process = None
+
+    def stop(self):
+        """Stop the JVM"""
+        if self.process is None:
+            return
+
+        if self.process.poll() is None:
+            try:
+                self._send("QUIT")
+                self.process.wait(timeout=10)
+            except (PaDELError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+        self.process = None
+
+    def alive(self):
+        """Check worker health
+
+        Returns:
+            bool: True if the JVM answers a ping
+        """
+        if self.process is None or self.process.poll() is not None:
+            return False
+
+        try:
+            self._send("PING")
+            return self._receive(timeout=self.ping_timeout) == "PONG"
+        except PaDELError:
+            return False
+
+    def run(self, arguments: list, timeout=None):
+        """Run PaDEL with command line arguments
+
+        Args:
+            arguments (list): PaDEL arguments
+            timeout (float, optional): Seconds allowed before the JVM is
+                killed. Defaults to None.
+        """
+        with self.lock:
+            if not self.alive():
+                self.stop()
+                self.start()
+
+            self._send("\t".join(arguments))
+            answer = self._answer(timeout)
+
+            if answer != "OK":
+                raise PaDELError(answer)
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(padel_path: str):
+    """Get the worker shared by all sessions
+
+    Args:
+        padel_path (str): Path to PaDEL folder
+
+    Returns:
+        PaDELWorker: PaDEL worker
+    """
+    padel_path = os.path.abspath(padel_path)
+
+    with _workers_lock:
+        if padel_path not in _workers:
+            worker = PaDELWorker(padel_path)
+            atexit.register(worker.stop)
+            _workers[padel_path] = worker
+
+        return _workers[padel_path]
+
+
+def run_PaDEL(padel_path: str, data_path: str, selected_fp: str,
+              persistent=True, sharded=False):
+    """Run PaDEL sub process
+
+    Args:
+        padel_path (str): Path to PaDEL folder
+        data_path (str): Path to data folder
+        selected_fp (str): Selected fingerprint file to calc
+        persistent (bool, optional): Use the shared PaDEL worker,
+            falls back to a new java process. Defaults to True.
+        sharded (bool, optional): Split molecules across concurrent
+            PaDEL processes. Defaults to False.
+
+    Returns:
+        str: Path to fingerprint CSV file
+    """
+    smi_path = data_path + "/molecule.smi"
+    out_file = data_path + "/fingerprint.csv"
+
+    descriptor_path = padel_path + f"/{str(selected_fp)}"
+
+    arguments = padel_arguments(descriptor_path, smi_path, out_file)
+    timeout = padel_timeout(smi_path)
+    done = False
+
+    if os.path.exists(out_file):
+        os.remove(out_file)
+
+    try:
+        if sharded:
+            run_sharded(padel_path, descriptor_path, smi_path, out_file)
+            done = True
+
+        elif persistent:
+            try:
+                get_worker(padel_path).run(arguments, timeout)
+                done = True
+            except (PaDELError, OSError):
+                pass
+
+        if not done:
+            # Never keep the output of a failed run
+            if os.path.exists(out_file):
+                os.remove(out_file)
+
+            _run_process(padel_command(padel_path, arguments), timeout)
+
+    except BaseException:
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        raise
+
+    finally:
+        os.remove(smi_path)
+
+    return out_file
+
+
+def _canonical_smiles(smiles: str):
+    mol = Chem.MolFromSmiles(str(smiles))
+
+    return Chem.MolToSmiles(mol) if mol is not None else str(smiles)
+
+
+def cached_run_PaDEL(dataframe, padel_path: str, data_path: str,
+                     selected_fp: str, cache_path: str, sharded=False):
+    """Run PaDEL only for molecules missing from the fingerprint cache
+
+    Args:
+        dataframe (DataFrame): Molecule ID and SMILES columns
+        padel_path (str): Path to PaDEL folder
+        data_path (str): Path to data folder
+        selected_fp (str): Selected fingerprint file to calc
+        cache_path (str): Path to fingerprint cache
+        sharded (bool, optional): Split molecules across concurrent
+            PaDEL processes. Defaults to False.
+
+    Returns:
+        str: Path to fingerprint CSV file
+        int: Cache hits
+        int: Cache misses
+    """
+    id_column, smiles_column = dataframe.columns[:2]
+    smiles = [str(current_smiles) for current_smiles in
+              dataframe[smiles_column]]
+    canonical = [_canonical_smiles(current_smiles)
+                 for current_smiles in smiles]
+
+    with FingerprintCache(cache_path, selected_fp,
+                          " ".join(PADEL_OPTIONS)) as cache:
+        found = cache.get_many(canonical)
+        columns = cache.get_columns()
+
+        # First input SMILES of each missing molecule, named by position
+        missing = {}
+        for current_smiles, current_canonical in zip(smiles, canonical):
+            if current_canonical not in found:
+                missing.setdefault(current_canonical, current_smiles)
+
+        if missing:
+            missing_smiles = pd.DataFrame({
+                "smiles": list(missing.values()),
+                "name": [f"m{index}" for index in range(len(missing))]})
+            missing_smiles.to_csv(data_path + "/molecule.smi", sep="\t",
+                                  header=False, index=False)
+
+            fp_path = run_PaDEL(padel_path, data_path, selected_fp,
+                                sharded=sharded)
+            computed = pd.read_csv(fp_path, dtype=str,
+                                   keep_default_na=False)
+            columns = list(computed.columns[1:])
+
+            names = dict(zip(missing_smiles["name"], missing))
+            entries = {names[row[0]]: ",".join(row[1:])
+                       for row in computed.itertuples(index=False)
+                       if row[0] in names}
+
+            cache.set_columns(columns)
+            cache.set_many(entries)
+            found.update(entries)
+
+        hits, misses = cache.hits, cache.misses
+
+    columns = columns or []
+    empty = ",".join([""] * len(columns))
+    values = [found.get(current_canonical, empty).split(",")
+              for current_canonical in canonical]
+
+    fingerprint_df = pd.DataFrame(values, columns=columns)
+    fingerprint_df.insert(0, "Name", list(dataframe[id_column]))
+
+    out_file = data_path + "/fingerprint.csv"
+    fingerprint_df.to_csv(out_file, index=False)
+
+    return out_file, hits, misses
+
+
+def run_PaDEL_batches(dataframe, padel_path: str, data_path: str,
+                      selected_fp: str, cache_path=None, sharded=False,
+                      batch_size=PADEL_BATCH_SIZE, callback=None):
+    """Run PaDEL on successive batches of molecules
+
+    Batch outputs are appended to one fingerprint CSV in input order.
+    Progress is reported after each batch, an exception raised by the
+    callback stops the run before the next batch.
+
+    Args:
+        dataframe (DataFrame): Molecule ID and SMILES columns
+        padel_path (str): Path to PaDEL folder
+        data_path (str): Path to data folder
+        selected_fp (str): Selected fingerprint file to calc
+        cache_path (str, optional): Path to fingerprint cache.
+            Defaults to None (no cache).
+        sharded (bool, optional): Split each batch across concurrent
+            PaDEL processes. Defaults to False.
+        batch_size (int, optional): Molecules per batch (per PaDEL
+            process when sharded). Defaults to PADEL_BATCH_SIZE.
+        callback (function, optional): Called with (done, total) after
+            each batch. Defaults to None.
+
+    Returns:
+        str: Path to fingerprint CSV file
+        int: Cache hits
+        int: Cache misses
+    """
+    if sharded:
+        batch_size *= padel_resources(len(dataframe))[0]
+
+    out_file = data_path + "/fingerprint.csv"
+    batch_path = tempfile.mkdtemp(dir=data_path)
+    hits = misses = 0
+
+    try:
+        with open(out_file, "w") as merged:
+            for start in range(0, len(dataframe), batch_size):
+                batch = dataframe.iloc[start:start + batch_size]
+
+                if cache_path:
+                    fp_path, batch_hits, batch_misses = cached_run_PaDEL(
+                        batch, padel_path, batch_path, selected_fp,
+                        cache_path, sharded)
+                    hits += batch_hits
+                    misses += batch_misses
+                else:
+                    # SMILES file: SMILES then molecule ID
+                    batch[batch.columns[1::-1]].to_csv(
+                        batch_path + "/molecule.smi", sep="\t",
+                        header=False, index=False)
+                    fp_path = run_PaDEL(padel_path, batch_path, selected_fp,
+                                        sharded=sharded)
+
+                with open(fp_path) as batch_file:
+                    header = batch_file.readline()
+                    if start == 0:
+                        merged.write(header)
+                    shutil.copyfileobj(batch_file, merged)
+                os.remove(fp_path)
+
+                if callback is not None:
+                    callback(start + len(batch), len(dataframe))
+
+    except BaseException:
+        os.remove(out_file)
+        raise
+
+    finally:
+        shutil.rmtree(batch_path, ignore_errors=True)
+
+    return out_file, hits, misses
@@ -0,0 +1,193 @@
+"""
+In-memory cleaner pipeline
+
+version: 1.0.0
+"""
+
+
+from contextlib import contextmanager
+from itertools import count
+
+import pandas as pd
+import streamlit as st
+
+from .metrics import get_metrics_log
+
+# Shared by all pipelines, so versions of different sessions never match
+_versions = count()
+
+
+class Pipeline:
+    """Dataset shared by the cleaner stages during a session.
+
+    The dataset is loaded once and kept in memory, each stage replaces
+    the current dataframe and the file on disk is only written when a
+    checkpoint is requested. Checkpoints are Parquet files, dtypes are
+    kept exactly and readers can load a subset of columns. Stages return
+    new dataframes, the current one may be shared with the upload cache
+    and is never modified in place. `version` changes whenever the
+    dataframe is replaced, a cheap key for caches derived from it.
+    """
+
+    def __init__(self, dataframe, path: str):
+        self.dataframe = dataframe
+        self.path = path
+        self.version = next(_versions)
+
+    def update(self, dataframe):
+        """Replace current dataframe
+
+        Args:
+            dataframe (DataFrame): Processed dataframe
+
+        Returns:
+            int: Number of rows removed
+        """
+        counter = self.dataframe.shape[0] - dataframe.shape[0]
+        self.dataframe = dataframe
+        self.version = next(_versions)
+
+        return counter
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure a stage updating the pipeline (see `measure`)
+
+        Rows in and out are taken from the dataframe before and after
+        the stage.
+
+        Args:
+            name (str): Stage name
+
+        Yields:
+            dict: Stage record
+        """
+        with get_metrics_log().measure(name, len(self.dataframe)) as record:
+            yield record
+            record["rows_out"] = len(self.dataframe)
+
+    def checkpoint(self):
+        """Write current dataframe to disk
+
+        Returns:
+            str: Path to checkpoint file
+        """
+        return write_checkpoint(self.dataframe, self.path)
+
+    def restore(self):
+        """Load last checkpoint from disk
+
+        Returns:
+            DataFrame: Restored dataframe
+        """
+        self.dataframe = read_checkpoint(self.path)
+        self.version = next(_versions)
+
+        return self.dataframe
+
+
+def arrow_compatible(dataframe):
+    """Store object columns mixing types (e.g. numbers and text) as text
+
+    Args:
+        dataframe (DataFrame): Dataframe
+
+    Returns:
+        DataFrame: Dataframe accepted by Arrow
+    """
+    dataframe = dataframe.copy()
+    for column in dataframe.columns[dataframe.dtypes == object]:
+        values = dataframe[column]
+        if pd.api.types.infer_dtype(values, skipna=True) not in (
+                "string", "empty", "bytes", "boolean"):
+            dataframe[column] = values.where(values.isna(),
+                                             values.astype(str))
+
+    return dataframe
+
+
+def write_checkpoint(dataframe, path: str):
+    """Write dataframe to a Parquet checkpoint
+
+    Args:
+        dataframe (DataFrame): Dataframe
+        path (str): Checkpoint path
+
+    Returns:
+        str: Checkpoint path
+    """
+    try:
+        dataframe.to_parquet(path, index=False)
+    except (TypeError, ValueError):
+        # pyarrow errors subclass TypeError/ValueError
+        arrow_compatible(dataframe).to_parquet(path, index=False)
+
+    return path
+
+
+def read_checkpoint(path: str, columns=None):
+    """Read a Parquet checkpoint
+
+    Args:
+        path (str): Checkpoint path
+        columns (list, optional): Columns loaded. Defaults to all columns.
+
+    Returns:
+        DataFrame: Checkpoint dataframe
+    """
+    return pd.read_parquet(path, columns=columns)
+
+
+def checkpoint_columns(path: str):
+    """Column names of a Parquet checkpoint, without reading data
+
+    Args:
+        path (str): Checkpoint path
+
+    Returns:
+        list: Column names
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_schema(path).names
+
+
+def checkpoint_chunks(path: str, chunk_size=100000):
+    """Read a Parquet checkpoint in chunks
+
+    Args:
+        path (str): Checkpoint path
+        chunk_size (int, optional): Rows per chunk. Defaults to 100000.
+
+    Yields:
+        DataFrame: Chunk of the checkpoint
+    """
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(chunk_size):
+        yield batch.to_pandas()
+
+
+def get_pipeline():
+    """Get pipeline of current session
+
+    Returns:
+        Pipeline: Session pipeline (None if not loaded)
+    """
+    return st.session_state.get("pipeline", None)
+
+
+def set_pipeline(dataframe, path: str):
+    """Create pipeline for current session
+
+    Args:
+        dataframe (DataFrame): Uploaded dataframe
+        path (str): Path to checkpoint file
+
+    Returns:
+        Pipeline: Session pipeline
+    """
+    pipeline = Pipeline(dataframe, path)
+    st.session_state["pipeline"] = pipeline
+
+    return pipeline
@@ -1,31 +1,65 @@
+import os
+
 import pandas as pd
-from rdkit import Chem
 import streamlit as st
-from tqdm import tqdm
-from chembl_structure_pipeline import standardizer
 
-from .utils import convert_threshold, process_duplicates
+from .cache import SmilesCache
+from .jobs import (get_runner, get_session_job, release_session_job,
+                   set_session_job)
+from .metrics import get_metrics_log, measure
+from .utils import (convert_threshold, process_duplicates,
+                    standardize_smiles, cached_standardize_smiles,
+                    remove_invalid_smiles, STANDARDIZER_VERSION,
+                    MOLAR_UNITS, MASS_UNITS, OUTPUT_UNITS,
+                    DUPLICATE_POLICIES, AGGREGATE_POLICIES, ELEMENTS,
+                    DEFAULT_ELEMENTS, filter_elements, filter_organisms,
+                    remove_outliers, shuffle_rows)
+
+SMILES_CACHE_PATH = "./csv_handler/core/files/smiles_cache.sqlite"
+
+# SMILES between progress reports of background standardization
+JOB_CHUNK_SIZE = 200
+
+
+def _standardize_job(smiles, use_cache, n_jobs, timeout, progress=None):
+    # Runs as a background job, without any display
+    with measure("standardize", len(smiles)) as record:
+        if use_cache:
+            with SmilesCache(SMILES_CACHE_PATH,
+                             STANDARDIZER_VERSION) as cache:
+                std_list = cached_standardize_smiles(
+                    smiles, cache, n_jobs=n_jobs, timeout=timeout,
+                    chunk_size=JOB_CHUNK_SIZE, callback=progress)
+            record.update(cache_hits=cache.hits, cache_misses=cache.misses)
+        else:
+            std_list = standardize_smiles(smiles, n_jobs=n_jobs,
+                                          timeout=timeout,
+                                          chunk_size=JOB_CHUNK_SIZE,
+                                          callback=progress)
+
+    return pd.Series(std_list, index=smiles.index,
+                     name=str(smiles.name)), record
 
 
 class Utils:
-    def shuffle_rows(path: str, delimiter=","):
+    def shuffle_rows(pipeline):
         """Shuffle rows
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Shuffle rows"):
             st.markdown("""###### Shuffle rows""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
+            dataframe = pipeline.dataframe
 
             if st.button("Shuffle"):
-                shuffle = dataframe.sample(frac=1)
+                with pipeline.stage("shuffle"):
+                    shuffle = shuffle_rows(dataframe)
 
-                shuffle.to_csv(path, index=False, sep=delimiter)
+                    pipeline.update(shuffle)
                 return True
 
             else:
@@ -33,73 +67,66 @@ class Utils:
 
 
 class Remover:
-    def remove_nan(path: str, delimiter=","):
+    def remove_nan(pipeline):
         """Remove rows with NaN values
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Remove NaN"):
             st.markdown("""###### Remove NaN""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
+            dataframe = pipeline.dataframe
 
             if st.button("Remove NaN"):
-                drop = dataframe.dropna(inplace=False)
+                with pipeline.stage("remove_nan"):
+                    drop = dataframe.dropna(inplace=False)
 
-                counter = dataframe.shape[0] - drop.shape[0]
+                    counter = pipeline.update(drop)
                 st.write(f"Rows removed: {counter}")
-                drop.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
                 return False
 
-    def remove_outlier(path: str, delimiter=","):
+    def remove_outlier(pipeline):
         """Remove outliers
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Remove Outliers"):
             st.markdown("""###### Remove Outliers""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
+            dataframe = pipeline.dataframe
 
             if st.button("Remove Outliers"):
-                shape_init = dataframe.shape[0]
-
-                dataframe = dataframe[(dataframe["Labels"] > dataframe[
-                    "Labels"].quantile(0.1)) & (dataframe[
-                        "Labels"] < dataframe["Labels"].quantile(0.9))]
+                with pipeline.stage("remove_outliers"):
+                    dataframe = remove_outliers(dataframe, "Labels")
 
-                counter = shape_init - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
                 return False
 
-    def select_strains(path: str, delimiter=","):
+    def select_strains(pipeline):
         """Shuffle rows
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Filter Organism"):
             st.markdown("""###### Filter Organism""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
+            dataframe = pipeline.dataframe
 
             try:
                 organism_column = st.selectbox("Organism Column",
@@ -114,33 +141,31 @@ class Remover:
                 selected_organism = st.multiselect("Select target organisms",
                                                    unique_organism)
 
-            shape = dataframe.shape[0]
-
             if st.button("Filter Organism"):
-                dataframe = dataframe[dataframe[str(organism_column)].isin(
-                    list(selected_organism))]
+                with pipeline.stage("filter_organisms"):
+                    dataframe = filter_organisms(dataframe,
+                                                 str(organism_column),
+                                                 selected_organism)
 
-                counter = shape - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
                 return False
 
-    def filter_elements(path: str, delimiter=","):
+    def filter_elements(pipeline):
         """Filter SMILES elements
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Filter Elements"):
             st.markdown("""###### Filter Elements""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
+            dataframe = pipeline.dataframe
 
             try:
                 smiles_column = st.selectbox("SMILES Column", ["Smiles"])
@@ -150,30 +175,20 @@ class Remover:
                 smiles_column = st.selectbox("SMILES Column", df_columns)
                 smiles = dataframe[str(smiles_column)]
 
-            if st.button("Filter Elements"):
-                shape = dataframe.shape[0]
-                valid_smiles = "C", "O", "N", "S", "P", "F", "I", "Br", "Cl"
-                flag_list = []
-
-                for current_smiles in smiles:
-                    mol = Chem.MolFromSmiles(str(current_smiles))
-                    valid_flag = True
-
-                    for current_atom in mol.GetAtoms():
-                        atom = current_atom.GetSymbol()
-
-                        if atom in valid_smiles:
-                            continue
-                        else:
-                            valid_flag = False
+            allowed = st.multiselect("Allowed elements", ELEMENTS,
+                                     list(DEFAULT_ELEMENTS))
+            parallel = st.checkbox("Parallel mode", value=False,
+                                   key="filter_elements_parallel")
+            n_jobs = (os.cpu_count() or 1) if parallel else 1
 
-                    flag_list.append(valid_flag)
-
-                dataframe = dataframe[flag_list]
+            if st.button("Filter Elements"):
+                with pipeline.stage("filter_elements"):
+                    flag_list = filter_elements(smiles, allowed,
+                                                n_jobs=n_jobs)
+                    dataframe = dataframe[flag_list]
 
-                counter = shape - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
@@ -181,21 +196,21 @@ class Remover:
 
 
 class Calc:
-    def select_threshold(path: str, delimiter=","):
+    def select_threshold(pipeline):
         """Calculate and select threshold for standard values
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Select threshold"):
             st.markdown("""###### Select threshold""")
-            st.markdown("""(Supported units: `ug.mL-1`, `nM`, `uM`)""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
-            shape = dataframe.shape[0]
+            supported = ", ".join(f"`{unit}`" for unit in
+                                  list(MOLAR_UNITS) + list(MASS_UNITS))
+            st.markdown(f"""(Supported units: {supported})""")
+            dataframe = pipeline.dataframe
 
             text = ("Select: Standard Value, Standard Units, "
                     "Molecular Weight (IN THIS ORDER)")
@@ -205,18 +220,14 @@ class Calc:
                 index_thr = list(dataframe.columns)
                 selected_columns = st.multiselect(text, index_thr, default)
 
-                units_dict = {"uM": "uM", "nM": "nM"}
-                user_threshold_unit = st.selectbox("Choose unit for threshold",
-                                                   list(units_dict.keys()))
-                selected_unit = units_dict[user_threshold_unit]
+                selected_unit = st.selectbox("Choose unit for threshold",
+                                             list(OUTPUT_UNITS.keys()))
             except st.errors.StreamlitAPIException:
                 index_thr = list(dataframe.columns)
                 selected_columns = st.multiselect(text, index_thr, None)
 
-                units_dict = {"uM": "uM", "nM": "nM"}
-                user_threshold_unit = st.selectbox("Choose unit for threshold",
-                                                   list(units_dict.keys()))
-                selected_unit = units_dict[user_threshold_unit]
+                selected_unit = st.selectbox("Choose unit for threshold",
+                                             list(OUTPUT_UNITS.keys()))
 
             try:
                 threshold_value = float(st.text_input("Threshold value",
@@ -226,31 +237,30 @@ class Calc:
                          "(Decimal separator is '.')")
 
             if st.button("Convert values"):
-                dataframe = convert_threshold(dataframe, threshold_value,
-                                              selected_unit, selected_columns)
+                with pipeline.stage("threshold"):
+                    dataframe = convert_threshold(dataframe, threshold_value,
+                                                  selected_unit,
+                                                  selected_columns)
 
-                counter = shape - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
                 return False
 
-    def check_duplicates(path: str, delimiter=","):
+    def check_duplicates(pipeline):
         """check and process duplicated data
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Check duplicates"):
             st.markdown("""###### Check duplicates""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
-            shape = dataframe.shape[0]
+            dataframe = pipeline.dataframe
 
             text = ("Select: Smiles, Activity, "
                     "Converted Value (IN THIS ORDER)")
@@ -263,31 +273,40 @@ class Calc:
                 index_id = list(dataframe.columns)
                 selected_duplicates = st.multiselect(text, index_id, None)
 
+            user_policy = st.selectbox("Replicate value policy",
+                                       list(DUPLICATE_POLICIES.keys()))
+            if DUPLICATE_POLICIES[user_policy] in AGGREGATE_POLICIES:
+                st.write("Molecules with conflicting activity are dropped")
+                drop_conflicts = True
+            else:
+                drop_conflicts = st.checkbox(
+                    "Drop molecules with conflicting activity", value=True)
+
             if st.button("Check duplicates"):
-                dataframe = process_duplicates(dataframe, selected_duplicates)
+                with pipeline.stage("duplicates"):
+                    dataframe = process_duplicates(
+                        dataframe, selected_duplicates,
+                        DUPLICATE_POLICIES[user_policy], drop_conflicts)
 
-                counter = shape - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
                 return False
 
-    def check_duplicates_simple(path: str, delimiter=","):
+    def check_duplicates_simple(pipeline):
         """check and process duplicated data
 
         Args:
-            path (str): path to csv file
-            delimiter (str, optional): cvs file delimiter. Defaults to ",".
+            pipeline (Pipeline): session pipeline
 
         Returns:
             bool: execution flag
         """
         with st.expander("Check duplicates (simple)"):
             st.markdown("""###### Check duplicates (simple)""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
-            shape = dataframe.shape[0]
+            dataframe = pipeline.dataframe
 
             try:
                 duplicate_col = [st.selectbox("Select Smiles column",
@@ -299,11 +318,11 @@ class Calc:
                     "Select Smiles column", index_id)]
 
             if st.button("Check simple duplicates"):
-                dataframe = process_duplicates(dataframe, duplicate_col)
+                with pipeline.stage("duplicates_simple"):
+                    dataframe = process_duplicates(dataframe, duplicate_col)
 
-                counter = shape - dataframe.shape[0]
+                    counter = pipeline.update(dataframe)
                 st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
                 return True
 
             else:
@@ -311,11 +330,10 @@ class Calc:
 
 
 class Standardize:
-    def standardize_smiles(path: str, delimiter=","):
+    def standardize_smiles(pipeline):
         with st.expander("Standardize SMILES"):
             st.markdown("""###### Standardize SMILES""")
-            dataframe = pd.read_csv(path, delimiter=delimiter)
-            shape = dataframe.shape[0]
+            dataframe = pipeline.dataframe
 
             try:
                 smiles_column = st.selectbox("Smiles Column", ["Smiles"])
@@ -325,45 +343,73 @@ class Standardize:
                 smiles_column = st.selectbox("Smiles Column", df_columns)
                 smiles = dataframe[str(smiles_column)]
 
-            if st.button("Standardize SMILES"):
-
-                std_list = []
-                for current_smiles in tqdm(smiles):
-                    mol = Chem.MolFromSmiles(str(current_smiles),
-                                             sanitize=True)
-
-                    if mol is not None:
-                        std_mol = standardizer.standardize_mol(mol)
-                        parent_mol, _ = standardizer.get_parent_mol(std_mol)
+            parallel = st.checkbox("Parallel mode", value=False,
+                                   key="standardize_parallel")
+            if parallel:
+                n_jobs = int(st.number_input("Worker processes",
+                                             min_value=1,
+                                             value=os.cpu_count() or 1))
+            else:
+                n_jobs = 1
 
-                        if len(parent_mol.GetAtoms()) < 2:
-                            std_list.append("remove")
+            # Enforced in worker processes, also without parallel mode
+            timeout = float(st.number_input(
+                "Timeout per molecule (s, 0 for none)", min_value=0.0,
+                value=10.0)) or None
 
-                        else:
-                            check = Chem.MolFromSmiles(
-                                Chem.MolToSmiles((parent_mol)))
+            use_cache = st.checkbox("Use standardization cache", value=True)
 
-                            if check is not None:
-                                std_list.append(Chem.MolToSmiles((parent_mol)))
-                            else:
-                                std_list.append("remove")
+            job = get_session_job("standardize")
+            if job is not None and job.finished:
+                return Standardize._collect(pipeline, job)
 
-                    else:
-                        std_list.append(Chem.MolToSmiles(parent_mol))
+            if job is not None:
+                st.info("Standardization running in the background, "
+                        "see the sidebar for progress.")
+                return False
 
-                dataframe[str(smiles_column)] = std_list
+            if st.button("Standardize SMILES"):
+                job = get_runner().submit("Standardize SMILES",
+                                          _standardize_job, smiles,
+                                          use_cache, n_jobs, timeout,
+                                          total=len(smiles))
+                set_session_job("standardize", job)
+                st.info("Standardization started in the background.")
 
-                for index, row in dataframe.iterrows():
-                    if "." in row["Smiles"]:
-                        dataframe.drop(index, inplace=True)
+            return False
 
-                    elif "remove" in row["Smiles"]:
-                        dataframe.drop(index, inplace=True)
+    def _collect(pipeline, job):
+        """Apply a finished standardization job to the pipeline
 
-                counter = shape - dataframe.shape[0]
-                st.write(f"Rows removed: {counter}")
-                dataframe.to_csv(path, index=False, sep=delimiter)
-                return True
+        Args:
+            pipeline (Pipeline): session pipeline
+            job (Job): finished standardization job
 
-            else:
-                return False
+        Returns:
+            bool: execution flag
+        """
+        release_session_job("standardize")
+
+        if job.status != "done":
+            st.warning(f"Standardization {job.status}" +
+                       (f": {job.error}" if job.error else ""))
+            return False
+
+        std_list, record = job.result
+        dataframe = pipeline.dataframe.copy()
+
+        # Rows removed by other stages meanwhile are skipped
+        dataframe[std_list.name] = std_list.reindex(dataframe.index)
+        dataframe = remove_invalid_smiles(dataframe, std_list.name)
+
+        rows_in = len(pipeline.dataframe)
+        counter = pipeline.update(dataframe)
+        get_metrics_log().add(dict(record, rows_in=rows_in,
+                                   rows_out=len(dataframe),
+                                   removed=counter))
+
+        if "cache_hits" in record:
+            st.write(f"Cache hits: {record['cache_hits']} | "
+                     f"Cache misses: {record['cache_misses']}")
+        st.write(f"Rows removed: {counter}")
+        return True
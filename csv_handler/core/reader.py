@@ -0,0 +1,265 @@
+"""
+Projected CSV reading
+
+version: 1.0.0
+"""
+
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Columns kept by default from ChEMBL activity exports
+CHEMBL_COLUMNS = ["Molecule ChEMBL ID", "Molecular Weight", "Smiles",
+                  "Standard Value", "Standard Units", "Assay Organism"]
+
+# Columns offered as row filters when present in the file
+FILTER_COLUMNS = ["Assay Organism", "Target Organism", "Standard Type",
+                  "Standard Units"]
+
+# Memory kept by parsed uploads shared by all sessions (bytes)
+UPLOAD_CACHE_BYTES = 512 * 2 ** 20
+
+
+class UploadCache:
+    """Parsed uploads kept in memory across reruns.
+
+    Entries are evicted least recently used first once their total size
+    exceeds `max_bytes`. Shared by all sessions of the process.
+    """
+
+    def __init__(self, max_bytes=UPLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached value
+
+        Args:
+            key (tuple): Entry key
+
+        Returns:
+            object: Cached value (None if missing)
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def set(self, key, value, size: int):
+        """Store a value
+
+        Args:
+            key (tuple): Entry key
+            value (object): Value
+            size (int): Value size (bytes)
+        """
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+
+upload_cache = UploadCache()
+
+
+def content_hash(file):
+    """Hash of a file object content
+
+    Args:
+        file (file): Binary file object
+
+    Returns:
+        str: Hex digest
+    """
+    if hasattr(file, "getbuffer"):
+        return hashlib.blake2b(file.getbuffer()).hexdigest()
+
+    file.seek(0)
+    digest = hashlib.blake2b()
+    for block in iter(lambda: file.read(2 ** 20), b""):
+        digest.update(block)
+    file.seek(0)
+
+    return digest.hexdigest()
+
+
+def csv_columns(file, delimiter=","):
+    """Read column names from the header only
+
+    Args:
+        file (file): CSV path or file object
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+
+    Returns:
+        list: Column names
+    """
+    if hasattr(file, "seek"):
+        file.seek(0)
+    columns = list(pd.read_csv(file, delimiter=delimiter, nrows=0).columns)
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    return columns
+
+
+def csv_unique(file, column: str, delimiter=",", chunksize=100000):
+    """Distinct values of a column, reading that column only
+
+    Args:
+        file (file): CSV path or file object
+        column (str): Column name
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        chunksize (int, optional): Rows read at once. Defaults to 100000.
+
+    Returns:
+        list: Distinct values, sorted
+    """
+    key = ("unique", content_hash(file), delimiter, column)
+    cached = upload_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    values = set()
+    for chunk in read_csv_chunks(file, delimiter, [column], None, chunksize):
+        values.update(chunk[column].dropna().unique())
+
+    values = sorted(values, key=str)
+    upload_cache.set(key, tuple(values),
+                     sum(len(str(value)) for value in values) + 64)
+
+    return values
+
+
+def read_csv_chunks(file, delimiter=",", columns=None, filters=None,
+                    chunksize=100000):
+    """Read selected columns and rows chunk by chunk
+
+    Only the selected and filtered columns are parsed, rows failing a
+    filter are dropped before the next chunk is read.
+
+    Args:
+        file (file): CSV path or file object
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+        filters (dict, optional): {column: allowed values}.
+            Defaults to None.
+        chunksize (int, optional): Rows read at once. Defaults to 100000.
+
+    Yields:
+        DataFrame: Filtered chunk with the selected columns
+    """
+    filters = filters or {}
+    usecols = None
+    if columns is not None:
+        usecols = list(columns) + [column for column in filters
+                                   if column not in columns]
+
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    reader = pd.read_csv(file, delimiter=delimiter, usecols=usecols,
+                         chunksize=chunksize)
+
+    for chunk in reader:
+        for column, allowed in filters.items():
+            chunk = chunk[chunk[column].isin(list(allowed))]
+
+        if columns is not None:
+            chunk = chunk[list(columns)]
+
+        yield chunk
+
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+
+def read_csv_projected(file, delimiter=",", columns=None, filters=None,
+                       chunksize=100000):
+    """Load selected columns and rows of a CSV file
+
+    Args:
+        file (file): CSV path or file object
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+        filters (dict, optional): {column: allowed values}.
+            Defaults to None.
+        chunksize (int, optional): Rows read at once. Defaults to 100000.
+
+    Returns:
+        DataFrame: Loaded dataframe
+    """
+    chunks = list(read_csv_chunks(file, delimiter, columns, filters,
+                                  chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=columns or csv_columns(file, delimiter))
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def csv_read_key(file, delimiter=",", columns=None, filters=None):
+    """Cache key of a projected read, also identifies the loaded data
+
+    Args:
+        file (file): CSV file object
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+        filters (dict, optional): {column: allowed values}.
+            Defaults to None.
+
+    Returns:
+        tuple: Content hash, delimiter, columns and filters
+    """
+    frozen_filters = tuple(sorted((column, tuple(map(str, allowed)))
+                                  for column, allowed in
+                                  (filters or {}).items()))
+
+    return ("csv", content_hash(file), delimiter,
+            tuple(columns) if columns else None, frozen_filters)
+
+
+def cached_read_csv(file, delimiter=",", columns=None, filters=None,
+                    key=None):
+    """Load selected columns and rows, reusing earlier parses
+
+    Parsed dataframes are cached by content hash, delimiter, columns and
+    filters. The cached dataframe itself is returned, callers modifying
+    it in place must copy it first.
+
+    Args:
+        file (file): CSV file object
+        delimiter (str, optional): CSV delimiter. Defaults to ",".
+        columns (list, optional): Selected columns. Defaults to all.
+        filters (dict, optional): {column: allowed values}.
+            Defaults to None.
+        key (tuple, optional): Key from `csv_read_key`, computed when
+            not given. Defaults to None.
+
+    Returns:
+        DataFrame: Loaded dataframe
+    """
+    if key is None:
+        key = csv_read_key(file, delimiter, columns, filters)
+
+    dataframe = upload_cache.get(key)
+    if dataframe is None:
+        dataframe = read_csv_projected(file, delimiter, columns, filters)
+        upload_cache.set(key, dataframe,
+                         int(dataframe.memory_usage(deep=True).sum()))
+
+    return dataframe
@@ -9,8 +9,24 @@ date: 04/01/2022
 from rdkit.Chem.PandasTools import LoadSDF
 import streamlit as st
 import pandas as pd
+import math
 import os
-import subprocess
+import time
+from functools import lru_cache
+
+from .fingerprints import (RDKIT_FINGERPRINTS, rdkit_fingerprints,
+                           bit_columns, save_fingerprints,
+                           csv_to_fingerprints, FingerprintStore)
+from .export import (EXPORT_FORMATS, FINGERPRINT_FORMATS, export_chunks,
+                     export_dataframe, export_fingerprints, remove_export)
+from .reader import (FILTER_COLUMNS, cached_read_csv, csv_columns,
+                     csv_read_key, csv_unique)
+from .padel import PADEL_FINGERPRINTS, run_PaDEL_batches
+from .pipeline import checkpoint_chunks
+from .jobs import get_runner, session_jobs, set_session_job
+from .workspace import QuotaExceeded, get_workspace
+
+FINGERPRINT_CACHE_PATH = "./csv_handler/core/files/fingerprint_cache.sqlite"
 
 
 def csv_download(dataframe, file_name: str, disp_text: str, sidebar=True):
@@ -63,38 +79,161 @@ def generic_download(file, mime: str, file_name: str,
                            mime=mime,)
 
 
-def run_PaDEL(padel_path: str, data_path: str, selected_fp: str):
-    """Run PaDEL sub process
+def _duration(seconds: float):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
 
-    Args:
-        padel_path (str): Path to PaDEL folder
-        data_path (str): Path to data folder
-        selected_fp (str): Selected fingerprint file to calc
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
 
-    Returns:
-        str: Path to fingerprint CSV file
-    """
-    smi_path = data_path + "/molecule.smi"
-    out_file = data_path + "/fingerprint.csv"
 
-    jar_path = padel_path + "/PaDEL-Descriptor.jar"
-    descriptor_path = padel_path + f"/{str(selected_fp)}"
+def _job_text(job):
+    text = f"{job.name}: {job.status}"
+    if job.total:
+        text += f" | {job.done}/{job.total} molecules"
+    if job.throughput:
+        text += f" | {job.throughput:.1f} molecules/s"
+    if job.eta is not None:
+        text += f" | ETA {_duration(job.eta)}"
+
+    return text
+
+
+def _job_percent(job):
+    if job.status == "done":
+        return 100
+    if not job.total:
+        return 0
+
+    return min(100, int(100 * job.done / job.total))
+
+
+def _page_controls(n_rows: int, n_columns: int, key: str,
+                   rows_per_page: int, columns_per_page: int):
+    # Page selectors, only the selected page is sent to the browser
+    n_row_pages = max(1, math.ceil(n_rows / rows_per_page))
+    n_column_pages = max(1, math.ceil(n_columns / columns_per_page))
+
+    col_rows, col_columns = st.columns(2)
+    row_page = col_rows.number_input(f"Row page (of {n_row_pages})",
+                                     min_value=1, max_value=n_row_pages,
+                                     value=1, key=f"{key}_row_page")
+    column_page = col_columns.number_input(
+        f"Column page (of {n_column_pages})", min_value=1,
+        max_value=n_column_pages, value=1, key=f"{key}_column_page")
+
+    row_start = (int(row_page) - 1) * rows_per_page
+    row_stop = min(n_rows, row_start + rows_per_page)
+    column_start = (int(column_page) - 1) * columns_per_page
+    column_stop = min(n_columns, column_start + columns_per_page)
+
+    return (row_start, row_stop), (column_start, column_stop)
+
+
+def _page_caption(n_rows: int, n_columns: int, rows: tuple, columns: tuple):
+    st.caption(f"Rows {rows[0] + 1}-{rows[1]} of {n_rows}, "
+               f"columns {columns[0] + 1}-{columns[1]} of {n_columns}")
+
+
+def _sorted_positions(dataframe, column: str, ascending: bool, key: str,
+                      version=None):
+    # Sort order kept across reruns until the data version, the column
+    # or the direction change, paging only slices it
+    sort_key = (version, column, ascending)
+    cached = st.session_state.get(f"{key}_sorted", None)
+    if version is not None and cached is not None and cached[0] == sort_key:
+        return cached[1]
+
+    values = dataframe[column].reset_index(drop=True)
+    try:
+        ordered = values.sort_values(ascending=ascending, kind="mergesort")
+    except TypeError:
+        # Mixed types are sorted as text
+        ordered = values.astype(str).sort_values(ascending=ascending,
+                                                 kind="mergesort")
+
+    st.session_state[f"{key}_sorted"] = (sort_key, ordered.index)
+
+    return ordered.index
+
+
+def _export_download(key: str, token, formats: dict, write, name: str,
+                     description: str):
+    # The file is written only when requested and reused until the
+    # data (token) or the format changes
+    out_format = st.selectbox("Download format", list(formats.keys()),
+                              key=f"{key}_format")
+    suffix, mime = formats[out_format]
+    state_key = f"{key}_export"
+
+    prepared = st.session_state.get(state_key, None)
+    if prepared and prepared[1] != (token(), out_format):
+        remove_export(prepared[0])
+        del st.session_state[state_key]
+        prepared = None
+
+    if prepared is None and st.button("Prepare download",
+                                      key=f"{key}_prepare"):
+        workspace = get_workspace()
+        try:
+            workspace.check_quota()
+        except QuotaExceeded as error:
+            st.error(str(error))
+            return
+
+        out_path = workspace.mkstemp(suffix)
+        with st.spinner("Preparing download"):
+            write(out_path, out_format)
+
+        prepared = (out_path, (token(), out_format))
+        st.session_state[state_key] = prepared
+
+    if prepared:
+        with open(prepared[0], "rb") as out_file:
+            generic_download(out_file, mime, f"{name}{suffix}", description,
+                             sidebar=False)
 
-    options = "-removesalt -standardizenitro -fingerprints"
 
-    bashCommand = (f"java -Xms2G -Xmx2G -Djava.awt.headless=true "
-                   f"-jar {jar_path} {options} "
-                   f"-descriptortypes {descriptor_path} "
-                   f"-dir {smi_path} -file {out_file}")
+@lru_cache(maxsize=4)
+def _example_payload(path: str, delimiter: str):
+    # Bundled example files never change, prepared once per process
+    dataframe = pd.read_csv(path, delimiter=delimiter)
 
-    process = subprocess.Popen(bashCommand.split(), stdout=subprocess.PIPE)
-    output, error = process.communicate()
-    os.remove(f"{smi_path}")
+    return dataframe.to_csv(index=False, encoding="utf-8")
 
-    return out_file
+
+def _checkpoint_example(path: str):
+    # Checkpoints change during the session: written to a CSV file in
+    # the workspace chunk by chunk, rewritten when the checkpoint changes
+    version = (path, os.stat(path).st_mtime_ns)
+    prepared = st.session_state.get("example_export", None)
+    if prepared and prepared[1] == version:
+        return prepared[0]
+
+    if prepared:
+        remove_export(prepared[0])
+        del st.session_state["example_export"]
+
+    out_path = get_workspace().mkstemp(".csv")
+    export_chunks(checkpoint_chunks(path), out_path, "CSV")
+    st.session_state["example_export"] = (out_path, version)
+
+    return out_path
 
 
 class IO:
+    def sb_csv_delimiter():
+        """Select CSV delimiter
+
+        Returns:
+            str: Selected delimiter
+        """
+        with st.sidebar.header("""Please select the CSV delimiter"""):
+            delimiter_dict = {",": ",", ";": ";"}
+            user_delimiter = st.sidebar.selectbox("Choose CSV file delimiter",
+                                                  list(delimiter_dict.keys()))
+
+            return delimiter_dict[user_delimiter]
+
     def sb_csv_read_dataframe(file):
         """Load UploadedFile CSV into pandas dataframe
 
@@ -102,21 +241,54 @@ class IO:
             file (UploadedFile): File to be loaded
 
         Returns:
-            DataFrame: loaded dataframe
+            DataFrame: loaded dataframe, shared with the upload cache
         """
-        with st.sidebar.header("""Please select the CSV delimiter"""):
-            delimiter_dict = {",": ",", ";": ";"}
-            user_delimiter = st.sidebar.selectbox("Choose CSV file delimiter",
-                                                  list(delimiter_dict.keys()))
-            selected_delimiter = delimiter_dict[user_delimiter]
+        selected_delimiter = IO.sb_csv_delimiter()
+
+        try:
+            dataframe = cached_read_csv(file, selected_delimiter)
+        except pd.errors.ParserError:
+            st.error("Plese check your selected delimiter")
+            dataframe = []
+
+        return dataframe
+
+    def sb_csv_read_selection(file, default: list = None):
+        """Load selected columns and rows of UploadedFile CSV
 
-            try:
-                dataframe = pd.read_csv(file, delimiter=selected_delimiter)
-            except pd.errors.ParserError:
-                st.error("Plese check your selected delimiter")
-                dataframe = []
+        The header is read first, only the selected columns are parsed
+        and row filters are applied chunk by chunk while reading.
+
+        Args:
+            file (UploadedFile): File to be loaded
+            default (list, optional): Default columns.
+                Defaults to all columns.
+
+        Returns:
+            DataFrame: loaded dataframe, shared with the upload cache
+            list: Selected columns
+            tuple: Version of the loaded data (see `csv_read_key`)
+        """
+        selected_delimiter = IO.sb_csv_delimiter()
 
-            return dataframe
+        try:
+            header = csv_columns(file, selected_delimiter)
+            if default is None:
+                default = header
+            default = [column for column in default if column in header]
+            columns = Sidebar.sb_columns_selector(pd.DataFrame(columns=header),
+                                                  default)
+            filters = Sidebar.sb_row_filters(file, header, selected_delimiter)
+
+            version = csv_read_key(file, selected_delimiter, columns or None,
+                                   filters)
+            dataframe = cached_read_csv(file, selected_delimiter,
+                                        columns or None, filters, version)
+        except pd.errors.ParserError:
+            st.error("Plese check your selected delimiter")
+            dataframe, columns, version = [], [], None
+
+        return dataframe, columns, version
 
     def sb_sdf_read_dataframe(file):
         """Load SDF UploadedFile into pandas dataframe
@@ -148,7 +320,7 @@ class Sidebar:
         Args:
             field_description (str): Uploader title
             file_description (str): Uploader description
-            example_path (str): Path to exemple file
+            example_path (str): Path to exemple file (CSV or Parquet)
             example_delimiter (str): Exemple file delimiter
             example_name (str): Exemple file name
             example_description (str): Exemple file description
@@ -160,11 +332,17 @@ class Sidebar:
             uploaded_file = st.sidebar.file_uploader(file_description,
                                                      type=["csv"])
 
-            if example_path:
-                exemple_file = pd.read_csv(
-                    example_path, delimiter=example_delimiter)
+            if example_path and example_path.endswith(".parquet"):
+                with open(_checkpoint_example(example_path), "rb") as payload:
+                    generic_download(payload, "text/csv",
+                                     f"{example_name}.csv",
+                                     example_description)
+
+            elif example_path:
+                payload = _example_payload(example_path, example_delimiter)
 
-                csv_download(exemple_file, example_name, example_description)
+                generic_download(payload, "text/csv",
+                                 f"{example_name}.csv", example_description)
 
         return uploaded_file
 
@@ -206,6 +384,31 @@ class Sidebar:
 
             return molecule_column
 
+    def sb_row_filters(file, columns: list, delimiter=","):
+        """Row filters applied while reading
+
+        Args:
+            file (UploadedFile): CSV file
+            columns (list): Columns of the file
+            delimiter (str, optional): CSV delimiter. Defaults to ",".
+
+        Returns:
+            dict: {column: allowed values}
+        """
+        with st.sidebar.header("""Row filters"""):
+            filters = {}
+            for column in FILTER_COLUMNS:
+                if column not in columns:
+                    continue
+
+                if st.sidebar.checkbox(f"Filter {column}"):
+                    values = csv_unique(file, column, delimiter)
+                    selected = st.sidebar.multiselect(column, values)
+                    if selected:
+                        filters[column] = selected
+
+            return filters
+
     def sb_data_limit(dataframe):
         """Select data number to work with
 
@@ -236,6 +439,64 @@ class Sidebar:
                 execute = not execute
                 return execute
 
+    def sb_resume_job(key: str):
+        """Attach a running job to the session by its ID, e.g. after a
+        page reload
+
+        Args:
+            key (str): Job key in the session
+        """
+        job_id = st.sidebar.text_input("Resume job ID",
+                                       key=f"{key}_resume").strip()
+        if not job_id or job_id in st.session_state.get("jobs", {}).values():
+            return
+
+        job = get_runner().get(job_id)
+        if job is None:
+            st.sidebar.warning("Unknown or already collected job ID")
+        else:
+            set_session_job(key, job)
+
+    def sb_jobs(poll_interval=1.0):
+        """Display background jobs of the session with a cancel button
+
+        While jobs run, their progress is refreshed every poll_interval
+        and the page reruns when one finishes so its result is picked
+        up. Widget changes interrupt the polling, not the jobs.
+
+        Args:
+            poll_interval (float, optional): Refresh delay (s).
+                Defaults to 1.0.
+        """
+        jobs = session_jobs()
+        if not jobs:
+            return
+
+        st.sidebar.header("Background jobs")
+        displays = []
+        for key, job in jobs.items():
+            text = st.sidebar.empty()
+            bar = st.sidebar.progress(0)
+            if not job.finished and st.sidebar.button("Cancel",
+                                                      key=f"{key}_cancel"):
+                job.cancel()
+            st.sidebar.caption(f"Job ID: {job.id}")
+            displays.append((job, text, bar))
+
+        def _show():
+            for job, text, bar in displays:
+                text.text(_job_text(job))
+                bar.progress(_job_percent(job))
+
+        running = [job for job in jobs.values() if not job.finished]
+        _show()
+
+        while running:
+            time.sleep(poll_interval)
+            _show()
+            if any(job.finished for job in running):
+                st.experimental_rerun()
+
     def sb_download_button(data, mime, name="file",
                            description="Download data"):
         """Create download button on sidebar
@@ -259,13 +520,16 @@ class MainStructure:
             st.markdown("""## Awaiting file to be uploaded""")
             st.markdown("""Please use the sidebar menu to upload.""")
 
-    def data_selection_preview(dataframe, display_nbr, columns):
+    def data_selection_preview(dataframe, display_nbr, columns,
+                               version=None):
         """Preview current selection of columns
 
         Args:
             dataframe ([type]): [description]
             display_nbr ([type]): [description]
             columns ([type]): [description]
+            version (hashable, optional): Version of the selection, see
+                `paged_dataframe`. Defaults to None.
 
         Returns:
             DataFrame: Selected dataframe
@@ -275,12 +539,49 @@ class MainStructure:
             sel_dataframe = df[columns]
 
             st.subheader("Data selected")
-            st.write(sel_dataframe)
+            MainStructure.paged_dataframe(sel_dataframe, "selection_preview",
+                                          version=version)
 
             return sel_dataframe
         except ValueError:
             st.error("""Plase check your data or column selection""")
 
+    def paged_dataframe(dataframe, key: str, rows_per_page=100,
+                        columns_per_page=50, version=None):
+        """Display one page of a dataframe, sorted server-side
+
+        Args:
+            dataframe (DataFrame): Dataframe
+            key (str): Unique widget key
+            rows_per_page (int, optional): Rows displayed. Defaults to 100.
+            columns_per_page (int, optional): Columns displayed.
+                Defaults to 50.
+            version (hashable, optional): Changes whenever the data
+                changes, the sort order is kept across reruns of the same
+                version. Defaults to None, sorted on every rerun.
+        """
+        n_rows, n_columns = dataframe.shape
+
+        col_sort, col_order = st.columns(2)
+        sort_column = col_sort.selectbox("Sort by",
+                                         [None] + list(dataframe.columns),
+                                         key=f"{key}_sort")
+        order = col_order.selectbox("Order", ["Ascending", "Descending"],
+                                    key=f"{key}_order")
+
+        rows, columns = _page_controls(n_rows, n_columns, key,
+                                       rows_per_page, columns_per_page)
+
+        if sort_column is None:
+            positions = slice(*rows)
+        else:
+            positions = _sorted_positions(dataframe, sort_column,
+                                          order == "Ascending", key,
+                                          version)[slice(*rows)]
+
+        st.dataframe(dataframe.iloc[positions, slice(*columns)])
+        _page_caption(n_rows, n_columns, rows, columns)
+
     def download_button(data, mime="text/csv", name="file",
                         description="Download data"):
         """Create download button on main structure
@@ -295,6 +596,31 @@ class MainStructure:
         else:
             generic_download(data, mime, name, description, False)
 
+    def export_button(dataframe, name="file", key="export",
+                      description="Download data", version=None):
+        """Create download of a dataframe, written only when requested
+
+        The dataframe is written in chunks to a temporary file in the
+        selected format (CSV, compressed CSV or Parquet).
+
+        Args:
+            dataframe (DataFrame): dataframe to be downloaded
+            name (str): download file name, without extension
+            key (str): unique widget key
+            description (str): displayed text
+            version (hashable, optional): Changes whenever the data
+                changes, the file is reused across reruns of the same
+                version. Defaults to None, kept for the current run only.
+        """
+        def _write(out_path, out_format):
+            export_dataframe(dataframe, out_path, out_format, name)
+
+        def _token():
+            return object() if version is None else version
+
+        _export_download(key, _token, EXPORT_FORMATS, _write, name,
+                         description)
+
 
 class Fingerprint:
     def fp_columns_selection(dataframe):
@@ -337,20 +663,15 @@ class Fingerprint:
         Returns:
             list: Selected fingerprint
             int: Number of seected molecules
+            dict: Execution options
         """
         with st.sidebar.header("Set parameters"):
-            fp_dict = {"AtomPairs2D": "AtomPairs2DFingerprinter.xml",
-                       "AtomPairs2DCount": "AtomPairs2DFingerprintCount.xml",
-                       "CDK": "Fingerprinter.xml",
-                       "CDKextended": "ExtendedFingerprinter.xml",
-                       "CDKgraphonly": "GraphOnlyFingerprinter.xml",
-                       "EState": "EStateFingerprinter.xml",
-                       "KlekotaRoth": "KlekotaRothFingerprinter.xml",
-                       "KlekotaRothCount": "KlekotaRothFingerprintCount.xml",
-                       "MACCS": "MACCSFingerprinter.xml",
-                       "PubChem": "PubchemFingerprinter.xml",
-                       "Substructure": "SubstructureFingerprinter.xml",
-                       "SubstructureCount": "SubstructureFingerprintCount.xml"}
+            fp_dict = PADEL_FINGERPRINTS
+
+        engine = st.sidebar.selectbox("Fingerprint engine",
+                                      ["PaDEL", "RDKit"])
+        if engine == "RDKit":
+            fp_dict = RDKIT_FINGERPRINTS
 
         user_fp = st.sidebar.selectbox("Choose fingerprint to calculate",
                                        list(fp_dict.keys()))
@@ -362,44 +683,126 @@ class Fingerprint:
                                             max_value=dataframe.shape[0],
                                             value=dataframe.shape[0], step=10)
 
-        return [user_fp, dict_fp], molecule_number
+        options = {"engine": engine}
+        if engine == "PaDEL":
+            options["sharded"] = st.sidebar.checkbox(
+                "Sharded execution (large datasets)", value=False)
+            options["cache"] = st.sidebar.checkbox("Use fingerprint cache",
+                                                   value=True)
+        else:
+            options["parallel"] = st.sidebar.checkbox("Parallel mode",
+                                                      value=False)
+
+        return [user_fp, dict_fp], molecule_number, options
 
-    def execute_PaDEL(dataframe, selected_fp: list):
-        """Execute PaDEL
+    def execute_PaDEL(dataframe, selected_fp: list, options: dict = None,
+                      progress=None, data_path="./csv_handler/core/files"):
+        """Execute PaDEL in batches, without display so it can run as a
+        background job
 
         Args:
             dataframe (DataFrame): Dataframe
             selected_fp (list): Fingerprint selection
+            options (dict, optional): Execution options ("sharded",
+                "cache"). Defaults to None.
+            progress (function, optional): Called with (done, total)
+                after each batch. Defaults to None.
+            data_path (str, optional): Folder of PaDEL inputs, outputs
+                and the fingerprint store.
+                Defaults to "./csv_handler/core/files".
 
         Returns:
-            DataFrame: Fingerprint dataframe
+            str: Path to fingerprint store
+            dict: Cache statistics
         """
         _, dict_fp = selected_fp
-        dataframe.to_csv("./csv_handler/core/files/molecule.smi", sep="\t",
-                         header=False, index=False)
+        options = options or {}
+        padel_path = "./csv_handler/PaDEL-Descriptor"
+        cache_path = (FINGERPRINT_CACHE_PATH if options.get("cache", False)
+                      else None)
+
+        fp_dir, hits, misses = run_PaDEL_batches(
+            dataframe, padel_path, data_path, dict_fp, cache_path,
+            options.get("sharded", False), callback=progress)
 
-        with st.spinner("Calculating descriptors..."):
-            fp_dir = run_PaDEL("./csv_handler/PaDEL-Descriptor",
-                               "./csv_handler/core/files", dict_fp)
+        store_path = csv_to_fingerprints(fp_dir, data_path + "/fingerprint",
+                                         counts="Count" in dict_fp)
+        os.remove(fp_dir)
 
-            return fp_dir
+        info = {"cache_hits": hits, "cache_misses": misses}
+        if cache_path is None:
+            info = {}
 
-    def display_fingerprints(fp_path: str, selected_fp: list):
+        return store_path, info
+
+    def execute_rdkit(dataframe, selected_fp: list, options: dict = None,
+                      progress=None, data_path="./csv_handler/core/files"):
+        """Compute RDKit fingerprints in process, without display so it
+        can run as a background job
+
+        Args:
+            dataframe (DataFrame): Molecule ID and SMILES columns
+            selected_fp (list): Fingerprint selection
+            options (dict, optional): Execution options ("parallel").
+                Defaults to None.
+            progress (function, optional): Called with (done, total)
+                after each chunk. Defaults to None.
+            data_path (str, optional): Folder of the fingerprint store.
+                Defaults to "./csv_handler/core/files".
+
+        Returns:
+            str: Path to fingerprint store
+            dict: Number of invalid SMILES
+        """
+        _, (fingerprint, n_bits) = selected_fp
+        options = options or {}
+        n_jobs = (os.cpu_count() or 1) if options.get("parallel") else 1
+        id_column, smiles_column = dataframe.columns[:2]
+
+        matrix, valid = rdkit_fingerprints(dataframe[smiles_column],
+                                           fingerprint, n_bits, n_jobs,
+                                           callback=progress)
+
+        store_path = save_fingerprints(
+            data_path + "/fingerprint", dataframe[id_column],
+            matrix, bit_columns(f"{fingerprint}_", n_bits))
+
+        return store_path, {"invalid": int((~valid).sum())}
+
+    def display_fingerprints(store_path: str, selected_fp: list,
+                             rows_per_page=100, columns_per_page=50):
         """Display final result
 
         Args:
-            fp_path (str): Path to fingerprint CSV file
+            store_path (str): Path to fingerprint store
             selected_fp (list): Fingerprint selection
+            rows_per_page (int, optional): Rows displayed. Defaults to 100.
+            columns_per_page (int, optional): Bit columns displayed.
+                Defaults to 50.
         """
         user_fp, _ = selected_fp
 
-        fingerprint_df = pd.read_csv(fp_path)
-        n_molecules = fingerprint_df.shape[0]
-        n_descriptors = fingerprint_df.shape[1]
+        store = FingerprintStore(store_path)
+        n_molecules, n_descriptors = store.shape
 
         st.success(f"Selected fingerprint: {user_fp}")
         st.success(f"Number of molecules: {str(n_molecules)}")
-        st.success(f"Number of descriptors: {str(n_descriptors-1)}")
+        st.success(f"Number of descriptors: {str(n_descriptors)}")
+
+        st.subheader("Fingerprint output file")
+        rows, columns = _page_controls(n_molecules, n_descriptors,
+                                       "fingerprints", rows_per_page,
+                                       columns_per_page)
+
+        # Only the displayed rows are unpacked from the store
+        page = store.to_dataframe(*rows)
+        bits = list(range(columns[0] + 1, columns[1] + 1))
+        st.dataframe(page.iloc[:, [0] + bits])
+        _page_caption(n_molecules, n_descriptors, rows, columns)
+
+        def _write(out_path, out_format):
+            export_fingerprints(store, out_path, out_format)
 
-        st.subheader("PADEL output file")
-        st.write(fingerprint_df)
+        token = (store_path, os.stat(store.files[0]).st_mtime_ns)
+        _export_download("fingerprints", lambda: token, FINGERPRINT_FORMATS,
+                         _write, "fingerprint", "Download fingerprints")
@@ -1,122 +1,539 @@
-from collections import defaultdict
+import queue
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
+from rdkit import Chem, rdBase
+from tqdm import tqdm
+import chembl_structure_pipeline
+from chembl_structure_pipeline import standardizer
 
-def _get_duplicates(seq):
-    tally = defaultdict(list)
-    for i, item in enumerate(seq):
-        tally[item].append(i)
-    target = ((key, locs) for key, locs in tally.items() if len(locs) > 1)
+from .jobs import process_context
 
-    duplicated = {}
-    for item in target:
-        duplicated[item[0]] = item[1]
+STANDARDIZER_VERSION = (f"chembl_structure_pipeline-"
+                        f"{chembl_structure_pipeline.__version__}/"
+                        f"rdkit-{rdBase.rdkitVersion}")
 
-    return duplicated
+# Factor to mol.L-1
+MOLAR_UNITS = {"M": 1.0, "mM": 1e-3, "uM": 1e-6, "nM": 1e-9, "pM": 1e-12}
 
+# Factor to g.L-1, divided by the molecular weight to get mol.L-1
+MASS_UNITS = {"mg.mL-1": 1.0, "ug.mL-1": 1e-3, "ng.mL-1": 1e-6,
+              "g.L-1": 1.0, "mg.L-1": 1e-3, "ug.L-1": 1e-6}
 
-def process_duplicates(df, columns):
-    remove_idx = []
+# Converted unit: factor to mol.L-1 (None for -log10(mol.L-1))
+OUTPUT_UNITS = {"uM": 1e-6, "nM": 1e-9, "pM": 1e-12, "mM": 1e-3,
+                "M": 1.0, "-log": None}
 
+# Replicate value policies for duplicated molecules
+DUPLICATE_POLICIES = {"Keep max": "max", "Keep min": "min",
+                      "Median": "median", "Geometric mean": "geomean"}
+
+# Policies replacing the value, only valid when conflicting molecules are
+# dropped: a kept Activity label could contradict the aggregated value
+AGGREGATE_POLICIES = ("median", "geomean")
+
+# Elements kept by default when filtering molecules
+DEFAULT_ELEMENTS = ("C", "O", "N", "S", "P", "F", "I", "Br", "Cl")
+
+ELEMENTS = tuple(Chem.GetPeriodicTable().GetElementSymbol(atomic_number)
+                 for atomic_number in range(1, 119))
+
+# Bracket atom, organic subset atom or any other letter
+_SMILES_ATOM_RE = re.compile(r"(\[[^\]]*\])|(Br|Cl|[BCNOPSFI]|[bcnops])|"
+                             r"([A-Za-z*])")
+_BRACKET_ELEMENT_RE = re.compile(r"\[\d*([A-Z][a-z]?|se|as|te|[bcnops])")
+
+
+# Result of a molecule that exceeded the timeout, reported as "remove"
+# but not cached: it may succeed with a longer timeout or a lighter load
+_TIMED_OUT = None
+
+
+def _chunks(seq, size):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+def _gather(futures, total, callback=None):
+    # Flatten chunk results in input order. callback(done, total) is
+    # called after each chunk, an exception it raises cancels the rest
+    results = []
+
+    try:
+        for future in tqdm(futures, total=len(futures)):
+            results.extend(future.result())
+            if callback is not None:
+                callback(len(results), total)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    return results
+
+
+def _map_chunks(function, seq, chunk_size, n_jobs, *args, callback=None):
+    # Apply function to chunks of seq, in a process pool if n_jobs > 1,
+    # and flatten the results in input order
+    chunks = list(_chunks(seq, chunk_size))
+    results = []
+
+    if n_jobs <= 1:
+        chunk_results = (function(chunk, *args) for chunk in chunks)
+        for chunk_result in tqdm(chunk_results, total=len(chunks)):
+            results.extend(chunk_result)
+            if callback is not None:
+                callback(len(results), len(seq))
+
+        return results
+
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             mp_context=process_context()) as executor:
+        futures = [executor.submit(function, chunk, *args)
+                   for chunk in chunks]
+
+        return _gather(futures, len(seq), callback)
+
+
+def _standardize(smiles):
+    mol = Chem.MolFromSmiles(str(smiles), sanitize=True)
+
+    if mol is None:
+        return "remove"
+
+    std_mol = standardizer.standardize_mol(mol)
+    parent_mol, _ = standardizer.get_parent_mol(std_mol)
+
+    if len(parent_mol.GetAtoms()) < 2:
+        return "remove"
+
+    parent_smiles = Chem.MolToSmiles(parent_mol)
+    if Chem.MolFromSmiles(parent_smiles) is None:
+        return "remove"
+
+    return parent_smiles
+
+
+def _standardize_chunk(chunk):
+    return [_standardize(current_smiles) for current_smiles in chunk]
+
+
+def _standardize_worker(connection):
+    # Child process: standardize the SMILES lists received, sending each
+    # result as soon as it is computed
+    connection.send("ready")
+
+    try:
+        for chunk in iter(connection.recv, None):
+            for current_smiles in chunk:
+                connection.send(_standardize(current_smiles))
+    except EOFError:
+        pass
+
+
+class _StandardizeWorker:
+    """Process standardizing SMILES under a per-molecule timeout.
+
+    A molecule taking longer than the timeout, RDKit calls included, is
+    removed: the process is killed and a new one continues with the
+    next molecule of the chunk.
+    """
+
+    def __init__(self, context, timeout: float):
+        self.context = context
+        self.timeout = timeout
+        self.process = None
+        self.connection = None
+        self.closed = False
+
+    def _start(self):
+        connection, child = self.context.Pipe()
+        process = self.context.Process(target=_standardize_worker,
+                                       args=(child,), daemon=True)
+        try:
+            process.start()
+        finally:
+            child.close()
+        self.process, self.connection = process, connection
+
+        # Startup is not counted in the timeout
+        try:
+            connection.recv()
+        except EOFError:
+            self.stop()
+            raise RuntimeError("Standardization worker failed to start")
+
+    def run(self, chunk):
+        """Standardize a chunk of SMILES
+
+        Args:
+            chunk (list): SMILES
+
+        Returns:
+            list: Parent SMILES, "remove" or _TIMED_OUT for each input
+        """
+        std_list = []
+
+        while len(std_list) < len(chunk):
+            if self.closed:
+                raise RuntimeError("Standardization worker closed")
+            if self.process is None:
+                self._start()
+            self.connection.send(chunk[len(std_list):])
+
+            try:
+                while len(std_list) < len(chunk):
+                    if not self.connection.poll(self.timeout):
+                        self.stop()
+                        std_list.append(_TIMED_OUT)
+                        break
+                    std_list.append(self.connection.recv())
+            except (EOFError, OSError):
+                if self.closed:
+                    raise
+                # The process died on this molecule
+                self.stop()
+                std_list.append(_TIMED_OUT)
+
+        return std_list
+
+    def stop(self):
+        """Kill the process, a new one is started on the next chunk"""
+        process, self.process = self.process, None
+        if process is not None:
+            process.kill()
+            process.join()
+            self.connection.close()
+
+    def close(self):
+        """Kill the process, interrupting a running chunk"""
+        self.closed = True
+        process = self.process
+        if process is not None:
+            process.kill()
+
+
+def _standardize_supervised(smiles, chunk_size, n_jobs, timeout,
+                            callback=None):
+    # One worker process per thread, chunks go to the first idle worker
+    n_jobs = max(1, n_jobs)
+    context = process_context()
+    workers = [_StandardizeWorker(context, timeout) for _ in range(n_jobs)]
+    idle = queue.Queue()
+    for worker in workers:
+        idle.put(worker)
+
+    def _run(chunk):
+        worker = idle.get()
+        try:
+            return worker.run(chunk)
+        finally:
+            idle.put(worker)
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_run, chunk)
+                       for chunk in _chunks(smiles, chunk_size)]
+            try:
+                return _gather(futures, len(smiles), callback)
+            finally:
+                for worker in workers:
+                    worker.close()
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+def _standardize_all(smiles, n_jobs=1, timeout=None, chunk_size=1000,
+                     callback=None):
+    if timeout:
+        return _standardize_supervised(smiles, chunk_size, n_jobs, timeout,
+                                       callback)
+
+    return _map_chunks(_standardize_chunk, smiles, chunk_size, n_jobs,
+                       callback=callback)
+
+
+def standardize_smiles(smiles, n_jobs=1, timeout=None, chunk_size=1000,
+                       callback=None):
+    """Standardize SMILES with the ChEMBL structure pipeline
+
+    With a timeout, SMILES are standardized in worker processes (at
+    least one) that are killed and replaced when a molecule takes
+    longer, so a molecule stuck inside RDKit cannot stall the run.
+
+    Args:
+        smiles (list): SMILES to be standardized
+        n_jobs (int, optional): Number of worker processes. Defaults to 1.
+        timeout (float, optional): Seconds allowed per molecule, molecules
+            exceeding it are removed. Defaults to None.
+        chunk_size (int, optional): SMILES sent to a worker at once.
+            Defaults to 1000.
+        callback (function, optional): Called with (done, total) after
+            each chunk. Defaults to None.
+
+    Returns:
+        list: Parent SMILES or "remove" for each input
+    """
+    return ["remove" if std_smiles is _TIMED_OUT else std_smiles
+            for std_smiles in _standardize_all(list(smiles), n_jobs, timeout,
+                                               chunk_size, callback)]
+
+
+def _screen_elements(smiles, allowed):
+    # True/False when the SMILES tokens decide, None when RDKit is needed
+    ambiguous = False
+
+    for bracket, organic, other in _SMILES_ATOM_RE.findall(smiles):
+        if organic:
+            element = organic.capitalize()
+        elif bracket:
+            match = _BRACKET_ELEMENT_RE.match(bracket)
+            if match is None:
+                ambiguous = True
+                continue
+            element = match.group(1).capitalize()
+        else:
+            ambiguous = True
+            continue
+
+        # Explicit hydrogens may be removed by RDKit
+        if element == "H":
+            ambiguous = True
+        elif element not in allowed:
+            return False
+
+    return None if ambiguous else True
+
+
+def _filter_elements_chunk(chunk, allowed):
+    flag_list = []
+
+    for current_smiles in chunk:
+        valid_flag = _screen_elements(current_smiles, allowed)
+
+        if valid_flag is None:
+            mol = Chem.MolFromSmiles(current_smiles)
+            valid_flag = mol is not None and all(
+                atom.GetSymbol() in allowed for atom in mol.GetAtoms())
+
+        flag_list.append(valid_flag)
+
+    return flag_list
+
+
+def filter_elements(smiles, allowed=DEFAULT_ELEMENTS, n_jobs=1,
+                    chunk_size=10000):
+    """Flag molecules made only of allowed elements
+
+    SMILES are tokenized first, RDKit only parses the SMILES with
+    explicit hydrogens or unknown tokens. SMILES accepted by the token
+    screen are not validated.
+
+    Args:
+        smiles (list): SMILES to be checked
+        allowed (tuple, optional): Allowed element symbols.
+            Defaults to DEFAULT_ELEMENTS.
+        n_jobs (int, optional): Number of worker processes. Defaults to 1.
+        chunk_size (int, optional): SMILES sent to a worker at once.
+            Defaults to 10000.
+
+    Returns:
+        ndarray: Boolean flag for each input (True to keep)
+    """
+    smiles = [str(current_smiles) for current_smiles in smiles]
+    flag_list = _map_chunks(_filter_elements_chunk, smiles, chunk_size,
+                            n_jobs, frozenset(allowed))
+
+    return np.array(flag_list, dtype=bool)
+
+
+def cached_standardize_smiles(smiles, cache, **kwargs):
+    """Standardize SMILES, only computing entries missing from cache
+
+    Args:
+        smiles (list): SMILES to be standardized
+        cache (SmilesCache): Persistent SMILES cache
+        **kwargs: Arguments passed to `standardize_smiles`
+
+    Returns:
+        list: Parent SMILES or "remove" for each input
+    """
+    smiles = [str(current_smiles) for current_smiles in smiles]
+    found = cache.get_many(smiles)
+
+    missing = list(dict.fromkeys(current_smiles for current_smiles in smiles
+                                 if current_smiles not in found))
+    if missing:
+        computed = dict(zip(missing, _standardize_all(missing, **kwargs)))
+        cache.set_many({current_smiles: std_smiles
+                        for current_smiles, std_smiles in computed.items()
+                        if std_smiles is not _TIMED_OUT})
+        found.update(computed)
+
+    return ["remove" if found[current_smiles] is _TIMED_OUT
+            else found[current_smiles] for current_smiles in smiles]
+
+
+def remove_invalid_smiles(df, column):
+    """Remove rows flagged by the standardization
+
+    Args:
+        df (DataFrame): Dataframe with standardized SMILES
+        column (str): SMILES column
+
+    Returns:
+        DataFrame: Dataframe without "remove" and multi-fragment rows
+    """
+    smiles = df[column].astype(str)
+    mask = smiles.str.contains(".", regex=False) | (smiles == "remove")
+
+    return df[~mask]
+
+
+def remove_outliers(df, column="Labels", lower=0.1, upper=0.9):
+    """Remove rows outside a quantile range
+
+    Args:
+        df (DataFrame): Dataframe
+        column (str, optional): Value column. Defaults to "Labels".
+        lower (float, optional): Lower quantile. Defaults to 0.1.
+        upper (float, optional): Upper quantile. Defaults to 0.9.
+
+    Returns:
+        DataFrame: Rows strictly between both quantiles
+    """
+    values = df[column]
+
+    return df[(values > values.quantile(lower)) &
+              (values < values.quantile(upper))]
+
+
+def filter_organisms(df, column, organisms):
+    """Keep rows of selected organisms
+
+    Args:
+        df (DataFrame): Dataframe
+        column (str): Organism column
+        organisms (list): Organisms kept
+
+    Returns:
+        DataFrame: Filtered dataframe
+    """
+    return df[df[column].isin(list(organisms))]
+
+
+def shuffle_rows(df, seed=None):
+    """Shuffle rows
+
+    Args:
+        df (DataFrame): Dataframe
+        seed (int, optional): Random seed. Defaults to None.
+
+    Returns:
+        DataFrame: Shuffled dataframe
+    """
+    return df.sample(frac=1, random_state=seed)
+
+
+def process_duplicates(df, columns, policy="max", drop_conflicts=True):
+    """Resolve duplicated molecules
+
+    Args:
+        df (DataFrame): Dataframe
+        columns (list): Smiles column, or Smiles, Activity and
+            Converted Value columns
+        policy (str, optional): Replicate value policy, one of
+            DUPLICATE_POLICIES values. Defaults to "max".
+        drop_conflicts (bool, optional): Drop molecules with conflicting
+            activity, required by AGGREGATE_POLICIES. Defaults to True.
+
+    Returns:
+        DataFrame: Dataframe with one row per molecule
+    """
     if len(columns) == 1:
-        df = df.drop_duplicates(subset=columns, keep="first")
+        return df.drop_duplicates(subset=columns, keep="first")
 
-    else:
-        list_id = list(df[columns[0]])
-        list_activity = list(df[columns[1]])
-        list_values = list(df[columns[2]])
+    if policy in AGGREGATE_POLICIES and not drop_conflicts:
+        raise ValueError(f"Policy {policy!r} requires dropping conflicts")
 
-        duplicated = _get_duplicates(list_id)
+    id_column, activity_column, value_column = columns[:3]
 
-        if len(duplicated) >= 1:
-            for mol_id in duplicated.keys():
-                temp_activity = []
-                temp_value = []
+    # Positional index so idxmin returns row positions
+    groups = pd.Series(df[id_column].to_numpy())
+    values = pd.Series(df[value_column].to_numpy(dtype=float))
+    grouped = values.groupby(groups, sort=False, dropna=False)
 
-                for list_idx in duplicated[mol_id]:
-                    temp_activity.append(list_activity[list_idx])
-                    temp_value.append(list_values[list_idx])
+    if policy == "geomean":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            aggregated = np.exp(np.log(values).groupby(
+                groups, sort=False, dropna=False).transform("mean"))
+    else:
+        aggregated = grouped.transform(policy)
 
-                # Entry has same activity?
-                if len(_get_duplicates(temp_activity)) != 1:
-                    for activity_iter in duplicated[mol_id]:
-                        remove_idx.append(activity_iter)
+    # Keep the first replicate closest to the aggregated value
+    distance = (values - aggregated).abs().fillna(np.inf)
+    keep_idx = distance.groupby(groups, sort=False,
+                                dropna=False).idxmin().to_numpy()
 
-                # Get entry with higher value
-                max_index = duplicated[mol_id][temp_value.index(
-                    max(temp_value))]
-                for value_iter in duplicated[mol_id]:
-                    if value_iter != max_index:
-                        remove_idx.append(value_iter)
+    keep_flag = np.zeros(len(df), dtype=bool)
+    keep_flag[keep_idx] = True
 
-            # Select keeped entrys
-            keep_flag = [True] * len(df)
-            for remove_iter in remove_idx:
-                keep_flag[remove_iter] = False
+    if drop_conflicts:
+        activity = pd.Series(df[activity_column].to_numpy())
+        n_activity = activity.groupby(groups, sort=False,
+                                      dropna=False).transform("nunique")
+        keep_flag &= (n_activity <= 1).to_numpy()
 
-            df = df[keep_flag]
+    replicates = grouped.transform("size").to_numpy()
+    df = df.assign(Replicates=replicates)
 
-    return df
+    if policy in ("median", "geomean"):
+        df[value_column] = aggregated.to_numpy()
+
+    return df[keep_flag]
 
 
 def convert_threshold(df, threshold_value, threshold_unit, threshold_columns):
-    allowed_units = ["ug.mL-1", "nM", "uM"]
-    df = df[df[str(threshold_columns[1])].isin(allowed_units)]
-
-    list_units = list(df[threshold_columns[1]])
-    list_values = list(df[threshold_columns[0]])
-    list_molweight = list(df[threshold_columns[2]])
-
-    converted_values = []
-
-    if threshold_unit == "uM":
-        for unit_index, current_unit in enumerate(list_units):
-            if current_unit == "ug.mL-1":
-                new_value = ((list_values[unit_index] /
-                              list_molweight[unit_index]) * 1000) * 1000
-            elif current_unit == "uM":
-                new_value = list_values[unit_index]
-            elif current_unit == "nM":
-                new_value = list_values[unit_index] / 1000
-
-            converted_values.append(new_value)
-
-        # Create activity column
-        converted_units = ["uM"] * len(list_values)
-        converted_activity = ["Inactive"] * len(list_values)
-
-        for value_index, current_value in enumerate(converted_values):
-            if current_value < threshold_value:
-                converted_activity[value_index] = "Active"
-
-        df = df.assign(converted_values=converted_values)
-        df = df.assign(converted_units=converted_units)
-        df = df.assign(converted_activity=converted_activity)
-
-        df = df.rename(columns={"converted_values": "Converted Value",
-                                "converted_units": "Converted Units",
-                                "converted_activity": "Activity"})
-
-    elif threshold_unit == "nM":
-        for current_index, current_unit in enumerate(list_units):
-            if current_unit == "ug.mL-1":
-                new_value = (list_values[current_index] /
-                             list_molweight[current_index]) * 1000
-            elif current_unit == "uM":
-                new_value = list_values[current_index] * 1000
-            elif current_unit == "nM":
-                new_value = list_values[current_index]
-
-            converted_values.append(new_value)
-
-        converted_units = ["nM"] * len(list_values)
-        converted_activity = ["Inactive"] * len(list_values)
-
-        for current_value_index, current_value in enumerate(converted_values):
-            if current_value < threshold_value:
-                converted_activity[current_value_index] = "Active"
-
-        df["Converted Value"] = converted_values
-        df["Converted Units"] = converted_units
-        df["Activity"] = converted_activity
+    """Convert standard values to a common unit and label activity
+
+    Args:
+        df (DataFrame): Dataframe
+        threshold_value (float): Activity threshold in `threshold_unit`
+        threshold_unit (str): Output unit (key of OUTPUT_UNITS)
+        threshold_columns (list): Standard Value, Standard Units and
+            Molecular Weight columns
+
+    Returns:
+        DataFrame: Dataframe with supported units and converted columns
+    """
+    value_column, unit_column, weight_column = threshold_columns[:3]
+
+    allowed_units = list(MOLAR_UNITS) + list(MASS_UNITS)
+    df = df[df[str(unit_column)].isin(allowed_units)]
+
+    units = df[unit_column]
+    values = df[value_column].to_numpy(dtype=float)
+    molar_factor = units.map(MOLAR_UNITS).to_numpy(dtype=float)
+    mass_factor = units.map(MASS_UNITS).to_numpy(dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        molweight = df[weight_column].to_numpy(dtype=float)
+        molar = np.where(np.isnan(molar_factor),
+                         values * mass_factor / molweight,
+                         values * molar_factor)
+
+        if OUTPUT_UNITS[threshold_unit] is None:
+            converted_values = -np.log10(molar)
+            active = converted_values > threshold_value
+        else:
+            converted_values = molar / OUTPUT_UNITS[threshold_unit]
+            active = converted_values < threshold_value
+
+    df = df.assign(**{"Converted Value": converted_values,
+                      "Converted Units": threshold_unit,
+                      "Activity": np.where(active, "Active", "Inactive")})
 
     return df
@@ -0,0 +1,191 @@
+"""
+Session workspaces
+
+version: 1.0.0
+"""
+
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import streamlit as st
+
+WORKSPACE_ROOT = "./csv_handler/core/files/workspaces"
+
+# Disk space of each session workspace (bytes)
+WORKSPACE_QUOTA = 2 * 2 ** 30
+
+# Workspaces left by a previous server process are removed after this
+# idle delay (s)
+WORKSPACE_MAX_IDLE = 6 * 3600
+
+# Minimum delay between two sweeps of the workspace root (s)
+SWEEP_INTERVAL = 600
+
+_MARKER = ".last_used"
+
+# Workspaces of this process, removed once their session is gone
+_workspaces = weakref.WeakValueDictionary()
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def _remove(path: str):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class Workspace:
+    """Directory holding the files of one session.
+
+    Files of the session (checkpoint, PaDEL inputs and outputs,
+    fingerprint stores, prepared downloads) are written here, so
+    concurrent sessions never share a path. The directory is removed
+    when the workspace object is garbage collected, i.e. once the
+    session and the jobs it submitted are gone.
+    """
+
+    def __init__(self, root=WORKSPACE_ROOT, quota=WORKSPACE_QUOTA):
+        self.id = uuid.uuid4().hex
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, self.id)
+        self.quota = quota
+
+        os.makedirs(self.path)
+        self.touch()
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+        _workspaces[self.id] = self
+
+    def file(self, name: str):
+        """Path of a file in the workspace
+
+        Args:
+            name (str): File name
+
+        Returns:
+            str: File path
+        """
+        return os.path.join(self.path, name)
+
+    def mkdtemp(self, prefix="tmp"):
+        """Create a unique directory in the workspace
+
+        Args:
+            prefix (str, optional): Directory prefix. Defaults to "tmp".
+
+        Returns:
+            str: Directory path
+        """
+        return tempfile.mkdtemp(prefix=prefix, dir=self.path)
+
+    def mkstemp(self, suffix=""):
+        """Create a unique empty file in the workspace
+
+        Args:
+            suffix (str, optional): File suffix. Defaults to "".
+
+        Returns:
+            str: File path
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.path)
+        os.close(handle)
+
+        return path
+
+    def touch(self):
+        """Mark the workspace as used now"""
+        with open(self.file(_MARKER), "w"):
+            pass
+
+    def usage(self):
+        """Disk space used by the workspace
+
+        Returns:
+            int: Size (bytes)
+        """
+        size = 0
+        for folder, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+        return size
+
+    def check_quota(self):
+        """Raise QuotaExceeded if the workspace uses more than its quota"""
+        usage = self.usage()
+        if usage > self.quota:
+            raise QuotaExceeded(f"Workspace uses {usage / 2 ** 20:.0f} MB "
+                                f"of {self.quota / 2 ** 20:.0f} MB, remove "
+                                f"downloads or results to continue")
+
+    def remove(self):
+        """Remove the workspace directory now"""
+        self._finalizer()
+
+
+def sweep_workspaces(root=WORKSPACE_ROOT, max_idle=WORKSPACE_MAX_IDLE):
+    """Remove idle workspaces not owned by this process
+
+    Args:
+        root (str, optional): Workspace root. Defaults to WORKSPACE_ROOT.
+        max_idle (float, optional): Idle delay (s).
+            Defaults to WORKSPACE_MAX_IDLE.
+
+    Returns:
+        int: Number of workspaces removed
+    """
+    if not os.path.isdir(root):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in _workspaces or not os.path.isdir(path):
+            continue
+
+        marker = os.path.join(path, _MARKER)
+        try:
+            last_used = os.path.getmtime(marker)
+        except OSError:
+            last_used = os.path.getmtime(path)
+
+        if now - last_used > max_idle:
+            _remove(path)
+            removed += 1
+
+    return removed
+
+
+def get_workspace():
+    """Get workspace of current session, creating it on first use
+
+    Returns:
+        Workspace: Session workspace
+    """
+    global _last_sweep
+
+    with _sweep_lock:
+        if time.time() - _last_sweep > SWEEP_INTERVAL:
+            _last_sweep = time.time()
+            sweep_workspaces()
+
+    workspace = st.session_state.get("workspace", None)
+    if workspace is None or not os.path.isdir(workspace.path):
+        workspace = Workspace()
+        st.session_state["workspace"] = workspace
+    else:
+        workspace.touch()
+
+    return workspace
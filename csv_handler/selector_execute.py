@@ -1,26 +1,26 @@
 import streamlit as st
 from .core.structure import Sidebar, MainStructure, IO
+from .core.reader import CHEMBL_COLUMNS
 
 
 def _selection(uploaded_file):
-    default_columns = ["Molecule ChEMBL ID", "Molecular Weight",
-                       "Smiles", "Standard Value",
-                       "Standard Units", "Assay Organism"]
-    dataframe = IO.sb_csv_read_dataframe(uploaded_file)
+    dataframe, columns, version = IO.sb_csv_read_selection(uploaded_file,
+                                                           CHEMBL_COLUMNS)
 
-    try:
-        columns = Sidebar.sb_columns_selector(dataframe,
-                                              default_columns)
-    except st.errors.StreamlitAPIException:
-        columns = Sidebar.sb_columns_selector(dataframe)
+    if len(dataframe) < 10:
+        st.error("Plese check your selected data")
+        return
 
     number = Sidebar.sb_data_limit(dataframe)
+    version = (version, number, tuple(columns))
 
     dataframe = MainStructure.data_selection_preview(dataframe,
                                                      number,
-                                                     columns)
+                                                     columns,
+                                                     version)
 
-    MainStructure.download_button(dataframe, name="dataframe")
+    MainStructure.export_button(dataframe, "dataframe", "selector",
+                                version=version)
 
 
 def selector():
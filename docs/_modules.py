@@ -15,6 +15,9 @@ def csv_selection():
 
     This module allows the selection of specific columns in
     the dataset to be saved.
+
+    Only the selected columns are read from the file. Rows can be filtered
+    by organism, standard type and units while the file is read.
     """)
 
 
@@ -45,12 +48,15 @@ def csv_cleaner():
     Remarks:
 
     - Some operations require a specific order of column selection.
-    - Currently filtering molecules by elements keeps molecules containing
-    **ONLY**: `C`, `O`, `N`, `S`, `P`, `F`, `I`, `Br`, `Cl`.
+    - Filtering molecules by elements keeps molecules containing **ONLY**
+    the selected elements (default: `C`, `O`, `N`, `S`, `P`, `F`, `I`,
+    `Br`, `Cl`).
     - Standardize concentration units and determining activity works only with
-    the **INPUT** values: `ug.mL-1`,` uM`, `nM`.
+    the **INPUT** values: `M`, `mM`, `uM`, `nM`, `pM`, `mg.mL-1`,
+    `ug.mL-1`, `ng.mL-1`, `g.L-1`, `mg.L-1`, `ug.L-1`.
     - Standardize concentration units and determining activity works only with
-    the **OUTPUT** values: ` uM`, `nM`.
+    the **OUTPUT** values: `uM`, `nM`, `pM`, `mM`, `M`, `-log`
+    (pChEMBL-style, molecules **above** the threshold are active).
 
     """)
 
@@ -88,3 +94,9 @@ def fp_calculator():
     - `Substructure`
     - `SubstructureCount`
     """)
+
+    st.markdown("""
+    The **RDKit** engine computes fingerprints in process, without Java:
+    `MACCS`, `Morgan2 (ECFP4)`, `Morgan3 (ECFP6)`, `AtomPairs`,
+    `TopologicalTorsion` and `RDKit` (path-based).
+    """)
@@ -0,0 +1,496 @@
+"""
+Streaming SDF conversion
+
+v - 1.0.0
+"""
+
+
+import hashlib
+import io
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from csv_handler.core.jobs import process_context
+from rdkit import Chem
+
+# Index files are rebuilt when their format changes
+INDEX_VERSION = 1
+INDEX_CACHE_SIZE = 16
+
+_TERMINATOR_RE = re.compile(rb"^\$\$\$\$[^\n]*(?:\n|$)", re.M)
+_PROPERTY_RE = re.compile(rb"^>[^\n]*?<([^>\n]*)>", re.M)
+
+_index_cache = OrderedDict()
+
+
+class SDFIndex:
+    """Byte offsets of the records of an SDF file.
+
+    `offsets` holds the start of each record followed by the end of the
+    last one, record i spans offsets[i]:offsets[i + 1].
+    """
+
+    def __init__(self, offsets, properties: list):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.properties = list(properties)
+
+    @classmethod
+    def build(cls, buffer):
+        """Index records with a single scan for terminators
+
+        Args:
+            buffer (bytes): SDF content (bytes, memoryview or mmap)
+
+        Returns:
+            SDFIndex: Record index
+        """
+        offsets = [0]
+        offsets.extend(match.end() for match in
+                       _TERMINATOR_RE.finditer(buffer))
+
+        # Last record without terminator
+        size = len(buffer)
+        if size > offsets[-1] and bytes(buffer[offsets[-1]:]).strip():
+            offsets.append(size)
+
+        properties = {}
+        for match in _PROPERTY_RE.finditer(buffer):
+            properties[match.group(1).decode(errors="replace")] = None
+
+        return cls(offsets, list(properties))
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a persisted index
+
+        Args:
+            path (str): Index file path
+
+        Returns:
+            SDFIndex: Record index
+        """
+        with np.load(path) as index_file:
+            return cls(index_file["offsets"],
+                       [str(name) for name in index_file["properties"]])
+
+    def save(self, path: str, **metadata):
+        """Persist the index
+
+        Args:
+            path (str): Index file path
+            **metadata: Extra integer arrays stored with the offsets
+        """
+        with open(path, "wb") as index_file:
+            np.savez(index_file, offsets=self.offsets,
+                     properties=np.asarray(self.properties, dtype=str),
+                     version=INDEX_VERSION, **metadata)
+
+    @property
+    def n_records(self):
+        return len(self.offsets) - 1
+
+    def spans(self, indices):
+        """Byte spans of records
+
+        Args:
+            indices (list): Record indices
+
+        Returns:
+            list: (start, end) byte offsets of each record
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+
+        return list(zip(self.offsets[indices].tolist(),
+                        self.offsets[indices + 1].tolist()))
+
+    def ranges(self, n_parts: int, n_records=None):
+        """Split the first records into contiguous byte ranges
+
+        Args:
+            n_parts (int): Number of ranges
+            n_records (int, optional): Records covered.
+                Defaults to all records.
+
+        Returns:
+            list: (start, end) byte offsets of each range
+        """
+        n_records = self.n_records if n_records is None else n_records
+        bounds = np.unique(np.linspace(0, n_records, n_parts + 1,
+                                       dtype=np.int64))
+        starts = self.offsets[bounds].tolist()
+
+        return list(zip(starts[:-1], starts[1:]))
+
+    def sample(self, n_records: int, seed=None):
+        """Random record indices, in file order
+
+        Args:
+            n_records (int): Number of records
+            seed (int, optional): Random seed. Defaults to None.
+
+        Returns:
+            ndarray: Sorted record indices
+        """
+        rng = np.random.default_rng(seed)
+        indices = rng.choice(self.n_records, min(n_records, self.n_records),
+                             replace=False)
+
+        return np.sort(indices)
+
+
+def _file_buffer(file):
+    if hasattr(file, "getbuffer"):
+        return file.getbuffer()
+
+    file.seek(0)
+    return file.read()
+
+
+def sdf_index(source, persist=True):
+    """Get the record index of an SDF file, building it if needed
+
+    Indexes of files on disk are stored next to the file (`path`.idx.npz)
+    and reused while the file is unchanged. Indexes of file objects are
+    kept in memory, keyed by content hash.
+
+    Args:
+        source (str or file): SDF path or binary file object
+        persist (bool, optional): Store the index of files on disk.
+            Defaults to True.
+
+    Returns:
+        SDFIndex: Record index
+    """
+    if isinstance(source, str):
+        stat = os.stat(source)
+        index_path = source + ".idx.npz"
+
+        if persist and os.path.exists(index_path):
+            with np.load(index_path) as index_file:
+                current = (int(index_file["version"]) == INDEX_VERSION and
+                           int(index_file["size"]) == stat.st_size and
+                           int(index_file["mtime"]) == stat.st_mtime_ns)
+            if current:
+                return SDFIndex.load(index_path)
+
+        with open(source, "rb") as sdf_file:
+            if stat.st_size == 0:
+                index = SDFIndex.build(b"")
+            else:
+                with mmap.mmap(sdf_file.fileno(), 0,
+                               access=mmap.ACCESS_READ) as buffer:
+                    index = SDFIndex.build(buffer)
+
+        if persist:
+            try:
+                index.save(index_path, size=stat.st_size,
+                           mtime=stat.st_mtime_ns)
+            except OSError:
+                pass
+
+        return index
+
+    buffer = _file_buffer(source)
+    key = hashlib.blake2b(buffer).hexdigest()
+
+    if key in _index_cache:
+        _index_cache.move_to_end(key)
+        return _index_cache[key]
+
+    index = SDFIndex.build(buffer)
+    _index_cache[key] = index
+    if len(_index_cache) > INDEX_CACHE_SIZE:
+        _index_cache.popitem(last=False)
+
+    return index
+
+
+def _read_spans(file, spans):
+    records = []
+    for start, end in spans:
+        file.seek(start)
+        record = file.read(end - start)
+
+        # Only the last record of a file may miss its terminator
+        if not record.rstrip().endswith(b"$$$$"):
+            record = record.rstrip(b"\r\n") + b"\n\n$$$$\n"
+        records.append(record)
+
+    return b"".join(records)
+
+
+def _convert_spans(path, spans, out_path, out_format, columns, chunk_size):
+    with open(path, "rb") as sdf_file:
+        data = _read_spans(sdf_file, spans)
+
+    converter = SDFConverter(io.BytesIO(data), chunk_size,
+                             SDFIndex.build(data))
+    if out_format == "parquet":
+        converter.to_parquet(out_path, columns=columns)
+    else:
+        converter.to_csv(out_path, columns=columns)
+
+    return converter.processed, converter.failed
+
+
+def _record(mol):
+    row = {name: mol.GetProp(name) for name in mol.GetPropNames()}
+    row["ID"] = mol.GetProp("_Name") if mol.HasProp("_Name") else ""
+    row["SMILES"] = Chem.MolToSmiles(mol)
+
+    return row
+
+
+class SDFConverter:
+    """Convert an SDF file chunk by chunk with a forward-only supplier.
+
+    Only one chunk of molecules is held in memory at a time, the
+    number of processed and failed molecules is updated while reading.
+    With record indices, only the selected records are read and parsed.
+    """
+
+    def __init__(self, file, chunk_size=10000, index=None):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.processed = 0
+        self.failed = 0
+
+        self.index = index or sdf_index(file)
+        self.n_records = self.index.n_records
+        self.columns = self.index.properties + ["ID", "SMILES"]
+
+    def _selected(self, indices):
+        # Parse batches of selected records only
+        for start in range(0, len(indices), self.chunk_size):
+            spans = self.index.spans(indices[start:start + self.chunk_size])
+            data = io.BytesIO(_read_spans(self.file, spans))
+            yield from Chem.ForwardSDMolSupplier(data)
+
+    def chunks(self, limit=None, columns=None, indices=None):
+        """Read molecules as dataframe chunks
+
+        Args:
+            limit (int, optional): Maximum records read. Defaults to None.
+            columns (list, optional): Selected columns. Defaults to None.
+            indices (list, optional): Records read, in this order.
+                Defaults to None (records in file order).
+
+        Yields:
+            DataFrame: Chunk of molecules
+        """
+        columns = columns or self.columns
+        self.processed = 0
+        self.failed = 0
+        self.file.seek(0)
+
+        if indices is None:
+            supplier = Chem.ForwardSDMolSupplier(self.file)
+        else:
+            supplier = self._selected(indices[:limit])
+        rows = []
+
+        for mol in supplier:
+            if limit is not None and self.processed + self.failed >= limit:
+                break
+
+            if mol is None:
+                self.failed += 1
+                continue
+
+            rows.append(_record(mol))
+            self.processed += 1
+
+            if len(rows) == self.chunk_size:
+                yield pd.DataFrame(rows, columns=columns)
+                rows = []
+
+        if rows:
+            yield pd.DataFrame(rows, columns=columns)
+
+        self.file.seek(0)
+
+    def head(self, n_rows: int, columns=None, indices=None):
+        """Read the first molecules
+
+        Args:
+            n_rows (int): Number of records
+            columns (list, optional): Selected columns. Defaults to None.
+            indices (list, optional): Records read. Defaults to None.
+
+        Returns:
+            DataFrame: First molecules
+        """
+        chunks = list(self.chunks(n_rows, columns, indices))
+        if not chunks:
+            return pd.DataFrame(columns=columns or self.columns)
+
+        return pd.concat(chunks, ignore_index=True)
+
+    def to_csv(self, out_path: str, limit=None, columns=None, callback=None,
+               indices=None):
+        """Convert to CSV incrementally
+
+        Args:
+            out_path (str): Output CSV path
+            limit (int, optional): Maximum records read. Defaults to None.
+            columns (list, optional): Selected columns. Defaults to None.
+            callback (function, optional): Called with (processed, failed)
+                after each chunk. Defaults to None.
+            indices (list, optional): Records read. Defaults to None.
+
+        Returns:
+            str: Output CSV path
+        """
+        columns = columns or self.columns
+
+        with open(out_path, "w", newline="") as out_file:
+            out_file.write(pd.DataFrame(columns=columns).to_csv(index=False))
+
+            for chunk in self.chunks(limit, columns, indices):
+                chunk.to_csv(out_file, header=False, index=False)
+                if callback:
+                    callback(self.processed, self.failed)
+
+        return out_path
+
+    def to_parquet(self, out_path: str, limit=None, columns=None,
+                   callback=None, indices=None):
+        """Convert to Parquet incrementally, one row group per chunk
+
+        Args:
+            out_path (str): Output Parquet path
+            limit (int, optional): Maximum records read. Defaults to None.
+            columns (list, optional): Selected columns. Defaults to None.
+            callback (function, optional): Called with (processed, failed)
+                after each chunk. Defaults to None.
+            indices (list, optional): Records read. Defaults to None.
+
+        Returns:
+            str: Output Parquet path
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = columns or self.columns
+        schema = pa.schema([(column, pa.string()) for column in columns])
+
+        writer = pq.ParquetWriter(out_path, schema)
+        try:
+            for chunk in self.chunks(limit, columns, indices):
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+                writer.write_table(pa.Table.from_pandas(
+                    chunk, schema=schema, preserve_index=False))
+                if callback:
+                    callback(self.processed, self.failed)
+        finally:
+            writer.close()
+
+        return out_path
+
+    def convert_parallel(self, out_path: str, out_format="csv", limit=None,
+                         columns=None, n_jobs=None, callback=None,
+                         indices=None):
+        """Convert in a process pool, one byte range of records per task
+
+        Ranges are taken from the record index, converted concurrently
+        and concatenated in input order.
+
+        Args:
+            out_path (str): Output path
+            out_format (str, optional): "csv" or "parquet".
+                Defaults to "csv".
+            limit (int, optional): Maximum records read. Defaults to None.
+            columns (list, optional): Selected columns. Defaults to None.
+            n_jobs (int, optional): Number of worker processes.
+                Defaults to the number of cores.
+            callback (function, optional): Called with (processed, failed)
+                after each range. Defaults to None.
+            indices (list, optional): Records read. Defaults to None.
+
+        Returns:
+            str: Output path
+        """
+        columns = columns or self.columns
+        n_jobs = n_jobs or os.cpu_count() or 1
+        self.processed = 0
+        self.failed = 0
+
+        # Several ranges per worker to balance uneven records
+        n_parts = n_jobs * 4
+        if indices is None:
+            n_records = self.n_records if limit is None else min(
+                limit, self.n_records)
+            tasks_spans = [[span] for span in
+                           self.index.ranges(n_parts, n_records)]
+        else:
+            selected = np.asarray(indices[:limit], dtype=np.int64)
+            tasks_spans = [self.index.spans(part) for part in
+                           np.array_split(selected, n_parts) if len(part)]
+
+        work_dir = tempfile.mkdtemp()
+        try:
+            sdf_path = os.path.join(work_dir, "input.sdf")
+            self.file.seek(0)
+            with open(sdf_path, "wb") as sdf_file:
+                shutil.copyfileobj(self.file, sdf_file)
+            self.file.seek(0)
+
+            parts = [os.path.join(work_dir, f"part{index}")
+                     for index in range(len(tasks_spans))]
+
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    mp_context=process_context()) as executor:
+                tasks = [executor.submit(_convert_spans, sdf_path, spans,
+                                         part, out_format, columns,
+                                         self.chunk_size)
+                         for spans, part in zip(tasks_spans, parts)]
+
+                for task in as_completed(tasks):
+                    processed, failed = task.result()
+                    self.processed += processed
+                    self.failed += failed
+                    if callback:
+                        callback(self.processed, self.failed)
+
+            if out_format == "parquet":
+                _merge_parquet(parts, out_path)
+            else:
+                _merge_csv(parts, out_path)
+
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return out_path
+
+
+def _merge_csv(parts, out_path):
+    with open(out_path, "wb") as out_file:
+        for index, part in enumerate(parts):
+            with open(part, "rb") as part_file:
+                header = part_file.readline()
+                if index == 0:
+                    out_file.write(header)
+                shutil.copyfileobj(part_file, out_file)
+
+
+def _merge_parquet(parts, out_path):
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for part in parts:
+            table = pq.read_table(part)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
@@ -172,19 +172,19 @@ class Sidebar:
 
             return molecule_column
 
-    def sb_data_limit(dataframe):
+    def sb_data_limit(n_rows: int):
         """Select data number to work with
 
         Args:
-            dataframe (DataFrame): Original dataframe
+            n_rows (int): Number of records
 
         Returns:
             int: selection number
         """
         number = st.sidebar.slider("Compute N data",
                                    min_value=10,
-                                   max_value=dataframe.shape[0],
-                                   value=dataframe.shape[0], step=10)
+                                   max_value=n_rows,
+                                   value=n_rows, step=10)
 
         return number
 
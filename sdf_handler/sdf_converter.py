@@ -1,22 +1,117 @@
+import gzip
+import os
+import shutil
+
+import pandas as pd
 import streamlit as st
-from .core.structure import Sidebar, MainStructure, IO
+from csv_handler.core.metrics import get_metrics_log, run_summary
+from csv_handler.core.workspace import QuotaExceeded, get_workspace
+from .core.structure import Sidebar, MainStructure, generic_download
+from .core.stream import SDFConverter
+
+PREVIEW_ROWS = 100
+
+OUTPUT_FORMATS = {"CSV": (".csv", "text/csv"),
+                  "CSV (gzip)": (".csv.gz", "application/gzip"),
+                  "Parquet": (".parquet", "application/octet-stream")}
+
+
+def _gzip(path):
+    # Compressed block by block next to the CSV file, which is removed
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb",
+                                               compresslevel=6) as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+
+    return path + ".gz"
+
+
+def _export(converter, number, columns, out_format, n_jobs, indices):
+    suffix, mime = OUTPUT_FORMATS[out_format]
+    progress = st.empty()
+
+    def _progress(processed, failed):
+        progress.info(f"Molecules processed: {processed} | "
+                      f"Molecules failed: {failed}")
+
+    workspace = get_workspace()
+    try:
+        workspace.check_quota()
+    except QuotaExceeded as error:
+        st.error(str(error))
+        return
+
+    # Compressed CSV is converted to CSV first
+    file_format = "parquet" if out_format == "Parquet" else "csv"
+    out_path = workspace.mkstemp(f".{file_format}")
+
+    try:
+        with get_metrics_log().measure("sdf_convert", number) as record:
+            if n_jobs > 1:
+                converter.convert_parallel(out_path, file_format, number,
+                                           columns, n_jobs, _progress,
+                                           indices)
+            elif out_format == "Parquet":
+                converter.to_parquet(out_path, number, columns, _progress,
+                                     indices)
+            else:
+                converter.to_csv(out_path, number, columns, _progress,
+                                 indices)
+            record.update(rows_out=converter.processed,
+                          failed=converter.failed, n_jobs=n_jobs)
+        _progress(converter.processed, converter.failed)
+
+        if out_format == "CSV (gzip)":
+            out_path = _gzip(out_path)
+
+        # Streamlit reads the whole file and keeps it in memory to serve
+        # it, the gzip format keeps that copy small
+        with open(out_path, "rb") as out_file:
+            generic_download(out_file, mime, f"dataframe{suffix}",
+                             "Download data", False)
+    finally:
+        os.remove(out_path)
 
 
 def _convert(uploaded_file):
-    dataframe = IO.sb_sdf_read_dataframe(uploaded_file)
+    converter = SDFConverter(uploaded_file)
 
+    if converter.n_records == 0:
+        st.error("Plese check your selected data")
+        return
+
+    columns_df = pd.DataFrame(columns=converter.columns)
     try:
-        columns = Sidebar.sb_columns_selector(dataframe)
+        columns = Sidebar.sb_columns_selector(columns_df)
     except st.errors.StreamlitAPIException:
-        columns = Sidebar.sb_columns_selector(dataframe)
+        columns = Sidebar.sb_columns_selector(columns_df)
+
+    number = Sidebar.sb_data_limit(converter.n_records)
+
+    indices = None
+    if st.sidebar.checkbox("Random sample"):
+        seed = st.sidebar.number_input("Random seed", min_value=0, value=0)
+        indices = converter.index.sample(number, int(seed))
+
+    preview = converter.head(min(number, PREVIEW_ROWS), indices=indices)
+    MainStructure.data_selection_preview(preview, number, columns)
+    st.caption(f"Preview of the first {PREVIEW_ROWS} molecules, "
+               f"{number} will be converted.")
+
+    out_format = st.sidebar.selectbox("Output format",
+                                      list(OUTPUT_FORMATS.keys()))
 
-    number = Sidebar.sb_data_limit(dataframe)
+    n_jobs = 1
+    if st.sidebar.checkbox("Parallel conversion"):
+        n_jobs = st.sidebar.number_input("Worker processes", min_value=2,
+                                         max_value=64,
+                                         value=max(2, os.cpu_count() or 2))
 
-    dataframe = MainStructure.data_selection_preview(dataframe,
-                                                     number,
-                                                     columns)
+    if st.sidebar.button("Convert"):
+        _export(converter, number, columns, out_format, int(n_jobs),
+                indices)
 
-    MainStructure.download_button(dataframe, name="dataframe")
+    run_summary(get_metrics_log(), "converter_summary")
 
 
 def converter():
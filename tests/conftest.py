@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+import pytest
+from rdkit import Chem
+
+FILES = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                     "csv_handler", "core", "files")
+
+CLEANER_EXAMPLE = os.path.join(FILES, "cleaner_example_csv.csv")
+SELECTOR_EXAMPLE = os.path.join(FILES, "selector_example_csv.csv")
+
+THRESHOLD_COLUMNS = ["Standard Value", "Standard Units", "Molecular Weight"]
+
+
+@pytest.fixture
+def cleaner_example():
+    return pd.read_csv(CLEANER_EXAMPLE)
+
+
+@pytest.fixture
+def converted_example(cleaner_example):
+    from csv_handler.core.utils import convert_threshold
+
+    return convert_threshold(cleaner_example, 1.0, "uM", THRESHOLD_COLUMNS)
+
+
+@pytest.fixture(scope="session")
+def example_sdf(tmp_path_factory):
+    # SDF written from the example CSV, one record per parsable SMILES
+    dataframe = pd.read_csv(CLEANER_EXAMPLE).head(300)
+    path = str(tmp_path_factory.mktemp("sdf") / "example.sdf")
+
+    writer = Chem.SDWriter(path)
+    for row in dataframe.itertuples(index=False):
+        mol = Chem.MolFromSmiles(row.Smiles)
+        if mol is None:
+            continue
+        mol.SetProp("_Name", row[0])
+        mol.SetProp("Standard Value", str(row[3]))
+        mol.SetProp("Assay Organism", row[5])
+        writer.write(mol)
+    writer.close()
+
+    return path
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+import batch
+from csv_handler.core.batch import (EXIT_CONFIG, ConfigError,
+                                    validate_config)
+
+from conftest import CLEANER_EXAMPLE
+
+
+@pytest.mark.parametrize("config, message", [
+    ({"stages": "remove_nan"}, "'stages' must be a list"),
+    ({"stages": ["remove_nan"]}, "Stage 0: must be a JSON object"),
+    ({"stages": [{"stage": "remove_nan"}, None]},
+     "Stage 1: must be a JSON object"),
+    ({"fingerprint": ["RDKit"]}, "'fingerprint' must be a JSON object")])
+def test_validate_config_types(config, message):
+    with pytest.raises(ConfigError, match=message):
+        validate_config(dict(config, input=CLEANER_EXAMPLE))
+
+
+def test_batch_invalid_stage_exit_code(tmp_path, capsys):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"input": CLEANER_EXAMPLE,
+                                       "stages": ["remove_nan"]}))
+
+    assert batch.main([str(config_path)]) == EXIT_CONFIG
+    assert json.loads(capsys.readouterr().out)["status"] == "invalid_config"
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from csv_handler.core.chunked import (ROW_COLUMN, process_duplicates_chunked,
+                                      quantiles_chunked,
+                                      remove_outliers_chunked, spill_csv)
+from csv_handler.core.utils import (AGGREGATE_POLICIES, DUPLICATE_POLICIES,
+                                    process_duplicates, remove_outliers)
+
+DUPLICATE_COLUMNS = ["Smiles", "Activity", "Converted Value"]
+
+
+@pytest.fixture
+def spilled(converted_example, tmp_path):
+    path = str(tmp_path / "converted.csv")
+    converted_example.to_csv(path, index=False)
+
+    return spill_csv(path, str(tmp_path / "input"), chunksize=100)
+
+
+def _collect(table):
+    return pd.concat(table.chunks(), ignore_index=True)
+
+
+@pytest.mark.parametrize("policy", list(DUPLICATE_POLICIES.values()))
+@pytest.mark.parametrize("drop_conflicts", [True, False])
+def test_process_duplicates_chunked(spilled, tmp_path, policy,
+                                    drop_conflicts):
+    if policy in AGGREGATE_POLICIES and not drop_conflicts:
+        with pytest.raises(ValueError):
+            process_duplicates_chunked(spilled, str(tmp_path / "output"),
+                                       DUPLICATE_COLUMNS, policy,
+                                       drop_conflicts)
+        return
+
+    expected = process_duplicates(_collect(spilled), DUPLICATE_COLUMNS,
+                                  policy, drop_conflicts)
+
+    # Tiny budget to use several buckets
+    table = process_duplicates_chunked(spilled, str(tmp_path / "output"),
+                                       DUPLICATE_COLUMNS, policy,
+                                       drop_conflicts, budget_mb=0.05)
+    result = _collect(table)
+
+    assert result[ROW_COLUMN].tolist() == expected[ROW_COLUMN].tolist()
+    pd.testing.assert_frame_equal(result, expected.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_process_duplicates_chunked_smiles_only(spilled, tmp_path):
+    expected = process_duplicates(_collect(spilled), ["Smiles"])
+
+    table = process_duplicates_chunked(spilled, str(tmp_path / "output"),
+                                       ["Smiles"], budget_mb=0.05)
+
+    assert (_collect(table)[ROW_COLUMN].tolist() ==
+            expected[ROW_COLUMN].tolist())
+
+
+def test_quantiles_chunked(spilled):
+    values = _collect(spilled)["Converted Value"]
+    quantiles = [0.0, 0.1, 0.25, 0.5, 0.9, 1.0]
+
+    assert quantiles_chunked(spilled, "Converted Value", quantiles) == [
+        pytest.approx(values.quantile(quantile), rel=1e-12)
+        for quantile in quantiles]
+
+
+def test_remove_outliers_chunked(spilled, tmp_path):
+    expected = remove_outliers(_collect(spilled), "Converted Value")
+
+    table = remove_outliers_chunked(spilled, str(tmp_path / "output"),
+                                    "Converted Value")
+
+    assert (_collect(table)[ROW_COLUMN].tolist() ==
+            expected[ROW_COLUMN].tolist())
@@ -0,0 +1,86 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from csv_handler.core.padel import PaDELError, PaDELWorker, padel_arguments
+
+# Stand-in for the JVM speaking the worker protocol: each start is logged,
+# a run writes the -file output, a run on "exit.smi" exits the process
+FAKE_JAVA = """#!{python}
+import os
+import sys
+
+assert sys.argv[-1] == "PaDELWorker", sys.argv
+
+with open({starts!r}, "a") as starts:
+    starts.write(f"{{os.getpid()}}\\n")
+
+print("READY", flush=True)
+for line in sys.stdin:
+    line = line.rstrip("\\n")
+    if line == "PING":
+        print("PONG", flush=True)
+    elif line == "QUIT":
+        break
+    else:
+        arguments = line.split("\\t")
+        if arguments[arguments.index("-dir") + 1].endswith("exit.smi"):
+            sys.exit(0)
+        with open(arguments[arguments.index("-file") + 1], "w") as out:
+            out.write("Name,FP1\\n")
+        print("OK", flush=True)
+"""
+
+
+@pytest.fixture
+def fake_java(tmp_path, monkeypatch):
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    starts = str(tmp_path / "starts.txt")
+
+    java = bin_path / "java"
+    java.write_text(FAKE_JAVA.format(python=sys.executable, starts=starts))
+    java.chmod(java.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_path}{os.pathsep}{os.environ['PATH']}")
+
+    def _starts():
+        with open(starts) as starts_file:
+            return starts_file.read().split()
+
+    return _starts
+
+
+def _arguments(tmp_path, name):
+    return padel_arguments(str(tmp_path / "MACCS.xml"),
+                           str(tmp_path / f"{name}.smi"),
+                           str(tmp_path / f"{name}.csv"))
+
+
+def test_worker_reused(fake_java, tmp_path):
+    worker = PaDELWorker(str(tmp_path))
+    try:
+        worker.run(_arguments(tmp_path, "first"), timeout=30)
+        process = worker.process
+        worker.run(_arguments(tmp_path, "second"), timeout=30)
+
+        assert worker.process is process
+        assert fake_java() == [str(process.pid)]
+        assert (tmp_path / "first.csv").exists()
+        assert (tmp_path / "second.csv").exists()
+    finally:
+        worker.stop()
+
+
+def test_worker_exit_is_an_error(fake_java, tmp_path):
+    worker = PaDELWorker(str(tmp_path))
+    try:
+        with pytest.raises(PaDELError):
+            worker.run(_arguments(tmp_path, "exit"), timeout=30)
+        assert worker.process is None
+
+        worker.run(_arguments(tmp_path, "next"), timeout=30)
+        assert len(fake_java()) == 2
+    finally:
+        worker.stop()
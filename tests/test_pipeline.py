@@ -0,0 +1,22 @@
+import pandas as pd
+
+from csv_handler.core.pipeline import Pipeline
+
+
+def test_pipeline_version(tmp_path):
+    dataframe = pd.DataFrame({"Smiles": ["CCO", "CCN", "CCC"]})
+    path = str(tmp_path / "checkpoint.parquet")
+
+    pipeline = Pipeline(dataframe, path)
+    versions = [pipeline.version]
+    pipeline.checkpoint()
+    assert pipeline.version == versions[-1]
+
+    assert pipeline.update(dataframe.iloc[1:]) == 1
+    versions.append(pipeline.version)
+    pipeline.restore()
+    versions.append(pipeline.version)
+    versions.append(Pipeline(dataframe, path).version)
+
+    assert len(set(versions)) == len(versions)
+    pd.testing.assert_frame_equal(pipeline.dataframe, dataframe)
@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+import pytest
+
+from csv_handler.core.metrics import MetricsLog
+from csv_handler.core.workspace import Workspace
+from sdf_handler import sdf_converter
+from sdf_handler.core.stream import SDFConverter
+
+
+@pytest.fixture
+def downloads(monkeypatch, tmp_path):
+    workspace = Workspace(root=str(tmp_path / "workspaces"))
+    metrics_log = MetricsLog(str(tmp_path / "metrics.jsonl"),
+                             str(tmp_path / "metrics.prom"))
+    monkeypatch.setattr(sdf_converter, "get_workspace", lambda: workspace)
+    monkeypatch.setattr(sdf_converter, "get_metrics_log", lambda: metrics_log)
+
+    # The file is only open during the call
+    calls = []
+    monkeypatch.setattr(sdf_converter, "generic_download",
+                        lambda file, *args: calls.append((file.read(),) +
+                                                         args))
+
+    return calls
+
+
+@pytest.mark.parametrize("out_format", list(sdf_converter.OUTPUT_FORMATS))
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_export(example_sdf, downloads, tmp_path, out_format, n_jobs):
+    with open(example_sdf, "rb") as sdf_file:
+        converter = SDFConverter(io.BytesIO(sdf_file.read()))
+
+    sdf_converter._export(converter, 100, ["ID", "SMILES"], out_format,
+                          n_jobs, None)
+
+    (data, mime, name, _, _), = downloads
+    suffix, expected_mime = sdf_converter.OUTPUT_FORMATS[out_format]
+    assert (mime, name) == (expected_mime, f"dataframe{suffix}")
+
+    if out_format == "Parquet":
+        dataframe = pd.read_parquet(io.BytesIO(data))
+    else:
+        dataframe = pd.read_csv(io.BytesIO(data),
+                                compression="gzip" if "gzip" in out_format
+                                else None)
+    assert dataframe.columns.tolist() == ["ID", "SMILES"]
+    assert len(dataframe) == 100
+
+    # Converted files are removed once served
+    assert not [path for path in (tmp_path / "workspaces").rglob("*")
+                if path.is_file() and path.name != ".last_used"]
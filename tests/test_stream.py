@@ -0,0 +1,94 @@
+import io
+
+import pandas as pd
+import pytest
+from rdkit import Chem
+
+from sdf_handler.core.stream import SDFConverter, SDFIndex
+
+
+@pytest.fixture
+def converter(example_sdf):
+    with open(example_sdf, "rb") as sdf_file:
+        return SDFConverter(io.BytesIO(sdf_file.read()), chunk_size=64)
+
+
+def _n_molecules(path):
+    return sum(1 for _ in Chem.ForwardSDMolSupplier(path))
+
+
+def test_index(example_sdf):
+    with open(example_sdf, "rb") as sdf_file:
+        data = sdf_file.read()
+    index = SDFIndex.build(data)
+
+    assert index.n_records == _n_molecules(example_sdf)
+    assert index.properties == ["Standard Value", "Assay Organism"]
+    assert data[index.offsets[1]:].startswith(b"CHEMBL")
+
+    ranges = index.ranges(7)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == start for (_, end), (start, _) in
+               zip(ranges[:-1], ranges[1:]))
+
+
+def test_index_without_terminator():
+    index = SDFIndex.build(b"a\n$$$$\nb\n")
+
+    assert index.n_records == 2
+    assert index.offsets.tolist() == [0, 7, 9]
+
+
+def test_head(converter):
+    head = converter.head(10)
+
+    assert len(head) == 10
+    assert head.columns.tolist() == ["Standard Value", "Assay Organism",
+                                     "ID", "SMILES"]
+    assert head["ID"].iloc[0] == "CHEMBL3355088"
+
+
+def test_to_csv(converter, example_sdf, tmp_path):
+    out_path = str(tmp_path / "out.csv")
+    calls = []
+    converter.to_csv(out_path, callback=lambda *args: calls.append(args))
+
+    dataframe = pd.read_csv(out_path)
+    assert len(dataframe) == _n_molecules(example_sdf)
+    assert converter.processed == len(dataframe)
+    assert calls[-1] == (converter.processed, converter.failed)
+
+    limited = str(tmp_path / "limited.csv")
+    converter.to_csv(limited, limit=100, columns=["ID", "SMILES"])
+    assert pd.read_csv(limited).equals(dataframe[["ID", "SMILES"]].head(100))
+
+
+def test_to_parquet(converter, tmp_path):
+    csv_path = str(tmp_path / "out.csv")
+    parquet_path = str(tmp_path / "out.parquet")
+    converter.to_csv(csv_path)
+    converter.to_parquet(parquet_path)
+
+    expected = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    result = pd.read_parquet(parquet_path).astype(str)
+    assert result.values.tolist() == expected.values.tolist()
+
+
+@pytest.mark.parametrize("out_format", ["csv", "parquet"])
+def test_convert_parallel(converter, tmp_path, out_format):
+    serial_path = str(tmp_path / f"serial.{out_format}")
+    parallel_path = str(tmp_path / f"parallel.{out_format}")
+
+    if out_format == "csv":
+        converter.to_csv(serial_path, limit=250)
+        read = pd.read_csv
+    else:
+        converter.to_parquet(serial_path, limit=250)
+        read = pd.read_parquet
+    processed = converter.processed
+
+    converter.convert_parallel(parallel_path, out_format, limit=250,
+                               n_jobs=2)
+
+    assert converter.processed == processed
+    assert read(parallel_path).equals(read(serial_path))
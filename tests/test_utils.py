@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from csv_handler.core import utils
+from csv_handler.core.cache import SmilesCache
+from csv_handler.core.utils import (AGGREGATE_POLICIES, DUPLICATE_POLICIES,
+                                    MASS_UNITS, MOLAR_UNITS,
+                                    cached_standardize_smiles,
+                                    convert_threshold, filter_elements,
+                                    process_duplicates, standardize_smiles)
+
+from conftest import THRESHOLD_COLUMNS
+
+DUPLICATE_COLUMNS = ["Smiles", "Activity", "Converted Value"]
+
+
+def test_convert_threshold_units(cleaner_example):
+    converted = convert_threshold(cleaner_example, 1.0, "uM",
+                                  THRESHOLD_COLUMNS)
+
+    supported = cleaner_example["Standard Units"].isin(
+        list(MOLAR_UNITS) + list(MASS_UNITS))
+    assert len(converted) == supported.sum()
+    assert (converted["Converted Units"] == "uM").all()
+
+    nanomolar = converted[converted["Standard Units"] == "nM"]
+    np.testing.assert_allclose(nanomolar["Converted Value"],
+                               nanomolar["Standard Value"] * 1e-3)
+
+    mass = converted[converted["Standard Units"] == "ug.mL-1"]
+    np.testing.assert_allclose(
+        mass["Converted Value"],
+        mass["Standard Value"] / mass["Molecular Weight"] * 1e3)
+
+
+def test_convert_threshold_activity():
+    dataframe = pd.DataFrame({"Standard Value": [10.0, 1000.0, 1.0],
+                              "Standard Units": ["nM", "nM", "mM"],
+                              "Molecular Weight": [300.0, 300.0, 300.0]})
+
+    converted = convert_threshold(dataframe, 100.0, "nM", THRESHOLD_COLUMNS)
+    assert converted["Activity"].tolist() == ["Active", "Inactive",
+                                              "Inactive"]
+
+    # -log10(M), actives are above the threshold
+    converted = convert_threshold(dataframe, 7.0, "-log", THRESHOLD_COLUMNS)
+    np.testing.assert_allclose(converted["Converted Value"], [8.0, 6.0, 3.0])
+    assert converted["Activity"].tolist() == ["Active", "Inactive",
+                                              "Inactive"]
+
+
+@pytest.fixture
+def replicates():
+    return pd.DataFrame({
+        "Smiles": ["CCO", "CCO", "CCO", "CCN", "CCN", "CCC"],
+        "Activity": ["Active", "Active", "Active", "Active", "Inactive",
+                     "Inactive"],
+        "Converted Value": [1.0, 4.0, 16.0, 2.0, 50.0, 80.0]})
+
+
+@pytest.mark.parametrize("policy, value, kept", [
+    ("max", 16.0, 2), ("min", 1.0, 0), ("median", 4.0, 1),
+    ("geomean", 4.0, 1)])
+def test_process_duplicates_policy(replicates, policy, value, kept):
+    processed = process_duplicates(replicates, DUPLICATE_COLUMNS, policy)
+
+    assert processed["Smiles"].tolist() == ["CCO", "CCC"]
+    assert processed.index[0] == kept
+    assert processed["Converted Value"].iloc[0] == pytest.approx(value)
+    assert processed["Replicates"].tolist() == [3, 1]
+
+
+def test_process_duplicates_policies_supported(converted_example):
+    consistent = set(process_duplicates(converted_example,
+                                        DUPLICATE_COLUMNS)["Smiles"])
+
+    for policy in DUPLICATE_POLICIES.values():
+        drop_conflicts = policy in AGGREGATE_POLICIES
+        processed = process_duplicates(converted_example, DUPLICATE_COLUMNS,
+                                       policy, drop_conflicts)
+
+        assert processed["Smiles"].is_unique
+        assert set(processed["Smiles"]) == (
+            consistent if drop_conflicts
+            else set(converted_example["Smiles"]))
+
+
+def test_process_duplicates_conflicts(replicates):
+    processed = process_duplicates(replicates, DUPLICATE_COLUMNS,
+                                   drop_conflicts=False)
+
+    assert processed["Smiles"].tolist() == ["CCO", "CCN", "CCC"]
+    assert processed.loc[processed["Smiles"] == "CCN",
+                         "Converted Value"].item() == 50.0
+
+
+@pytest.mark.parametrize("policy", AGGREGATE_POLICIES)
+def test_process_duplicates_aggregate_conflicts(replicates, policy):
+    # CCN is Active at 2 and Inactive at 50, its aggregate has no label
+    with pytest.raises(ValueError):
+        process_duplicates(replicates, DUPLICATE_COLUMNS, policy,
+                           drop_conflicts=False)
+
+    processed = process_duplicates(replicates, DUPLICATE_COLUMNS, policy)
+    assert "CCN" not in processed["Smiles"].tolist()
+
+
+def test_process_duplicates_smiles_only(replicates):
+    processed = process_duplicates(replicates, ["Smiles"])
+
+    assert processed.index.tolist() == [0, 3, 5]
+
+
+def test_filter_elements():
+    smiles = ["CCO", "c1ccccc1Cl", "C[Si](C)(C)C", "[Na+].[Cl-]",
+              "[NH4+]", "CC[Se]C", "OB(O)O", "[nH]1cccc1"]
+
+    flags = filter_elements(smiles)
+
+    assert flags.tolist() == [True, True, False, False, True, False, False,
+                              True]
+
+
+def test_filter_elements_allowed(cleaner_example):
+    smiles = cleaner_example["Smiles"].head(200)
+
+    default = filter_elements(smiles)
+    parallel = filter_elements(smiles, n_jobs=2, chunk_size=50)
+    assert default.tolist() == parallel.tolist()
+
+    organic = filter_elements(smiles, allowed=("C", "H", "N", "O"))
+    assert not (organic & ~default).any()
+    assert filter_elements(["CCS"], allowed=("C", "S")).tolist() == [True]
+
+
+@pytest.fixture
+def supervised(monkeypatch):
+    # Forked workers inherit the patched _standardize
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork start method not available")
+    monkeypatch.setattr(utils, "process_context",
+                        lambda: multiprocessing.get_context("fork"))
+
+    def _standardize(smiles):
+        if smiles == "slow":
+            time.sleep(30)
+        elif smiles == "crash":
+            os._exit(1)
+        return smiles.upper()
+
+    monkeypatch.setattr(utils, "_standardize", _standardize)
+
+
+def test_standardize_timeout(supervised):
+    start = time.monotonic()
+    std_smiles = standardize_smiles(["cco", "slow", "ccn", "ccc"],
+                                    timeout=0.5, chunk_size=4)
+
+    assert std_smiles == ["CCO", "remove", "CCN", "CCC"]
+    assert time.monotonic() - start < 10
+
+
+def test_standardize_worker_restarted(supervised):
+    worker = utils._StandardizeWorker(multiprocessing.get_context("fork"),
+                                      timeout=5)
+    try:
+        assert worker.run(["cco"]) == ["CCO"]
+        process = worker.process
+
+        assert worker.run(["crash", "ccn"]) == [utils._TIMED_OUT, "CCN"]
+        assert not process.is_alive()
+        assert worker.process is not process
+        assert worker.process.is_alive()
+    finally:
+        worker.close()
+        worker.stop()
+
+
+def test_standardize_parallel_crash(supervised):
+    std_smiles = standardize_smiles(["cco", "crash", "ccn", "crash", "ccc"],
+                                    n_jobs=2, timeout=5, chunk_size=2)
+
+    assert std_smiles == ["CCO", "remove", "CCN", "remove", "CCC"]
+
+
+def test_cached_standardize_timeout(supervised, tmp_path):
+    with SmilesCache(str(tmp_path / "cache.sqlite"), "test") as cache:
+        std_smiles = cached_standardize_smiles(["cco", "slow"], cache,
+                                               timeout=0.5)
+
+        assert std_smiles == ["CCO", "remove"]
+        assert cache.get_many(["cco", "slow"]) == {"cco": "CCO"}